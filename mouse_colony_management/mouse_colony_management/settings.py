@@ -52,9 +52,26 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'website.routers.ReplicaRoutingMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'website.metrics.MetricsMiddleware',
 ]
 
+# Request metrics served at /ops/metrics (see website.metrics)
+METRICS_BUFFER_SIZE = env.int('METRICS_BUFFER_SIZE', default=1000)
+METRICS_TOKEN = env('METRICS_TOKEN', default='')
+
+# Bench devices posting health readings to /health/observations/ present this token (see website.health)
+HEALTH_DEVICE_TOKEN = env('HEALTH_DEVICE_TOKEN', default='')
+
+# Search index backend: 'fts5' (SQLite), 'terms' (any database) or 'auto' (see website.search)
+SEARCH_BACKEND = env('SEARCH_BACKEND', default='auto')
+
+# Thresholds of the colony maintenance sweeps run by `manage.py run_maintenance` (see website.maintenance)
+WEANING_AGE_DAYS = env.int('WEANING_AGE_DAYS', default=21)
+MAX_BREEDING_DAYS = env.int('MAX_BREEDING_DAYS', default=270)
+APPROVED_REQUEST_EXPIRY_DAYS = env.int('APPROVED_REQUEST_EXPIRY_DAYS', default=14)
+
 # Redirect to login page if not authenticated
 LOGIN_URL = '/login/'
 
@@ -85,17 +102,42 @@ WSGI_APPLICATION = 'mouse_colony_management.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': env('DB_NAME'),
-        'USER': env('DB_USER'),
-        'PASSWORD': env('DB_PASSWORD'),
-        'HOST': env('DB_HOST'),
-        'PORT': env('DB_PORT'),
+# DB_ENGINE=sqlite runs against a local file instead, e.g. for benchmarks
+if env('DB_ENGINE', default='mysql') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': env('DB_NAME'),
+            'USER': env('DB_USER'),
+            'PASSWORD': env('DB_PASSWORD'),
+            'HOST': env('DB_HOST'),
+            'PORT': env('DB_PORT'),
+        }
     }
-}
 
+# Read replicas of the default database, given as hosts (MySQL) or database files
+# (SQLite), e.g. DB_REPLICAS=db-replica-1,db-replica-2. Only code wrapped in
+# website.routers.replica_reads() reads from them; REPLICA_READS=off keeps the
+# aliases but sends every read to the primary.
+REPLICA_DATABASES = []
+for number, replica in enumerate(env.list('DB_REPLICAS', default=[]), start=1):
+    location = 'NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3') else 'HOST'
+    # Tests read the replicas from the test copy of the primary
+    DATABASES[f'replica_{number}'] = dict(DATABASES['default'], **{location: replica}, TEST={'MIRROR': 'default'})
+    REPLICA_DATABASES.append(f'replica_{number}')
+if not env.bool('REPLICA_READS', default=True):
+    REPLICA_DATABASES = []
+DATABASE_ROUTERS = ['website.routers.PrimaryReplicaRouter']
+# Seconds a client reads from the primary after writing, and the most a replica may trail it
+REPLICA_STICKY_SECONDS = env.int('REPLICA_STICKY_SECONDS', default=10)
+REPLICA_MAX_LAG_SECONDS = env.int('REPLICA_MAX_LAG_SECONDS', default=5)
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -0,0 +1,8 @@
+"""Settings for the test suite, e.g. ``python manage.py test --settings=mouse_colony_management.test_settings``.
+
+Adds ``replica_test``, an SQLite database that nothing copies rows to, so the
+router tests can tell reads served by a replica from reads served by the primary.
+"""
+from .settings import *
+
+DATABASES['replica_test'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
@@ -1,7 +1,12 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.models import User as DefaultUser
 from django.contrib.auth.admin import UserAdmin as DefaultUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from .models import *
+from .breeding import predict_requests
+from .bulk_requests import process_requests
 
 # Register your custom User model with the default UserAdmin options
 @admin.register(User)
@@ -12,13 +17,218 @@ class CustomUserAdmin(DefaultUserAdmin):
     )
 
 # admin.site.register(Role)
-admin.site.register(Cage)
 # admin.site.register(User)
 admin.site.register(Team)
-admin.site.register(TeamMembership)
-admin.site.register(Mouse)
-admin.site.register(Request)
-admin.site.register(Breed)
 admin.site.register(Strain)
-admin.site.register(Genotype)
-admin.site.register(Phenotype)
\ No newline at end of file
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that reads the row count of an unfiltered large table from the
+    database's statistics instead of running COUNT(*) over it.
+
+    Falls back to an exact count for filtered querysets, small tables and
+    backends without cheap statistics (e.g. SQLite).
+    """
+    ESTIMATE_FROM = 100000
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate >= self.ESTIMATE_FROM:
+            return estimate
+        return super().count
+
+
+def estimated_count(queryset):
+    if queryset.query.where or queryset.query.distinct:
+        return None
+    table = queryset.model._meta.db_table
+    connection = connections[queryset.db]
+    if connection.vendor == 'mysql':
+        sql = "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+    elif connection.vendor == 'postgresql':
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE relname = %s"
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables that grow with the colony."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(CageType)
+class CageTypeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'capacity')
+
+
+@admin.register(Cage)
+class CageAdmin(admin.ModelAdmin):
+    list_display = ('cage_number', 'cage_type', 'location', 'occupancy', 'capacity')
+    list_filter = ('location', 'cage_type', 'team')
+    search_fields = ('cage_number',)
+
+
+@admin.register(TeamMembership)
+class TeamMembershipAdmin(admin.ModelAdmin):
+    list_display = ('user', 'team')
+    list_select_related = ('user', 'team')
+    list_filter = ('team',)
+    autocomplete_fields = ('user',)
+
+
+@admin.register(Mouse)
+class MouseAdmin(LargeTableAdmin):
+    list_display = ('mouse_id', 'strain', 'tube_id', 'sex', 'state', 'dob', 'cage', 'mouse_keeper')
+    list_select_related = ('strain', 'cage', 'mouse_keeper')
+    list_filter = ('state', 'sex', 'strain', 'team')
+    search_fields = ('=mouse_id', '=tube_id')
+    autocomplete_fields = ('father', 'mother', 'cage')
+    raw_id_fields = ('mouse_keeper',)
+
+    def get_search_results(self, request, queryset, search_term):
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        # Autocomplete labels show the strain
+        return queryset.select_related('strain'), may_have_duplicates
+
+
+@admin.register(Breed)
+class BreedAdmin(LargeTableAdmin):
+    list_display = ('breed_id', 'male', 'female', 'cage', 'start_date', 'end_date')
+    list_select_related = ('male__strain', 'female__strain', 'cage')
+    list_filter = (('end_date', admin.EmptyFieldListFilter),)
+    autocomplete_fields = ('male', 'female', 'cage')
+
+
+@admin.register(Litter)
+class LitterAdmin(LargeTableAdmin):
+    list_display = ('litter_id', 'father', 'mother', 'strain', 'birth_date', 'born', 'wean_date', 'weaned')
+    list_select_related = ('father__strain', 'mother__strain', 'strain')
+    list_filter = ('strain', ('wean_date', admin.EmptyFieldListFilter))
+    autocomplete_fields = ('father', 'mother')
+    raw_id_fields = ('breed',)
+    date_hierarchy = 'birth_date'
+
+
+@admin.register(MouseEvent)
+class MouseEventAdmin(LargeTableAdmin):
+    """Read-only: the event log is append-only."""
+    list_display = ('mouse_id', 'at', 'changed', 'state', 'cage_id', 'keeper_id')
+    list_filter = ('state',)
+    search_fields = ('=mouse_id',)
+    date_hierarchy = 'at'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ColonySnapshot)
+class ColonySnapshotAdmin(admin.ModelAdmin):
+    list_display = ('taken_at', 'mice')
+    exclude = ('data',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(HealthObservation)
+class HealthObservationAdmin(LargeTableAdmin):
+    list_display = ('mouse_id', 'metric', 'value', 'observed_at', 'cage_id', 'device')
+    list_filter = ('metric',)
+    search_fields = ('=mouse_id', 'device')
+    date_hierarchy = 'observed_at'
+    raw_id_fields = ('mouse', 'recorded_by')
+    readonly_fields = ('cage_id', 'strain_id')
+
+
+@admin.register(HealthRollup)
+class HealthRollupAdmin(LargeTableAdmin):
+    """Read-only: rollups are derived from the observations."""
+    list_display = ('scope', 'scope_id', 'metric', 'period', 'period_start', 'count', 'mean', 'minimum', 'maximum')
+    list_filter = ('scope', 'metric', 'period')
+    search_fields = ('=scope_id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MaintenanceJob)
+class MaintenanceJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'enabled', 'interval', 'next_run_at', 'last_finished_at', 'last_result', 'failures', 'locked_by')
+    readonly_fields = ('locked_by', 'locked_until', 'last_started_at', 'last_finished_at', 'last_result', 'failures')
+
+
+@admin.register(Gene)
+class GeneAdmin(admin.ModelAdmin):
+    search_fields = ('name',)
+
+
+@admin.register(Allele)
+class AlleleAdmin(admin.ModelAdmin):
+    list_display = ('gene', 'symbol')
+    list_select_related = ('gene',)
+    list_filter = ('gene',)
+
+
+@admin.register(Genotype)
+class GenotypeAdmin(LargeTableAdmin):
+    list_display = ('mouse', 'gene', 'allele_1', 'allele_2', 'zygosity', 'test_date')
+    list_select_related = ('mouse__strain',)
+    list_filter = ('gene', 'zygosity')
+    autocomplete_fields = ('mouse',)
+
+
+@admin.register(Phenotype)
+class PhenotypeAdmin(LargeTableAdmin):
+    list_display = ('mouse', 'characteristic', 'description', 'observation_date')
+    list_select_related = ('mouse__strain',)
+    list_filter = ('characteristic',)
+    autocomplete_fields = ('mouse',)
+
+
+def _bulk_request_action(action, description):
+    def run(modeladmin, request, queryset):
+        report = process_requests(queryset.values_list('pk', flat=True), action)
+        modeladmin.message_user(request, f"Requests {report}.", messages.SUCCESS if report.done else messages.WARNING)
+        for request_id, message in report.errors:
+            modeladmin.message_user(request, f"Request {request_id}: {message}", messages.ERROR)
+    run.__name__ = f'{action}_requests'
+    run.short_description = description
+    return run
+
+
+@admin.register(Request)
+class RequestAdmin(LargeTableAdmin):
+    list_display = ('request_id', 'request_type', 'status', 'mouse', 'second_mouse', 'cage', 'requester', 'submitted_at')
+    list_select_related = ('mouse__strain', 'second_mouse__strain', 'cage', 'requester')
+    list_filter = ('status', 'request_type', 'team')
+    autocomplete_fields = ('mouse', 'second_mouse', 'cage', 'requester')
+    readonly_fields = ('inbreeding_coefficient', 'predicted_offspring')
+    actions = [
+        _bulk_request_action('approve', "Approve selected requests"),
+        _bulk_request_action('reject', "Reject selected requests"),
+        _bulk_request_action('complete', "Complete selected requests"),
+    ]
+
+    @admin.display(description="Predicted offspring")
+    def predicted_offspring(self, obj):
+        prediction = predict_requests([obj]).get(obj.pk) if obj.pk else None
+        return str(prediction or '') or '-'
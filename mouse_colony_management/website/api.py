@@ -0,0 +1,171 @@
+"""Async JSON read API for scanners and bench tablets.
+
+The views are coroutines and use Django's async ORM (``afirst``, ``acount``,
+``async for``), so under ASGI a request waiting on the database holds no
+worker thread. Queries that do not depend on each other are started together
+with ``asyncio.gather``, e.g. a mouse's genotypes, phenotypes and offspring
+count, or a lineage's ancestors and descendants. Pedigree traversals, which
+work on cached NumPy snapshots, run through ``sync_to_async``. Django still
+executes each request's queries one at a time on its sync thread, so the
+gain is in not tying up workers while waiting, not in parallel SQL.
+
+Listings are keyset-paginated (``?cursor=<last id>``); every endpoint needs a
+logged-in user and only shows the rows of their teams (see website.teams).
+All reads may be served by a read replica (see website.routers).
+"""
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import Http404, JsonResponse
+
+from .models import Breed, Cage, Genotype, Mouse, Phenotype, Request
+from .pedigree import MAX_TREE_LISTING
+from .routers import replica_reads
+from .teams import request_scope
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_LINEAGE_DEPTH = 10
+MOUSE_FIELDS = ('mouse_id', 'strain__name', 'tube_id', 'dob', 'sex', 'state', 'father_id', 'mother_id', 'cage_id', 'earmark')
+
+
+def api_view(view):
+    """Reject anonymous requests with 401, set ``request.team_scope``, read from a replica and turn Http404/ValueError into JSON errors."""
+    @functools.wraps(view)
+    async def wrapped(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return JsonResponse({'error': "Authentication required."}, status=401)
+        # Reads the session, which has no async API yet
+        request.team_scope = await sync_to_async(request_scope)(request)
+        try:
+            with replica_reads():
+                return await view(request, *args, **kwargs)
+        except Http404 as error:
+            return JsonResponse({'error': str(error) or "Not found."}, status=404)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+    return wrapped
+
+
+def _int_param(request, name, default=None, low=None, high=None):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be a whole number.")
+    if low is not None:
+        value = max(value, low)
+    return value if high is None else min(value, high)
+
+
+async def _rows(queryset):
+    return [row async for row in queryset]
+
+
+async def _page(request, queryset, fields):
+    """One keyset page of ``queryset`` as ``{'results': [...], 'next_cursor': id or None}``."""
+    key = queryset.model._meta.pk.name
+    cursor = _int_param(request, 'cursor')
+    limit = _int_param(request, 'limit', PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    if cursor is not None:
+        queryset = queryset.filter(pk__gt=cursor)
+    # One extra row tells whether another page follows
+    rows = await _rows(queryset.order_by(key).values(*fields)[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {'results': rows, 'next_cursor': rows[-1][key] if more else None}
+
+
+async def _mouse_row(mouse_id, scope):
+    row = await Mouse.objects.visible_to(scope).filter(pk=mouse_id).values(*MOUSE_FIELDS).afirst()
+    if row is None:
+        raise Http404(f"No mouse {mouse_id}.")
+    return row
+
+
+# A mouse with its genotypes, phenotypes, cage and offspring count
+@api_view
+async def mouse_detail(request, mouse_id):
+    mouse, genotypes, phenotypes, offspring = await asyncio.gather(
+        _mouse_row(mouse_id, request.team_scope),
+        _rows(Genotype.objects.filter(mouse_id=mouse_id).order_by('gene', 'test_date').values('gene', 'allele_1', 'allele_2', 'zygosity', 'test_date')),
+        _rows(Phenotype.objects.filter(mouse_id=mouse_id).order_by('characteristic').values('characteristic', 'description', 'observation_date')),
+        Mouse.objects.filter(Q(father_id=mouse_id) | Q(mother_id=mouse_id)).acount(),
+    )
+    cage = None
+    if mouse['cage_id']:
+        cage = await Cage.objects.filter(pk=mouse['cage_id']).values('cage_id', 'cage_number', 'location', 'occupancy', 'capacity').afirst()
+    return JsonResponse(dict(mouse, genotypes=genotypes, phenotypes=phenotypes, offspring=offspring, cage=cage))
+
+
+def _generation_rows(mice, scope):
+    return [
+        {'mouse_id': mouse.mouse_id, 'strain': mouse.strain.name, 'tube_id': mouse.tube_id, 'sex': mouse.sex, 'state': mouse.state, 'generation': mouse.generation}
+        for mouse in mice if scope.includes(mouse.team_id)
+    ]
+
+
+# Ancestors and descendants of a mouse, e.g. ?depth=3
+@api_view
+async def mouse_lineage(request, mouse_id):
+    depth = _int_param(request, 'depth', 3, 1, MAX_LINEAGE_DEPTH)
+    mouse = await Mouse.objects.visible_to(request.team_scope).filter(pk=mouse_id).only('mouse_id', 'strain_id').afirst()
+    if mouse is None:
+        raise Http404(f"No mouse {mouse_id}.")
+    ancestors, descendants = await asyncio.gather(
+        sync_to_async(mouse.get_ancestors)(max_depth=depth, limit=MAX_TREE_LISTING),
+        sync_to_async(mouse.get_descendants)(max_depth=depth, limit=MAX_TREE_LISTING),
+    )
+    return JsonResponse({
+        'mouse_id': mouse.mouse_id,
+        'depth': depth,
+        'ancestors': _generation_rows(ancestors, request.team_scope),
+        'descendants': _generation_rows(descendants, request.team_scope),
+    })
+
+
+# Cages with their occupancy, e.g. ?location=Room 01&available=1
+@api_view
+async def cage_list(request):
+    cages = Cage.objects.visible_to(request.team_scope)
+    if request.GET.get('location'):
+        cages = cages.filter(location=request.GET['location'])
+    if request.GET.get('available'):
+        cages = cages.with_space(1)
+    return JsonResponse(await _page(request, cages, ('cage_id', 'cage_number', 'cage_type', 'location', 'occupancy', 'capacity')))
+
+
+# A cage's occupants and active breeding pair
+@api_view
+async def cage_detail(request, cage_id):
+    cage, mice, breed = await asyncio.gather(
+        Cage.objects.visible_to(request.team_scope).filter(pk=cage_id).values('cage_id', 'cage_number', 'cage_type', 'location', 'occupancy', 'capacity').afirst(),
+        _rows(Mouse.objects.visible_to(request.team_scope).filter(cage_id=cage_id).order_by('pk').values('mouse_id', 'tube_id', 'sex', 'state', 'strain__name')),
+        Breed.objects.filter(cage_id=cage_id, end_date__isnull=True).values('breed_id', 'male_id', 'female_id', 'start_date').afirst(),
+    )
+    if cage is None:
+        raise Http404(f"No cage {cage_id}.")
+    return JsonResponse(dict(cage, mice=mice, active_breed=breed))
+
+
+# Requests, newest id last, e.g. ?status=pending&type=breed&cursor=120
+@api_view
+async def request_list(request):
+    requests = Request.objects.visible_to(request.team_scope)
+    status, request_type = request.GET.get('status'), request.GET.get('type')
+    if status:
+        if status not in dict(Request.STATUS_CHOICES):
+            raise ValueError(f"Unknown status '{status}'.")
+        requests = requests.filter(status=status)
+    if request_type:
+        if request_type not in dict(Request.REQUEST_TYPES):
+            raise ValueError(f"Unknown request type '{request_type}'.")
+        requests = requests.filter(request_type=request_type)
+    fields = ('request_id', 'request_type', 'status', 'mouse_id', 'second_mouse_id', 'cage_id', 'requester__username', 'submitted_at', 'updated_at')
+    page, total = await asyncio.gather(_page(request, requests, fields), requests.acount())
+    return JsonResponse(dict(page, total=total))
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class WebsiteConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'website'
+
+    def ready(self):
+        # Connect the signal handlers that keep derived tables in sync
+        from . import cages, genetics, health, history, lineage, litters, rollups, search, snapshots, teams
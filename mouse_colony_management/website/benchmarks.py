@@ -0,0 +1,238 @@
+"""Timings and query plans for the colony's hot lookups and code paths.
+
+Each entry of ``HOT_QUERIES`` builds a queryset for one of the filters that
+dominate the slow query log. ``benchmark_queries`` records the database's
+plan (``QuerySet.explain()``) and the best and median wall time over a few
+runs of each, so index changes can be compared on the same dataset.
+
+``HOT_PATHS`` are the model methods, views and screens that grow with the colony.
+``benchmark_paths`` generates a synthetic colony at each requested scale and
+records, per path, the wall time of a cold run (caches cleared) and the
+median of warm runs, the queries of the cold run and its peak Python memory.
+Every run happens inside a transaction that is rolled back, so paths that
+write (``Request.complete``) see the same colony each time. ``compare``
+checks results against a stored baseline.
+"""
+import datetime as dt
+import json
+import statistics
+import time
+import tracemalloc
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from . import genetics, kinship, snapshots
+from .breeding import rank_pairs, recommend_pairs
+from .models import Breed, Cage, Genotype, Mouse, Request, User
+from .search import search
+from .synthetic import generate_colony
+from .teams import TeamScope
+
+
+def _sample(model, field='pk'):
+    """A value from the middle of ``model``'s ``field``, so lookups hit real rows."""
+    bounds = model.objects.aggregate(low=Min(field), high=Max(field))
+    if bounds['low'] is None:
+        return None
+    return model.objects.filter(**{f'{field}__gte': (bounds['low'] + bounds['high']) // 2}).order_by(field).values_list(field, flat=True).first()
+
+
+HOT_QUERIES = {
+    'mice_by_state_and_sex': lambda: Mouse.objects.filter(state='breeding', sex='F'),
+    'mice_by_strain_and_state': lambda: Mouse.objects.filter(strain_id=_sample(Mouse, 'strain_id'), state='alive'),
+    'mice_by_keeper': lambda: Mouse.objects.filter(mouse_keeper_id=_sample(User), state='alive'),
+    'pending_requests': lambda: Request.objects.filter(status='pending').order_by('-submitted_at')[:50],
+    'requests_by_status_and_type': lambda: Request.objects.filter(status='approved', request_type='breed'),
+    'active_breeds': lambda: Breed.objects.filter(end_date__isnull=True),
+    'active_breeds_in_cage': lambda: Breed.objects.filter(cage_id=_sample(Cage), end_date__isnull=True),
+    'genotype_of_mouse': lambda: Genotype.objects.filter(mouse_id=_sample(Mouse), gene='Apoe'),
+}
+
+
+class QueryTiming:
+    def __init__(self, name, rows, timings, plan):
+        self.name = name
+        self.rows = rows
+        self.best_ms = min(timings) * 1000
+        self.median_ms = statistics.median(timings) * 1000
+        self.plan = plan
+
+    def as_dict(self):
+        return {'name': self.name, 'rows': self.rows, 'best_ms': self.best_ms, 'median_ms': self.median_ms, 'plan': self.plan}
+
+
+def benchmark_queries(names=None, repeat=5):
+    """Return a QueryTiming for each hot query (all of them by default)."""
+    results = []
+    for name in names or HOT_QUERIES:
+        queryset = HOT_QUERIES[name]()
+        plan = queryset.explain()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = len(list(queryset.all().values_list('pk', flat=True)))
+            timings.append(time.perf_counter() - started)
+        results.append(QueryTiming(name, rows, timings, plan))
+    return results
+
+
+def _ancestors(summary):
+    mouse = Mouse.objects.get(pk=summary.youngest[0])
+    return lambda: mouse.get_ancestors()
+
+
+def _descendants(summary):
+    mouse = Mouse.objects.get(pk=summary.founders[0])
+    return lambda: mouse.get_descendants()
+
+
+def _complete(summary):
+    alive = Mouse.objects.filter(strain_id=Mouse.objects.get(pk=summary.youngest[0]).strain_id, state='alive')
+    male, female = alive.filter(sex='M').last(), alive.filter(sex='F').last()
+    cage = Cage.objects.filter(occupancy=0).first() or Cage.objects.create(cage_number='bench', cage_type='Breeding', location='Bench')
+    request = Request.objects.create(requester=User.objects.first(), mouse=male, second_mouse=female, cage=cage, request_type='breed', status='approved')
+    return lambda: Request.objects.get(pk=request.pk).complete()
+
+
+def _genetic_tree(summary):
+    from .views import genetic_tree
+    mouse_id = summary.youngest[0]
+    request = RequestFactory().get(f'/genetic-tree/{mouse_id}/', {'depth': 4})
+    request.user, request.session = AnonymousUser(), {}
+    return lambda: genetic_tree(request, mouse_id)
+
+
+def _rank_pairs(summary):
+    # A leader screening 200 candidate males against 50 females
+    alive = Mouse.objects.filter(state='alive').order_by('-pk')
+    males = list(alive.filter(sex='M').values_list('pk', flat=True)[:200])
+    females = list(alive.filter(sex='F').values_list('pk', flat=True)[:50])
+    return lambda: rank_pairs(males, females, {'Apoe': 'homozygous'}, limit=20)
+
+
+def _recommend_pairs(summary):
+    youngest = Mouse.objects.get(pk=summary.youngest[0])
+    # Synthetic colonies are dated in the past; judge ages as of just after the last litter
+    today = Mouse.objects.filter(strain_id=youngest.strain_id).aggregate(last=Max('dob'))['last'] + dt.timedelta(days=60)
+    return lambda: recommend_pairs(youngest.strain_id, {'Apoe': 'homozygous'}, today=today)
+
+
+def _search(summary):
+    # A typeahead query: a phenotype word and the start of another
+    everyone = TeamScope((), sees_everything=True)
+    return lambda: search('coat bla', everyone)
+
+
+# name -> function of a ColonySummary returning the callable to measure
+HOT_PATHS = {
+    'get_ancestors': _ancestors,
+    'get_descendants': _descendants,
+    'request_complete': _complete,
+    'genetic_tree_view': _genetic_tree,
+    'rank_pairs': _rank_pairs,
+    'recommend_pairs': _recommend_pairs,
+    'search': _search,
+}
+
+
+class PathTiming:
+    def __init__(self, name, scale, cold_ms, warm_ms, queries, peak_kib):
+        self.name = name
+        self.scale = scale
+        self.cold_ms = cold_ms
+        self.warm_ms = warm_ms
+        self.queries = queries
+        self.peak_kib = peak_kib
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        return (
+            f"{self.name} @ {self.scale}: cold {self.cold_ms:.1f} ms, warm {self.warm_ms:.1f} ms, "
+            f"{self.queries} queries, peak {self.peak_kib:.0f} KiB"
+        )
+
+
+def _clear_caches():
+    snapshots._local.clear()
+    genetics._local.clear()
+    kinship._pedigrees.clear()
+    cache.clear()
+
+
+def _rolled_back(run):
+    with transaction.atomic():
+        run()
+        transaction.set_rollback(True)
+
+
+def _measure(name, scale, run, repeat):
+    _clear_caches()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        _rolled_back(run)
+        cold = time.perf_counter() - started
+
+    warm = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        _rolled_back(run)
+        warm.append(time.perf_counter() - started)
+
+    _clear_caches()
+    tracemalloc.start()
+    try:
+        _rolled_back(run)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return PathTiming(name, scale, cold * 1000, statistics.median(warm) * 1000 if warm else cold * 1000, len(queries), peak / 1024)
+
+
+def benchmark_paths(scales, names=None, repeat=3, seed=0):
+    """Return a PathTiming for each hot path at each scale (number of mice)."""
+    results = []
+    for scale in scales:
+        with transaction.atomic():
+            summary = generate_colony(scale, strains=max(1, scale // 5000), seed=seed)
+            for name in names or HOT_PATHS:
+                results.append(_measure(name, scale, HOT_PATHS[name](summary), repeat))
+            transaction.set_rollback(True)
+    return results
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as handle:
+        return {(row['name'], row['scale']): row for row in json.load(handle)}
+
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as handle:
+        json.dump([result.as_dict() for result in results], handle, indent=2)
+        handle.write('\n')
+
+
+def compare(results, baseline, tolerance=0.5, noise_ms=2.0):
+    """Messages for results that regressed against ``baseline``.
+
+    More queries is always a regression; time and memory must exceed the
+    baseline by ``tolerance`` (a fraction), and time by ``noise_ms`` too.
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get((result.name, result.scale))
+        if base is None:
+            continue
+        if result.queries > base['queries']:
+            regressions.append(f"{result.name} @ {result.scale}: {result.queries} queries, baseline {base['queries']}")
+        for field, unit, slack in (('cold_ms', 'ms', noise_ms), ('warm_ms', 'ms', noise_ms), ('peak_kib', 'KiB', 0)):
+            value, limit = getattr(result, field), base[field] * (1 + tolerance) + slack
+            if value > limit:
+                regressions.append(f"{result.name} @ {result.scale}: {field} {value:.1f} {unit}, baseline {base[field]:.1f} {unit}")
+    return regressions
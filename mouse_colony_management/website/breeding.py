@@ -0,0 +1,346 @@
+"""Mendelian predictions of the offspring genotypes of breeding pairs.
+
+Each parent passes on one of its two alleles with probability 1/2, so for
+every gene a pair has four equally likely pup genotypes. ``OffspringPredictor``
+builds those as ``(pairs, 4)`` arrays of allele codes taken from the cached
+genotype matrices (see ``genetics``), one vectorised step per gene for any
+number of pairs. Genes are assumed to assort independently, so the chance of
+a pup matching several genes is the product of the per-gene chances.
+
+``predict_requests`` annotates pending breed requests; ``rank_pairs`` screens
+every male against every female for a desired genotype.
+
+``recommend_pairs`` proposes new pairs from a strain's unpaired adults. The
+candidates come from one indexed query and are cut down per sex by
+genotype and age. All remaining male x female pairs are then scored
+together: the chance of the desired genotype, times the age factors of
+both mice, times a kinship penalty. Kinship is only worked out for a
+shortlist. Each mouse is used at most once, and each pair is given a free
+cage.
+"""
+import datetime as dt
+
+import numpy as np
+from django.db.models import Sum
+
+from .genetics import ZYGOSITIES, genotype_matrices, genotype_matrix
+from .kinship import strain_pedigree
+from .models import Breed, Cage, Mouse, Request, StrainLitterStats
+
+# Used when the colony has no recorded litters yet
+DEFAULT_LITTER_SIZE = 6
+# Age factor by age in days: weaned adults only, fertility falls off after about six months
+BREEDING_AGES = ([42, 56, 180, 270], [0.5, 1.0, 1.0, 0.0])
+# Candidates kept per sex after the genotype and age prefilter
+MAX_CANDIDATES = 200
+# Pairs a single mouse may take in the kinship shortlist
+PAIRS_PER_MOUSE = 5
+# A pair's score is scaled by 1 - KINSHIP_PENALTY * kinship: full sibs (0.25) halve it
+KINSHIP_PENALTY = 2
+# Scored in place of a kinship too costly to work out now (that of full sibs)
+UNKNOWN_KINSHIP = 0.25
+
+
+def mean_litter_size():
+    """Average number of pups born per litter, from the running strain statistics."""
+    totals = StrainLitterStats.objects.aggregate(born=Sum('born'), litters=Sum('litters'))
+    return totals['born'] / totals['litters'] if totals['litters'] else DEFAULT_LITTER_SIZE
+
+
+class OffspringPredictor:
+    """Offspring genotype predictions for many ``(father_id, mother_id)`` pairs at once."""
+
+    def __init__(self, pairs):
+        self.pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        self.mouse_ids = np.unique(self.pairs)
+        self.by_strain = {}
+        for mouse_id, strain_id in Mouse.objects.filter(pk__in=self.mouse_ids.tolist()).values_list('pk', 'strain_id'):
+            self.by_strain.setdefault(strain_id, []).append(mouse_id)
+        self.matrices = genotype_matrices(self.by_strain)
+        self.fathers = np.searchsorted(self.mouse_ids, self.pairs[:, 0])
+        self.mothers = np.searchsorted(self.mouse_ids, self.pairs[:, 1])
+
+        # Allele codes are global, so matrices of different strains merge
+        self.codes = {}  # gene name -> {allele symbol: code}
+        self.symbols = {}  # code -> allele symbol
+        for matrix in self.matrices.values():
+            self.symbols.update(matrix.symbols)
+            for gene, codes in matrix.codes.items():
+                self.codes.setdefault(gene, {}).update(codes)
+        self._alleles = {}
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def genes(self):
+        return sorted(self.codes)
+
+    def alleles(self, gene):
+        """``(mice, 2)`` allele codes of ``gene`` for every parent in ``mouse_ids``, 0 when untested."""
+        if gene not in self._alleles:
+            alleles = np.zeros((len(self.mouse_ids), 2), dtype=np.int32)
+            for strain_id, mouse_ids in self.by_strain.items():
+                alleles[np.searchsorted(self.mouse_ids, mouse_ids)] = self.matrices[strain_id].pairs(gene, mouse_ids)
+            self._alleles[gene] = alleles
+        return self._alleles[gene]
+
+    def offspring(self, gene):
+        """``(low, high, tested)``: the sorted allele codes of the four equally likely
+        pups of each pair, and which pairs have both parents tested for ``gene``."""
+        alleles = self.alleles(gene)
+        father, mother = alleles[self.fathers], alleles[self.mothers]
+        # Pup k inherits the father's allele k // 2 and the mother's allele k % 2
+        from_father, from_mother = father[:, [0, 0, 1, 1]], mother[:, [0, 1, 0, 1]]
+        tested = (father[:, 0] > 0) & (mother[:, 0] > 0)
+        return np.minimum(from_father, from_mother), np.maximum(from_father, from_mother), tested
+
+    def probability(self, gene, target):
+        """Chance that a pup of each pair has ``target`` at ``gene``.
+
+        ``target`` is a genotype such as ``'tm1/+'`` (in either order) or a
+        zygosity. Pairs with an untested parent get 0.
+        """
+        low, high, tested = self.offspring(gene)
+        if target in ZYGOSITIES:
+            hits = low == high if target == 'homozygous' else low != high
+        else:
+            codes = self.codes.get(gene, {})
+            first, second = (codes.get(symbol.strip(), -1) for symbol in target.partition('/')[::2])
+            hits = (low == min(first, second)) & (high == max(first, second))
+        return np.where(tested, hits.mean(axis=1), 0.0)
+
+    def probabilities(self, desired):
+        """Chance that a pup of each pair matches every ``{gene: target}`` of ``desired``."""
+        result = np.ones(len(self.pairs))
+        for gene, target in desired.items():
+            result *= self.probability(gene, target)
+        return result
+
+    def distributions(self, rows=None):
+        """``[{gene: {'a/b': probability}}]`` for the pairs at ``rows`` (all by default),
+        over the genes tested in both parents."""
+        rows = np.arange(len(self.pairs)) if rows is None else np.asarray(rows, dtype=np.int64)
+        results = [{} for _ in rows]
+        for gene in self.genes():
+            low, high, tested = self.offspring(gene)
+            low, high, tested = low[rows], high[rows], tested[rows]
+            if not tested.any():
+                continue
+            # Count each pair's distinct pup genotypes in one pass via packed integer keys
+            base = int(high.max()) + 1
+            positions = np.nonzero(tested)[0]
+            keys = (positions[:, None] * base + low[positions]) * base + high[positions]
+            keys, counts = np.unique(keys, return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                position, code = divmod(key, base * base)
+                first, second = divmod(code, base)
+                results[position].setdefault(gene, {})[f"{self.symbols[first]}/{self.symbols[second]}"] = count / 4
+        return results
+
+
+class Prediction:
+    def __init__(self, father_id, mother_id, genotypes, probability=None, litter_size=None, request_id=None):
+        self.request_id = request_id
+        self.father_id = father_id
+        self.mother_id = mother_id
+        self.genotypes = genotypes
+        # Only meaningful when a desired genotype was given
+        self.probability = probability
+        self.expected_pups = None if probability is None else probability * litter_size
+        self.at_least_one = None if probability is None else 1 - (1 - probability) ** round(litter_size)
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        return '; '.join(
+            f"{gene}: " + ', '.join(f"{genotype} {share:.0%}" for genotype, share in sorted(shares.items()))
+            for gene, shares in sorted(self.genotypes.items())
+        )
+
+
+def predict_pairs(pairs, desired=None, litter_size=None):
+    """A Prediction for each ``(father_id, mother_id)`` pair, in order."""
+    if not pairs:
+        return []
+    if desired:
+        litter_size = litter_size or mean_litter_size()
+    predictor = OffspringPredictor(pairs)
+    probabilities = predictor.probabilities(desired).tolist() if desired else [None] * len(predictor)
+    return [
+        Prediction(int(father_id), int(mother_id), genotypes, probability, litter_size)
+        for (father_id, mother_id), genotypes, probability in zip(predictor.pairs.tolist(), predictor.distributions(), probabilities)
+    ]
+
+
+def predict_requests(requests=None, desired=None, litter_size=None):
+    """``{request_id: Prediction}`` for breed requests (all pending ones by default)."""
+    if requests is None:
+        requests = Request.objects.filter(status='pending', request_type='breed')
+    rows = [
+        (request.pk, request.mouse_id, request.second_mouse_id)
+        for request in requests if request.request_type == 'breed' and request.second_mouse_id
+    ]
+    predictions = predict_pairs([(mouse_id, second_id) for _, mouse_id, second_id in rows], desired, litter_size)
+    for (request_id, _, _), prediction in zip(rows, predictions):
+        prediction.request_id = request_id
+    return {prediction.request_id: prediction for prediction in predictions}
+
+
+def rank_pairs(male_ids, female_ids, desired, litter_size=None, limit=None):
+    """Every male x female pair as a Prediction, most likely to give ``desired`` pups first.
+
+    Probabilities for all pairs are computed together; genotype distributions
+    only for the ``limit`` pairs returned.
+    """
+    pairs = [(male_id, female_id) for male_id in male_ids for female_id in female_ids]
+    if not pairs:
+        return []
+    litter_size = litter_size or mean_litter_size()
+    predictor = OffspringPredictor(pairs)
+    probabilities = predictor.probabilities(desired)
+    # Stable sort keeps the input order between equally likely pairs
+    order = np.argsort(-probabilities, kind='stable')[:limit]
+    return [
+        Prediction(int(father_id), int(mother_id), genotypes, probability, litter_size)
+        for (father_id, mother_id), genotypes, probability in zip(
+            predictor.pairs[order].tolist(), predictor.distributions(order), probabilities[order].tolist()
+        )
+    ]
+
+
+def parse_targets(values):
+    """``{gene: target}`` from ``'gene:target'`` strings such as ``'Apoe:tm1/tm1'``."""
+    desired = {}
+    for value in values:
+        gene, _, target = value.partition(':')
+        gene, target = gene.strip(), target.strip()
+        alleles = [symbol.strip() for symbol in target.split('/')]
+        if not gene or (target not in ZYGOSITIES and (len(alleles) != 2 or not all(alleles))):
+            raise ValueError(f"Targets look like 'Apoe:tm1/tm1' or 'Apoe:homozygous', not '{value}'.")
+        desired[gene] = target
+    return desired
+
+
+def age_factors(ages):
+    """Breeding suitability (0 to 1) of mice aged ``ages`` days."""
+    return np.interp(ages, *BREEDING_AGES, left=0.0, right=0.0)
+
+
+def _carrier_share(matrix, gene, target, mouse_ids):
+    """Share of each mouse's alleles that can go into a ``target`` pup (0 when untested)."""
+    pairs = matrix.pairs(gene, mouse_ids)
+    if target in ZYGOSITIES:
+        share = np.ones(len(mouse_ids))
+    else:
+        codes = matrix.codes.get(gene, {})
+        wanted = [codes.get(symbol.strip(), -1) for symbol in target.partition('/')[::2]]
+        share = np.isin(pairs, wanted).mean(axis=1)
+    return np.where(pairs[:, 0] > 0, share, 0.0)
+
+
+def _candidates(strain_id, today):
+    """``(mouse_ids, sexes, ages)`` of the strain's alive adults that are not already in a breed request."""
+    requested = Request.objects.filter(status__in=['pending', 'approved'], request_type='breed')
+    rows = list(
+        Mouse.objects.filter(
+            strain_id=strain_id, state='alive',
+            dob__gt=today - dt.timedelta(days=BREEDING_AGES[0][-1]), dob__lte=today - dt.timedelta(days=BREEDING_AGES[0][0]),
+        )
+        .exclude(pk__in=requested.values('mouse_id'))
+        .exclude(pk__in=requested.filter(second_mouse__isnull=False).values('second_mouse_id'))
+        .order_by('pk').values_list('pk', 'sex', 'dob')
+    )
+    mouse_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    sexes = np.array([row[1] for row in rows], dtype='U1')
+    ages = np.array([(today - row[2]).days for row in rows], dtype=np.float64)
+    return mouse_ids, sexes, ages
+
+
+def _free_cages(count, location=None, cage_type=None):
+    cages = Cage.objects.empty().with_space(2).exclude(pk__in=Breed.objects.filter(end_date__isnull=True).values('cage_id'))
+    if location:
+        cages = cages.filter(location=location)
+    if cage_type:
+        cages = cages.filter(cage_type=cage_type)
+    return list(cages.order_by('cage_number').values_list('pk', flat=True)[:count])
+
+
+class Recommendation(Prediction):
+    def __init__(self, father_id, mother_id, genotypes, probability, litter_size, score, kinship, ages, cage_id):
+        super().__init__(father_id, mother_id, genotypes, probability, litter_size)
+        self.score = score
+        self.kinship = kinship
+        self.father_age_days, self.mother_age_days = ages
+        self.cage_id = cage_id
+
+
+def recommend_pairs(strain_id, desired=None, limit=20, location=None, cage_type=None, today=None):
+    """Up to ``limit`` Recommendations of new pairs within ``strain_id``, best first.
+
+    ``desired`` is ``{gene: target}`` as for ``OffspringPredictor.probability``;
+    without it pairs are ranked on age and kinship alone. Pairs that could not
+    be given a free cage have ``cage_id`` None.
+    """
+    today = today or dt.date.today()
+    desired = desired or {}
+    mouse_ids, sexes, ages = _candidates(strain_id, today)
+    fitness = age_factors(ages)
+    if desired:
+        matrix = genotype_matrix(strain_id)
+        for gene, target in desired.items():
+            fitness *= _carrier_share(matrix, gene, target, mouse_ids)
+
+    def best(sex):
+        rows = np.flatnonzero((sexes == sex) & (fitness > 0))
+        return rows[np.argsort(-fitness[rows], kind='stable')[:MAX_CANDIDATES]]
+
+    males, females = best('M'), best('F')
+    if not len(males) or not len(females):
+        return []
+    # Every candidate male against every candidate female, as rows into the candidate arrays
+    father_rows, mother_rows = np.repeat(males, len(females)), np.tile(females, len(males))
+    predictor = OffspringPredictor(np.column_stack((mouse_ids[father_rows], mouse_ids[mother_rows])))
+    probabilities = predictor.probabilities(desired)
+    scores = probabilities * age_factors(ages[father_rows]) * age_factors(ages[mother_rows])
+
+    # Kinship only for the best pairs, with no mouse crowding out the rest
+    shortlist, uses = [], {}
+    for row in np.argsort(-scores, kind='stable').tolist():
+        if scores[row] <= 0 or len(shortlist) >= limit * PAIRS_PER_MOUSE:
+            break
+        father, mother = father_rows[row], mother_rows[row]
+        if uses.get(father, 0) < PAIRS_PER_MOUSE and uses.get(mother, 0) < PAIRS_PER_MOUSE:
+            shortlist.append(row)
+            uses[father], uses[mother] = uses.get(father, 0) + 1, uses.get(mother, 0) + 1
+    if not shortlist:
+        return []
+    shortlist = np.array(shortlist)
+    kinships = strain_pedigree(strain_id).kinships(predictor.pairs[shortlist].tolist())
+    penalties = np.array([UNKNOWN_KINSHIP if value is None else value for value in kinships])
+    final = scores[shortlist] * np.clip(1 - KINSHIP_PENALTY * penalties, 0, 1)
+
+    chosen, used = [], set()
+    for position in np.argsort(-final, kind='stable').tolist():
+        father, mother = father_rows[shortlist[position]], mother_rows[shortlist[position]]
+        if final[position] > 0 and father not in used and mother not in used:
+            chosen.append(position)
+            used.update((father, mother))
+            if len(chosen) == limit:
+                break
+
+    litter_size = mean_litter_size()
+    cages = _free_cages(len(chosen), location, cage_type)
+    rows = shortlist[chosen]
+    return [
+        Recommendation(
+            int(father_id), int(mother_id), genotypes,
+            float(probabilities[row]) if desired else None, litter_size,
+            float(final[position]), kinships[position],
+            (int(ages[father_rows[row]]), int(ages[mother_rows[row]])),
+            cages[n] if n < len(cages) else None,
+        )
+        for n, (position, row, (father_id, mother_id), genotypes) in enumerate(
+            zip(chosen, rows.tolist(), predictor.pairs[rows].tolist(), predictor.distributions(rows))
+        )
+    ]
@@ -0,0 +1,173 @@
+"""Approve, reject or complete many requests in one transaction.
+
+``process_requests`` locks the requests (and, for completion, the cages they
+name), validates each one against the state the batch has reached so far,
+and then writes every change with set-based queries: one ``bulk_update`` for
+the requests, one ``UPDATE`` for culled mice, one ``bulk_update`` for mice
+entering breeding cages and one ``bulk_create`` for the new breeds. Requests
+that fail validation are left untouched and reported by id; the rest of the
+batch still goes through.
+
+Single requests keep using ``Request.approve``/``reject``/``complete``.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cages import record_moves
+from .models import Breed, Cage, CageRollup, Mouse, Request, RequestRollup
+from .pedigree import id_batches
+from .rollups import _bump, reconcile_cages
+from .signals import mice_bulk_changed
+
+WRITE_BATCH_SIZE = 1000
+
+# action -> (statuses it may be applied to, resulting status)
+TRANSITIONS = {
+    'approve': ({'pending'}, 'approved'),
+    'reject': ({'pending', 'approved'}, 'rejected'),
+    'complete': ({'approved'}, 'completed'),
+}
+BULK_ACTIONS = list(TRANSITIONS)
+
+
+class BulkReport:
+    def __init__(self, action):
+        self.action = action
+        self.done = []  # request ids
+        self.errors = []  # (request id, message)
+
+    def error(self, request_id, message):
+        self.errors.append((request_id, message))
+
+    def __str__(self):
+        return f"{len(self.done)} {TRANSITIONS[self.action][1]}, {len(self.errors)} errors"
+
+
+class _Completion:
+    """The mice, cages and breeds of a batch of completions, as planned so far."""
+
+    def __init__(self, requests):
+        self.mice = {}
+        self.cages = {}
+        self.breeding = set()
+        self.culled = set()
+        self.breeds = []
+        cage_ids = {request.cage_id for request in requests if request.cage_id}
+        for batch in id_batches(cage_ids):
+            self.cages.update((cage.pk, cage) for cage in Cage.objects.select_for_update().filter(pk__in=batch))
+            self.breeding.update(CageRollup.objects.filter(cage_id__in=batch, active_breeds__gt=0).values_list('cage_id', flat=True))
+
+    def _move(self, mouse, cage_id):
+        if mouse.cage_id in self.cages:
+            self.cages[mouse.cage_id].occupancy -= 1
+        if cage_id in self.cages:
+            self.cages[cage_id].occupancy += 1
+        mouse.cage_id = cage_id
+
+    def add(self, request):
+        """Plan ``request``, or return why it cannot be completed."""
+        own = [request.mouse] if request.request_type == 'cull' else [request.mouse, request.second_mouse]
+        if None in own:
+            return "Breeding requests must specify a second mouse."
+        # The same mouse may appear in several requests; always use the planned copy
+        own = [self.mice.setdefault(mouse.pk, mouse) for mouse in own]
+        for mouse in own:
+            if mouse.state == 'deceased':
+                return f"Mouse {mouse.pk} is deceased."
+
+        if request.request_type == 'cull':
+            self._move(own[0], None)
+            own[0].state = 'deceased'
+            self.culled.add(own[0].pk)
+            return None
+
+        cage = self.cages.get(request.cage_id)
+        if cage is None:
+            return "A cage must be specified for breeding requests."
+        incoming = sum(1 for mouse in own if mouse.cage_id != cage.pk)
+        if cage.occupancy + incoming > cage.capacity:
+            return f"Cage {cage.cage_number} is full ({cage.occupancy} of {cage.capacity} places taken)."
+        if cage.pk in self.breeding:
+            return f"Cage {cage.cage_number} already holds an active breeding pair."
+        for mouse in own:
+            self._move(mouse, cage.pk)
+            mouse.state = 'breeding'
+        self.breeding.add(cage.pk)
+        male, female = sorted(own, key=lambda mouse: mouse.sex != 'M')
+        self.breeds.append(Breed(male=male, female=female, cage_id=cage.pk))
+        return None
+
+    def write(self, now):
+        changed = [mouse for mouse in self.mice.values() if mouse.has_changed('state', 'cage_id')]
+        if not changed:
+            return
+        for batch in id_batches(self.culled):
+            Mouse.objects.filter(pk__in=batch).update(state='deceased', cull_date=now, cage=None)
+        Mouse.objects.bulk_update([mouse for mouse in changed if mouse.pk not in self.culled], ['state', 'cage'], batch_size=WRITE_BATCH_SIZE)
+        record_moves([(mouse.pk, mouse.loaded_value('cage_id'), mouse.cage_id) for mouse in changed])
+        Breed.objects.bulk_create(self.breeds, batch_size=WRITE_BATCH_SIZE)
+
+        reconcile_cages({breed.cage_id for breed in self.breeds})
+        mice_bulk_changed.send(
+            sender=Mouse,
+            mouse_ids=[mouse.pk for mouse in changed],
+            strain_ids={mouse.strain_id for mouse in changed},
+            fields={'state', 'cage_id', 'cull_date'},
+        )
+        for mouse in changed:
+            if mouse.pk in self.culled:
+                mouse.cull_date = now
+            mouse.mark_saved('state', 'cage_id', 'cull_date')
+
+
+def process_requests(requests, action):
+    """Apply ``action`` ('approve', 'reject' or 'complete') to ``requests``.
+
+    ``requests`` may be Request instances or ids. Returns a BulkReport.
+    """
+    allowed, status = TRANSITIONS[action]
+    report = BulkReport(action)
+    request_ids = list(dict.fromkeys(getattr(request, 'pk', request) for request in requests))
+    now = timezone.now()
+
+    with transaction.atomic():
+        loaded = {}
+        for batch in id_batches(request_ids):
+            queryset = Request.objects.select_for_update().filter(pk__in=batch)
+            if action == 'complete':
+                queryset = queryset.select_related('mouse', 'second_mouse')
+            loaded.update((request.pk, request) for request in queryset)
+        completion = _Completion(loaded.values()) if action == 'complete' else None
+
+        accepted = []
+        # (request_type, status) -> change in the RequestRollup count
+        deltas = Counter()
+        for request_id in request_ids:
+            request = loaded.get(request_id)
+            if request is None:
+                report.error(request_id, "No such request.")
+                continue
+            if request.status not in allowed:
+                report.error(request_id, f"Cannot {action} a request that is {request.status}.")
+                continue
+            problem = completion.add(request) if completion else None
+            if problem:
+                report.error(request_id, problem)
+                continue
+            deltas[request.request_type, request.status] -= 1
+            deltas[request.request_type, status] += 1
+            request.status, request.updated_at = status, now
+            accepted.append(request)
+            report.done.append(request_id)
+
+        if accepted:
+            Request.objects.bulk_update(accepted, ['status', 'updated_at'], batch_size=WRITE_BATCH_SIZE)
+            for request in accepted:
+                request.mark_saved('status', 'updated_at')
+            if completion:
+                completion.write(now)
+            for (request_type, request_status), delta in deltas.items():
+                _bump(RequestRollup, {'request_type': request_type, 'status': request_status}, count=delta)
+    return report
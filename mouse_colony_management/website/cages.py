@@ -0,0 +1,92 @@
+"""Cage assignments and the occupancy counters that make capacity checks O(1).
+
+``Mouse.cage`` is the mouse's current cage and ``CageAssignment`` keeps the
+history of moves. ``Cage.occupancy`` is updated with ``UPDATE ... SET
+occupancy = occupancy + n`` in the same transaction as every move, whether
+the move comes from a plain ``mouse.save()`` (via the post_save receiver,
+inside the transaction ``Mouse.save`` opens) or from ``move_mice``, which
+also checks the locked target cage for room. Checking whether a cage has
+room therefore reads one row instead of counting its mice. ``recount_cages``
+rebuilds the counters from the mice table for the nightly reconcile.
+"""
+from collections import Counter
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Cage, CageAssignment, Mouse
+from .pedigree import id_batches
+from .signals import mice_bulk_changed
+
+
+def record_moves(moves):
+    """Apply ``(mouse_id, old_cage_id, new_cage_id)`` moves to counters and history."""
+    moves = [(mouse_id, old, new) for mouse_id, old, new in moves if old != new]
+    if not moves:
+        return
+    now = timezone.now()
+    for batch in id_batches([mouse_id for mouse_id, _, _ in moves]):
+        CageAssignment.objects.filter(mouse_id__in=batch, removed_at__isnull=True).update(removed_at=now)
+    CageAssignment.objects.bulk_create(
+        CageAssignment(mouse_id=mouse_id, cage_id=new, assigned_at=now) for mouse_id, _, new in moves if new is not None
+    )
+    deltas = Counter()
+    for _, old, new in moves:
+        deltas[old] -= 1
+        deltas[new] += 1
+    for cage_id, delta in deltas.items():
+        if cage_id is not None and delta:
+            Cage.objects.filter(pk=cage_id).update(occupancy=F('occupancy') + delta)
+
+
+def move_mice(mice, cage):
+    """Move ``mice`` into ``cage`` (or out of their cages when ``cage`` is None).
+
+    The target cage row is locked for the duration so two concurrent moves
+    cannot both take its last place. Raises ValidationError when it is full.
+    """
+    cage_id = cage.pk if cage is not None else None
+    moving = [mouse for mouse in mice if mouse.cage_id != cage_id]
+    with transaction.atomic():
+        if cage is not None:
+            locked = Cage.objects.select_for_update().get(pk=cage_id)
+            if locked.occupancy + len(moving) > locked.capacity:
+                raise ValidationError(
+                    f"Cage {locked.cage_number} has {locked.capacity - locked.occupancy} free places; cannot move {len(moving)} mice in."
+                )
+        for batch in id_batches([mouse.pk for mouse in moving]):
+            Mouse.objects.filter(pk__in=batch).update(cage_id=cage_id)
+        record_moves([(mouse.pk, mouse.cage_id, cage_id) for mouse in moving])
+        mice_bulk_changed.send(sender=Mouse, mouse_ids=[mouse.pk for mouse in moving], strain_ids={mouse.strain_id for mouse in moving}, fields={'cage_id'})
+    for mouse in moving:
+        mouse.cage_id = cage_id
+        mouse.mark_saved('cage_id')
+    return len(moving)
+
+
+def recount_cages():
+    """Recompute every cage's occupancy from the mice table."""
+    counts = dict(Mouse.objects.filter(cage__isnull=False).values('cage_id').annotate(n=Count('pk')).order_by().values_list('cage_id', 'n'))
+    with transaction.atomic():
+        Cage.objects.exclude(pk__in=list(counts)).exclude(occupancy=0).update(occupancy=0)
+        for cage_id, n in counts.items():
+            Cage.objects.filter(pk=cage_id).exclude(occupancy=n).update(occupancy=n)
+
+
+@receiver(post_save, sender=Mouse)
+def track_cage_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old = None if created else instance.loaded_value('cage_id')
+    record_moves([(instance.pk, old, instance.cage_id)])
+
+
+@receiver(post_delete, sender=Mouse)
+def track_cage_on_delete(sender, instance, **kwargs):
+    cage_id = instance.loaded_value('cage_id')
+    if cage_id is not None:
+        Cage.objects.filter(pk=cage_id).update(occupancy=F('occupancy') - 1)
@@ -0,0 +1,161 @@
+"""Constant-memory export of colony data as CSV, JSON Lines or column blocks.
+
+Rows are read with ``values_list`` in keyset-paginated pages over the primary
+key (``pk > last ORDER BY pk LIMIT n``), so memory stays flat on every
+backend, including MySQL whose driver buffers whole result sets. Output is
+produced by generators and can be fed straight to a StreamingHttpResponse or
+written to a file.
+
+The ``columnar`` format writes one JSON object per line: a schema line
+followed by row groups of the form ``{"rows": n, "columns": {name: [...]}}``.
+Each row group loads directly into a DataFrame (``pd.DataFrame(group["columns"])``).
+"""
+import csv
+import datetime as dt
+import json
+
+from .models import Breed, Genotype, HealthObservation, Litter, Mouse, Phenotype
+
+CHUNK_SIZE = 2000
+
+# dataset -> (model, [(column name, values_list lookup), ...]); the first lookup is the key
+DATASETS = {
+    'mice': (Mouse, [
+        ('mouse_id', 'mouse_id'),
+        ('strain', 'strain__name'),
+        ('tube_id', 'tube_id'),
+        ('dob', 'dob'),
+        ('sex', 'sex'),
+        ('father_id', 'father_id'),
+        ('father_tube_id', 'father__tube_id'),
+        ('mother_id', 'mother_id'),
+        ('mother_tube_id', 'mother__tube_id'),
+        ('state', 'state'),
+        ('earmark', 'earmark'),
+        ('clipped_date', 'clipped_date'),
+        ('cull_date', 'cull_date'),
+        ('mouse_keeper', 'mouse_keeper__username'),
+        ('team', 'team__name'),
+    ]),
+    'genotypes': (Genotype, [
+        ('id', 'id'),
+        ('mouse_id', 'mouse_id'),
+        ('strain', 'mouse__strain__name'),
+        ('tube_id', 'mouse__tube_id'),
+        ('gene', 'gene'),
+        ('allele_1', 'allele_1'),
+        ('allele_2', 'allele_2'),
+        ('zygosity', 'zygosity'),
+        ('test_date', 'test_date'),
+    ]),
+    'phenotypes': (Phenotype, [
+        ('id', 'id'),
+        ('mouse_id', 'mouse_id'),
+        ('strain', 'mouse__strain__name'),
+        ('tube_id', 'mouse__tube_id'),
+        ('characteristic', 'characteristic'),
+        ('description', 'description'),
+        ('observation_date', 'observation_date'),
+    ]),
+    'health': (HealthObservation, [
+        ('id', 'id'),
+        ('mouse_id', 'mouse_id'),
+        ('strain_id', 'strain_id'),
+        ('cage_id', 'cage_id'),
+        ('metric', 'metric'),
+        ('value', 'value'),
+        ('observed_at', 'observed_at'),
+        ('device', 'device'),
+    ]),
+    'breeds': (Breed, [
+        ('breed_id', 'breed_id'),
+        ('male_id', 'male_id'),
+        ('female_id', 'female_id'),
+        ('cage', 'cage__cage_number'),
+        ('start_date', 'start_date'),
+        ('end_date', 'end_date'),
+    ]),
+    'litters': (Litter, [
+        ('litter_id', 'litter_id'),
+        ('breed_id', 'breed_id'),
+        ('father_id', 'father_id'),
+        ('mother_id', 'mother_id'),
+        ('strain', 'strain__name'),
+        ('birth_date', 'birth_date'),
+        ('born', 'born'),
+        ('wean_date', 'wean_date'),
+        ('weaned', 'weaned'),
+    ]),
+}
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'columnar': ('application/x-ndjson', 'columns.jsonl'),
+}
+
+
+def columns(dataset):
+    return [name for name, _ in DATASETS[dataset][1]]
+
+
+def iter_row_groups(dataset, chunk_size=CHUNK_SIZE):
+    """Yield lists of up to ``chunk_size`` value tuples, in primary key order."""
+    model, fields = DATASETS[dataset]
+    lookups = [lookup for _, lookup in fields]
+    key = model._meta.pk.name
+    queryset = model.objects.order_by(key).values_list(*lookups)
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(**{f'{key}__gt': last})
+        rows = list(page[:chunk_size].iterator(chunk_size=chunk_size))
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def _json_value(value):
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value.isoformat()
+    return value
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to the csv writer's caller."""
+
+    def write(self, value):
+        return value
+
+
+def export_csv(dataset, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns(dataset))
+    for rows in iter_row_groups(dataset, chunk_size):
+        yield ''.join(writer.writerow(['' if value is None else _json_value(value) for value in row]) for row in rows)
+
+
+def export_jsonl(dataset, chunk_size=CHUNK_SIZE):
+    names = columns(dataset)
+    for rows in iter_row_groups(dataset, chunk_size):
+        yield ''.join(json.dumps(dict(zip(names, map(_json_value, row)))) + '\n' for row in rows)
+
+
+def export_columnar(dataset, chunk_size=CHUNK_SIZE):
+    names = columns(dataset)
+    yield json.dumps({'dataset': dataset, 'columns': names}) + '\n'
+    for rows in iter_row_groups(dataset, chunk_size):
+        data = {name: [_json_value(value) for value in column] for name, column in zip(names, zip(*rows))}
+        yield json.dumps({'rows': len(rows), 'columns': data}) + '\n'
+
+
+EXPORTERS = {
+    'csv': export_csv,
+    'jsonl': export_jsonl,
+    'columnar': export_columnar,
+}
+
+
+def export_colony(dataset, export_format='csv', chunk_size=CHUNK_SIZE):
+    """Generator of text chunks for ``dataset`` in ``export_format``."""
+    return EXPORTERS[export_format](dataset, chunk_size)
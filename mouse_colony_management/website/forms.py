@@ -3,6 +3,7 @@ from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 from .models import *  # Import your custom User model
+from .importers import IMPORT_KINDS
 
 class RegistrationForm(UserCreationForm):
     email = forms.EmailField(required=True)  # Keep email as required
@@ -26,3 +27,8 @@ class RegistrationForm(UserCreationForm):
         if commit:
             user.save()
         return user
+
+
+class ColonyImportForm(forms.Form):
+    kind = forms.ChoiceField(choices=IMPORT_KINDS)
+    file = forms.FileField(help_text="CSV or TSV export with a header row.")
@@ -0,0 +1,220 @@
+"""Dictionary-coded genotypes and cached per-strain genotype matrices.
+
+Gene names and allele symbols are stored once in ``Gene`` and ``Allele``;
+each ``Genotype`` row carries the gene (``locus``) and both alleles as
+integer keys plus a ``zygosity`` column. Codes are assigned on save, and by
+``encode_genotypes`` for bulk inserts and the ``normalize_genotypes`` backfill.
+
+``GenotypeMatrix`` holds a strain's genotypes as one dense NumPy array of
+allele codes, ``alleles[mouse, gene] = (low code, high code)`` with 0 for
+untested, so filters such as "heterozygous for Apoe and carrying Lepr tm1"
+and genotype counts are vectorised comparisons over thousands of mice.
+Where a mouse was genotyped more than once for a gene, the latest test wins.
+Matrices are cached in process memory and in the Django cache, keyed by
+``Strain.genotype_version``, which is re-stamped whenever a genotype of the
+strain changes (random stamps, as for pedigree snapshots).
+"""
+import secrets
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Allele, Gene, Genotype, Mouse, Strain
+from .snapshots import CACHE_TIMEOUT, get_snapshot
+
+ZYGOSITIES = [zygosity for zygosity, _ in Genotype.ZYGOSITY_CHOICES]
+
+# (gene name, None) -> gene id and (gene name, allele symbol) -> allele id, for committed rows only
+_dictionary = {}
+
+
+def _code(key, seen):
+    if key in _dictionary:
+        return _dictionary[key]
+    if key not in seen:
+        name, symbol = key
+        if symbol is None:
+            seen[key] = Gene.objects.get_or_create(name=name)[0].pk
+        else:
+            seen[key] = Allele.objects.get_or_create(gene_id=_code((name, None), seen), symbol=symbol)[0].pk
+        # Only remember ids that survive the transaction
+        transaction.on_commit(lambda code=seen[key]: _dictionary.__setitem__(key, code))
+    return seen[key]
+
+
+def encode_genotypes(genotypes):
+    """Fill in ``locus``, the allele codes and ``zygosity`` on Genotype instances."""
+    seen = {}
+    for genotype in genotypes:
+        genotype.gene = genotype.gene.strip()
+        genotype.allele_1 = genotype.allele_1.strip()
+        genotype.allele_2 = genotype.allele_2.strip()
+        genotype.locus_id = _code((genotype.gene, None), seen)
+        genotype.allele_1_code_id = _code((genotype.gene, genotype.allele_1), seen)
+        genotype.allele_2_code_id = _code((genotype.gene, genotype.allele_2), seen)
+        genotype.zygosity = 'homozygous' if genotype.allele_1 == genotype.allele_2 else 'heterozygous'
+    return genotypes
+
+
+class GenotypeMatrix:
+    def __init__(self, strain_id, version, rows):
+        """``rows`` are ``(mouse_id, gene_id, allele_1_id, allele_2_id)``, oldest test first."""
+        self.strain_id = strain_id
+        self.version = version
+        rows = np.array(list(rows), dtype=np.int64).reshape(-1, 4)
+        self.mouse_ids = np.unique(rows[:, 0])
+        self.gene_ids = np.unique(rows[:, 1])
+        self.alleles = np.zeros((len(self.mouse_ids), len(self.gene_ids), 2), dtype=np.int32)
+        mouse_rows = np.searchsorted(self.mouse_ids, rows[:, 0])
+        gene_columns = np.searchsorted(self.gene_ids, rows[:, 1])
+        # Later rows overwrite earlier ones, so the latest test of a (mouse, gene) wins
+        self.alleles[mouse_rows, gene_columns] = np.sort(rows[:, 2:], axis=1)
+
+        self.gene_columns = {}
+        self.codes = {}  # gene name -> {allele symbol: code}
+        self.symbols = {}  # code -> allele symbol
+        for gene_id, name in Gene.objects.filter(pk__in=self.gene_ids.tolist()).values_list('pk', 'name'):
+            self.gene_columns[name] = int(np.searchsorted(self.gene_ids, gene_id))
+            self.codes[name] = {}
+        for code, gene_name, symbol in Allele.objects.filter(gene_id__in=self.gene_ids.tolist()).values_list('pk', 'gene__name', 'symbol'):
+            self.codes[gene_name][symbol] = code
+            self.symbols[code] = symbol
+
+    @classmethod
+    def load(cls, strain_id, version):
+        rows = (
+            Genotype.objects.filter(mouse__strain_id=strain_id, locus__isnull=False)
+            .order_by('test_date', 'pk')
+            .values_list('mouse_id', 'locus_id', 'allele_1_code_id', 'allele_2_code_id')
+        )
+        return cls(strain_id, version, rows)
+
+    def __len__(self):
+        return len(self.mouse_ids)
+
+    def rows(self, mouse_ids):
+        """Boolean mask of the rows of ``mouse_ids`` (ids without genotypes are ignored)."""
+        return np.isin(self.mouse_ids, np.asarray(list(mouse_ids), dtype=np.int64))
+
+    def mask(self, gene, zygosity=None, allele=None):
+        """Boolean mask of the mice tested for ``gene``, optionally only those with
+        ``zygosity`` ('homozygous'/'heterozygous') or carrying ``allele``."""
+        if zygosity is not None and zygosity not in ZYGOSITIES:
+            raise ValueError(f"Unknown zygosity '{zygosity}'.")
+        column = self.gene_columns.get(gene)
+        if column is None:
+            return np.zeros(len(self.mouse_ids), dtype=bool)
+        pairs = self.alleles[:, column]
+        selected = pairs[:, 0] > 0
+        if zygosity == 'homozygous':
+            selected &= pairs[:, 0] == pairs[:, 1]
+        elif zygosity == 'heterozygous':
+            selected &= pairs[:, 0] != pairs[:, 1]
+        if allele is not None:
+            code = self.codes[gene].get(allele, -1)
+            selected &= (pairs[:, 0] == code) | (pairs[:, 1] == code)
+        return selected
+
+    def pairs(self, gene, mouse_ids):
+        """``(len(mouse_ids), 2)`` allele codes of ``gene``, zeros where untested or not in the strain."""
+        mouse_ids = np.asarray(mouse_ids, dtype=np.int64)
+        pairs = np.zeros((len(mouse_ids), 2), dtype=np.int32)
+        column = self.gene_columns.get(gene)
+        if column is None or not len(self.mouse_ids):
+            return pairs
+        positions = np.minimum(np.searchsorted(self.mouse_ids, mouse_ids), len(self.mouse_ids) - 1)
+        found = self.mouse_ids[positions] == mouse_ids
+        pairs[found] = self.alleles[positions[found], column]
+        return pairs
+
+    def mice(self, gene, zygosity=None, allele=None):
+        return self.mouse_ids[self.mask(gene, zygosity, allele)].tolist()
+
+    def matching(self, criteria):
+        """Mouse ids matching every ``{gene: zygosity}`` criterion."""
+        selected = np.ones(len(self.mouse_ids), dtype=bool)
+        for gene, zygosity in criteria.items():
+            selected &= self.mask(gene, zygosity)
+        return self.mouse_ids[selected].tolist()
+
+    def counts(self, gene, mouse_ids=None):
+        """``{'allele/allele': number of mice}`` for ``gene``, over ``mouse_ids`` or the whole strain."""
+        selected = self.mask(gene)
+        if mouse_ids is not None:
+            selected &= self.rows(mouse_ids)
+        if not selected.any():
+            return {}
+        pairs, totals = np.unique(self.alleles[selected, self.gene_columns[gene]], axis=0, return_counts=True)
+        return {f"{self.symbols[low]}/{self.symbols[high]}": int(total) for (low, high), total in zip(pairs.tolist(), totals.tolist())}
+
+
+def _cache_key(strain_id, version):
+    return f'genotype-matrix:{strain_id}:{version}'
+
+
+_local = {}
+
+
+def genotype_matrices(strain_ids):
+    """``{strain_id: GenotypeMatrix}`` at each strain's current genotype version."""
+    matrices = {}
+    versions = Strain.objects.filter(pk__in=list(strain_ids)).values_list('pk', 'genotype_version')
+    for strain_id, version in versions:
+        matrix = _local.get(strain_id)
+        if matrix is None or matrix.version != version:
+            matrix = cache.get(_cache_key(strain_id, version))
+            if matrix is None:
+                matrix = GenotypeMatrix.load(strain_id, version)
+                cache.set(_cache_key(strain_id, version), matrix, CACHE_TIMEOUT)
+            _local[strain_id] = matrix
+        matrices[strain_id] = matrix
+    return matrices
+
+
+def genotype_matrix(strain_id):
+    """The strain's GenotypeMatrix at its current genotype version."""
+    return genotype_matrices([strain_id]).get(strain_id) or GenotypeMatrix(strain_id, None, [])
+
+
+def bump_genotype_versions(strain_ids):
+    strain_ids = {strain_id for strain_id in strain_ids if strain_id is not None}
+    if strain_ids:
+        Strain.objects.filter(pk__in=strain_ids).update(genotype_version=secrets.randbits(63))
+        for strain_id in strain_ids:
+            _local.pop(strain_id, None)
+
+
+def litter_counts(father_id, mother_id, gene, strain_id=None):
+    """Genotype counts for ``gene`` among the pups of a pair (from the pedigree snapshot)."""
+    if strain_id is None:
+        strain_id = Mouse.objects.filter(pk=mother_id).values_list('strain_id', flat=True).first()
+    snapshot = get_snapshot(strain_id)
+    if snapshot is None:
+        return {}
+    pups = snapshot.mouse_ids[(snapshot.father_ids == father_id) & (snapshot.mother_ids == mother_id) & snapshot.own_rows()]
+    return genotype_matrix(strain_id).counts(gene, pups.tolist())
+
+
+def _strain_of(mouse_id):
+    return Mouse.objects.filter(pk=mouse_id).values_list('strain_id', flat=True).first()
+
+
+@receiver(post_save, sender=Mouse)
+def bump_on_strain_change(sender, instance, created, raw=False, **kwargs):
+    # A mouse moving strain takes its genotypes to the other strain's matrix
+    if not raw and not created and instance.has_changed('strain_id'):
+        bump_genotype_versions([instance.strain_id, instance.loaded_value('strain_id')])
+
+
+@receiver(post_save, sender=Genotype)
+def bump_on_genotype_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_genotype_versions([_strain_of(instance.mouse_id)])
+
+
+@receiver(post_delete, sender=Genotype)
+def bump_on_genotype_delete(sender, instance, **kwargs):
+    bump_genotype_versions([_strain_of(instance.mouse_id)])
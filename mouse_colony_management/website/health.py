@@ -0,0 +1,234 @@
+"""Health observation time series with pre-aggregated daily and weekly rollups.
+
+Numeric readings (``HealthObservation``: weight, body condition score,
+temperature) are summarized into ``HealthRollup`` rows per mouse, cage and
+strain, for every day and every week (starting on Monday). A rollup holds the
+count, sum, sum of squares, minimum and maximum of its readings, so rollups of
+several scopes (all the cages of a room, say) combine exactly into a mean,
+standard deviation and range. Trend queries read only rollups, through their
+unique (scope, scope_id, metric, period, period_start) index, and never scan
+raw readings.
+
+A reading keeps the cage and strain of its mouse at the time it was stored,
+so moving a mouse later does not rewrite the history of its old cage.
+
+Rollups are refreshed rather than incremented: once readings are written, the
+buckets they fall in are deleted and recomputed from the raw readings with one
+grouped query per scope over the (scope, metric, observed_at) indexes, and the
+weeks are recomputed from the refreshed days. Minimum and maximum stay right
+when readings are edited or deleted, and re-sending a batch is harmless. The
+delete comes first so that two refreshes of the same buckets run one after the
+other. ``reconcile_health_rollups`` rebuilds a range of days from scratch.
+"""
+import datetime as dt
+import math
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Cage, HealthObservation, HealthRollup, Mouse
+from .pedigree import id_batches
+
+CHUNK_SIZE = 1000
+# Readings accepted in one device upload
+MAX_DEVICE_READINGS = 10000
+# Rollup scope -> HealthObservation column
+SCOPES = {'mouse': 'mouse_id', 'cage': 'cage_id', 'strain': 'strain_id'}
+PERIODS = ('day', 'week')
+ROLLUP_FIELDS = ('count', 'total', 'total_sq', 'minimum', 'maximum')
+
+
+def check_reading(metric, value):
+    """``value`` as a float; raises ValueError for unknown metrics and implausible values."""
+    if metric not in HealthObservation.METRIC_RANGES:
+        raise ValueError(f"Unknown metric '{metric}'.")
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{metric} must be a number, got '{value}'.")
+    low, high = HealthObservation.METRIC_RANGES[metric]
+    if not low <= value <= high:
+        raise ValueError(f"{metric} must be between {low:g} and {high:g}, got {value:g}.")
+    return value
+
+
+def _week_start(day):
+    return day - dt.timedelta(days=day.weekday())
+
+
+def _day_range(first, last):
+    """Aware datetimes bounding the days ``first`` to ``last``, end exclusive."""
+    return (
+        timezone.make_aware(dt.datetime.combine(first, dt.time.min)),
+        timezone.make_aware(dt.datetime.combine(last + dt.timedelta(days=1), dt.time.min)),
+    )
+
+
+def _bucket(observation, loaded=False):
+    """(mouse_id, cage_id, strain_id, metric, day) of ``observation``, or of its stored row."""
+    value = observation.loaded_value if loaded else lambda attname: getattr(observation, attname)
+    return (value('mouse_id'), value('cage_id'), value('strain_id'), value('metric'), timezone.localtime(value('observed_at')).date())
+
+
+def _refresh(scope, scope_ids, metrics, first, last):
+    """Recompute the day and week rollups of ``scope`` touching the days ``first`` to ``last``.
+
+    ``scope_ids=None`` means every id, for reconciling.
+    """
+    field = SCOPES[scope]
+    first_week, last_week = _week_start(first), _week_start(last)
+    rollups = HealthRollup.objects.filter(scope=scope, metric__in=metrics)
+    start, end = _day_range(first, last)
+    readings = HealthObservation.objects.filter(metric__in=metrics, observed_at__gte=start, observed_at__lt=end)
+    if scope_ids is not None:
+        rollups = rollups.filter(scope_id__in=scope_ids)
+        readings = readings.filter(**{f'{field}__in': scope_ids})
+    with transaction.atomic():
+        # Deleting first locks the buckets, so concurrent refreshes of them take turns
+        rollups.filter(
+            Q(period='day', period_start__range=(first, last)) | Q(period='week', period_start__range=(first_week, last_week))
+        ).delete()
+        days = (
+            readings.exclude(**{f'{field}__isnull': True})
+            .values(field, 'metric', day=TruncDate('observed_at'))
+            .annotate(count=Count('id'), total=Sum('value'), total_sq=Sum(F('value') * F('value')), minimum=Min('value'), maximum=Max('value'))
+            .values_list(field, 'metric', 'day', *ROLLUP_FIELDS)
+        )
+        HealthRollup.objects.bulk_create([
+            HealthRollup(scope=scope, scope_id=scope_id, metric=metric, period='day', period_start=day, count=count, total=total, total_sq=total_sq, minimum=minimum, maximum=maximum)
+            for scope_id, metric, day, count, total, total_sq, minimum, maximum in days
+        ], batch_size=1000)
+
+        # Weeks add up their days, including days outside the refreshed range
+        weeks = {}
+        for scope_id, metric, day, *totals in rollups.filter(period='day', period_start__range=(first_week, last_week + dt.timedelta(days=6))).values_list('scope_id', 'metric', 'period_start', *ROLLUP_FIELDS):
+            key = (scope_id, metric, _week_start(day))
+            week = weeks.get(key)
+            weeks[key] = totals if week is None else [
+                week[0] + totals[0], week[1] + totals[1], week[2] + totals[2], min(week[3], totals[3]), max(week[4], totals[4]),
+            ]
+        HealthRollup.objects.bulk_create([
+            HealthRollup(scope=scope, scope_id=scope_id, metric=metric, period='week', period_start=week_start, **dict(zip(ROLLUP_FIELDS, totals)))
+            for (scope_id, metric, week_start), totals in weeks.items()
+        ], batch_size=1000)
+
+
+def refresh_rollups(buckets):
+    """Recompute the rollups of ``buckets``, (mouse_id, cage_id, strain_id, metric, day) tuples."""
+    if not buckets:
+        return
+    metrics = {bucket[3] for bucket in buckets}
+    first, last = min(bucket[4] for bucket in buckets), max(bucket[4] for bucket in buckets)
+    for position, scope in enumerate(SCOPES):
+        scope_ids = {bucket[position] for bucket in buckets} - {None}
+        for batch in id_batches(scope_ids):
+            _refresh(scope, batch, metrics, first, last)
+
+
+def reconcile_health_rollups(first, last=None):
+    """Rebuild every rollup of the days ``first`` to ``last`` (default: today) from the raw readings."""
+    last = last or timezone.localdate()
+    metrics = [metric for metric, _ in HealthObservation.METRIC_CHOICES]
+    for scope in SCOPES:
+        _refresh(scope, None, metrics, first, last)
+
+
+def ingest_observations(readings, device='', recorded_by=None, chunk_size=CHUNK_SIZE):
+    """Store ``(mouse_id, metric, value, observed_at)`` readings and refresh their rollups.
+
+    Every reading is checked before anything is written; a ValueError names the
+    first bad one. Readings already stored (same mouse, metric and time) are
+    skipped. Returns the number of new readings.
+    """
+    checked = {}
+    for mouse_id, metric, value, observed_at in readings:
+        if timezone.is_naive(observed_at):
+            observed_at = timezone.make_aware(observed_at)
+        checked[(mouse_id, metric, observed_at)] = check_reading(metric, value)
+    mice = {}
+    for batch in id_batches({mouse_id for mouse_id, _, _ in checked}):
+        mice.update((pk, (cage_id, strain_id)) for pk, cage_id, strain_id in Mouse.objects.filter(pk__in=batch).values_list('pk', 'cage_id', 'strain_id'))
+    missing = {mouse_id for mouse_id, _, _ in checked} - set(mice)
+    if missing:
+        raise ValueError(f"No mouse with id {min(missing)}.")
+
+    created = 0
+    keys = list(checked)
+    for offset in range(0, len(keys), chunk_size):
+        chunk = keys[offset:offset + chunk_size]
+        with transaction.atomic():
+            stored = set(HealthObservation.objects.filter(
+                mouse_id__in={mouse_id for mouse_id, _, _ in chunk},
+                observed_at__range=(min(key[2] for key in chunk), max(key[2] for key in chunk)),
+            ).values_list('mouse_id', 'metric', 'observed_at'))
+            observations = [
+                HealthObservation(
+                    mouse_id=mouse_id, cage_id=mice[mouse_id][0], strain_id=mice[mouse_id][1], metric=metric,
+                    value=checked[(mouse_id, metric, observed_at)], observed_at=observed_at, device=device, recorded_by=recorded_by,
+                )
+                for mouse_id, metric, observed_at in chunk if (mouse_id, metric, observed_at) not in stored
+            ]
+            # Conflicts can only come from a concurrent upload of the same readings
+            HealthObservation.objects.bulk_create(observations, ignore_conflicts=True)
+            refresh_rollups({_bucket(observation) for observation in observations})
+        created += len(observations)
+    return created
+
+
+def _point(row):
+    count = row['count']
+    mean = row['total'] / count
+    # Clamped, as rounding can take the variance of near-identical readings below zero
+    variance = max(row['total_sq'] / count - mean * mean, 0.0)
+    return {
+        'period_start': row['period_start'], 'count': count, 'mean': mean, 'sd': math.sqrt(variance),
+        'min': row['minimum'], 'max': row['maximum'],
+    }
+
+
+def health_trend(metric, scope, scope_ids, period='day', start=None, end=None):
+    """``metric`` per day or week over the rollups of ``scope_ids`` (ids or a values_list queryset), oldest first.
+
+    The rollups of several ids are combined per period. Each point has
+    ``period_start``, ``count``, ``mean``, ``sd``, ``min`` and ``max``.
+    """
+    if metric not in HealthObservation.METRIC_RANGES:
+        raise ValueError(f"Unknown metric '{metric}'.")
+    if scope not in SCOPES or period not in PERIODS:
+        raise ValueError(f"Unknown trend '{scope}' by '{period}'.")
+    rollups = HealthRollup.objects.filter(scope=scope, scope_id__in=scope_ids, metric=metric, period=period)
+    if start is not None:
+        rollups = rollups.filter(period_start__gte=_week_start(start) if period == 'week' else start)
+    if end is not None:
+        rollups = rollups.filter(period_start__lte=end)
+    rows = (
+        rollups.values('period_start')
+        .annotate(count=Sum('count'), total=Sum('total'), total_sq=Sum('total_sq'), minimum=Min('minimum'), maximum=Max('maximum'))
+        .order_by('period_start')
+    )
+    return [_point(row) for row in rows]
+
+
+def room_trend(location, metric, period='day', start=None, end=None, cages=None):
+    """``health_trend`` over the cages in ``location`` (``cages``: the Cage queryset to pick them from)."""
+    cages = Cage.objects.all() if cages is None else cages
+    return health_trend(metric, 'cage', cages.filter(location=location).values_list('pk', flat=True), period, start, end)
+
+
+@receiver(post_save, sender=HealthObservation)
+def refresh_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    buckets = {_bucket(instance)}
+    if not created:
+        buckets.add(_bucket(instance, loaded=True))
+    refresh_rollups(buckets)
+
+
+@receiver(post_delete, sender=HealthObservation)
+def refresh_on_delete(sender, instance, **kwargs):
+    refresh_rollups({_bucket(instance)})
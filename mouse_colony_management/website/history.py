@@ -0,0 +1,263 @@
+"""Append-only colony history and point-in-time ("as of") reconstruction.
+
+Every change to a mouse's state, cage or keeper appends one ``MouseEvent``
+holding the mouse's values just after the change. Single saves are recorded
+from ``post_save``/``post_delete``, and bulk writes from ``mice_bulk_changed``.
+Deleting a cage or a user empties the cage or keeper of their mice through
+SET_NULL, which sends no save signals; those mice are collected on
+``pre_delete`` and recorded on ``post_delete``. Inside ``batched_events()``
+the changes of each mouse are combined and written as one event per mouse
+when the block ends, for code that changes the same mice several times in
+one transaction. Events are never updated, so the history survives
+``Request.complete`` and ``Breed.end_breeding`` overwriting ``Mouse.state``
+in place.
+
+``ColonySnapshot`` rows store the whole colony at a moment as one compressed
+``(n, 5)`` NumPy array of ``(mouse_id, strain_id, state code, cage_id,
+keeper_id)`` rows, sorted by mouse id. The ``snapshot_colony`` maintenance job
+takes one at the start of each day. ``colony_as_of(when)`` loads the nearest
+snapshot at or before ``when`` and replays only the events between the two
+through the ``at`` index. Each event carries absolute values, so the replay
+keeps the last event per mouse; it never scans the full history.
+
+The first snapshot is a baseline read from the mice table; the colony cannot
+be reconstructed for dates before it.
+"""
+import datetime as dt
+import io
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Cage, ColonySnapshot, Mouse, MouseEvent, User
+from .pedigree import id_batches
+from .signals import mice_bulk_changed
+
+CACHE_TIMEOUT = 60 * 60 * 24
+STATE_CODES = {state: code for code, (state, _) in enumerate(Mouse.STATE_CHOICES, start=1)}
+STATES = {code: state for state, code in STATE_CODES.items()}
+# Mouse attribute -> bit of MouseEvent.changed
+TRACKED = {'state': MouseEvent.STATE, 'cage_id': MouseEvent.CAGE, 'mouse_keeper_id': MouseEvent.KEEPER}
+ALL_TRACKED = MouseEvent.STATE | MouseEvent.CAGE | MouseEvent.KEEPER
+EVENT_FIELDS = ('mouse_id', 'strain_id', 'state', 'cage_id', 'keeper_id')
+MOUSE_FIELDS = ('pk', 'strain_id', 'state', 'cage_id', 'mouse_keeper_id')
+
+# Inside batched_events(): mouse_id -> [changed bits, (strain_id, state, cage_id, keeper_id) or None to read them]
+_batch = ContextVar('mouse_event_batch', default=None)
+
+
+class ColonyState:
+    """The mice present at ``at``, as rows of (mouse_id, strain_id, state code, cage_id, keeper_id); 0 means none."""
+
+    def __init__(self, at, rows):
+        self.at = at
+        self.rows = np.asarray(rows, dtype=np.int64).reshape(-1, 5)
+
+    @classmethod
+    def from_values(cls, at, values):
+        """From (mouse_id, strain_id, state, cage_id, keeper_id) tuples with state names and None for no cage/keeper."""
+        return cls(at, sorted(
+            (mouse_id, strain_id, STATE_CODES[state], cage_id or 0, keeper_id or 0)
+            for mouse_id, strain_id, state, cage_id, keeper_id in values
+        ))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def dumps(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, rows=self.rows)
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, at, data):
+        return cls(at, np.load(io.BytesIO(bytes(data)))['rows'])
+
+    def replay(self, events, at):
+        """This state with ``events`` (in the order they happened) applied, as of ``at``."""
+        events = np.array(
+            [(mouse_id, strain_id, state, cage_id or 0, keeper_id or 0) for mouse_id, strain_id, state, cage_id, keeper_id in events],
+            dtype=np.int64,
+        ).reshape(-1, 5)
+        combined = np.concatenate([self.rows, events])
+        # The last row of each mouse wins; np.unique also sorts by mouse id
+        _, first_from_end = np.unique(combined[::-1, 0], return_index=True)
+        rows = combined[len(combined) - 1 - first_from_end]
+        return ColonyState(at, rows[rows[:, 2] != 0])
+
+    def for_strains(self, strain_ids):
+        return ColonyState(self.at, self.rows[np.isin(self.rows[:, 1], list(strain_ids))])
+
+    def mice(self):
+        return [
+            {'mouse_id': int(mouse_id), 'strain_id': int(strain_id), 'state': STATES[int(state)], 'cage_id': int(cage_id) or None, 'keeper_id': int(keeper_id) or None}
+            for mouse_id, strain_id, state, cage_id, keeper_id in self.rows
+        ]
+
+    def counts(self):
+        """``{(strain_id, state): mice}``."""
+        pairs, counts = np.unique(self.rows[:, 1:3], axis=0, return_counts=True)
+        return {(int(strain_id), STATES[int(state)]): int(count) for (strain_id, state), count in zip(pairs, counts)}
+
+    def cage_occupancy(self):
+        """``{cage_id: mice}`` for the cages holding any."""
+        cage_ids, counts = np.unique(self.rows[self.rows[:, 3] != 0, 3], return_counts=True)
+        return dict(zip(cage_ids.tolist(), counts.tolist()))
+
+
+def _end_of_day(day):
+    return timezone.make_aware(dt.datetime.combine(day + dt.timedelta(days=1), dt.time.min)) - dt.timedelta(microseconds=1)
+
+
+def _cache_key(snapshot_id):
+    return f'colony-snapshot:{snapshot_id}'
+
+
+def _load(snapshot):
+    # Snapshots never change, so their id is the whole cache key
+    state = cache.get(_cache_key(snapshot.pk))
+    if state is None:
+        data = ColonySnapshot.objects.filter(pk=snapshot.pk).values_list('data', flat=True).get()
+        state = ColonyState.loads(snapshot.taken_at, data)
+        cache.set(_cache_key(snapshot.pk), state, CACHE_TIMEOUT)
+    return state
+
+
+def colony_as_of(when, strain_ids=None):
+    """ColonyState at ``when`` (a datetime, or a date meaning the end of that day).
+
+    Raises ValueError when ``when`` is earlier than the first snapshot.
+    """
+    if not isinstance(when, dt.datetime):
+        when = _end_of_day(when)
+    snapshot = ColonySnapshot.objects.filter(taken_at__lte=when).order_by('-taken_at').only('pk', 'taken_at').first()
+    if snapshot is None:
+        raise ValueError(f"No colony history before {when:%Y-%m-%d %H:%M}; the earliest snapshot is later.")
+    events = MouseEvent.objects.filter(at__gt=snapshot.taken_at, at__lte=when)
+    if strain_ids is not None:
+        events = events.filter(strain_id__in=list(strain_ids))
+    state = _load(snapshot).replay(list(events.order_by('at', 'id').values_list(*EVENT_FIELDS)), when)
+    return state if strain_ids is None else state.for_strains(strain_ids)
+
+
+def take_snapshot(cutoff=None):
+    """Snapshot the colony as of ``cutoff`` (default: the start of today) and return it.
+
+    Without an earlier snapshot to replay from, a baseline is read from the
+    mice table instead and stamped with the current time.
+    """
+    if cutoff is None:
+        cutoff = timezone.make_aware(dt.datetime.combine(timezone.localdate(), dt.time.min))
+    existing = ColonySnapshot.objects.filter(taken_at=cutoff).first()
+    if existing is not None:
+        return existing
+    if ColonySnapshot.objects.filter(taken_at__lt=cutoff).exists():
+        state = colony_as_of(cutoff)
+    else:
+        cutoff = timezone.now()
+        state = ColonyState.from_values(cutoff, Mouse.objects.values_list(*MOUSE_FIELDS).iterator(chunk_size=2000))
+    return ColonySnapshot.objects.create(taken_at=cutoff, mice=len(state), data=state.dumps())
+
+
+def _event(mouse_id, changed, values, at=None):
+    strain_id, state, cage_id, keeper_id = values
+    return MouseEvent(mouse_id=mouse_id, strain_id=strain_id, at=at or timezone.now(), changed=changed, state=STATE_CODES[state], cage_id=cage_id, keeper_id=keeper_id)
+
+
+def record_events(mouse_ids, changed, at=None):
+    """Append an event with the current values of each of ``mouse_ids``."""
+    batch = _batch.get()
+    if batch is not None:
+        for mouse_id in mouse_ids:
+            pending = batch.setdefault(mouse_id, [0, None])
+            pending[0] |= changed
+            pending[1] = None
+        return
+    at = at or timezone.now()
+    events = []
+    for batch in id_batches(mouse_ids):
+        events.extend(
+            _event(mouse_id, changed, values, at)
+            for mouse_id, *values in Mouse.objects.filter(pk__in=batch).values_list(*MOUSE_FIELDS)
+        )
+    MouseEvent.objects.bulk_create(events, batch_size=1000)
+
+
+@contextmanager
+def batched_events():
+    """Write one event per changed mouse when the block ends, rather than one per change.
+
+    Use it inside the transaction that makes the changes. Nothing is written
+    if the block raises.
+    """
+    if _batch.get() is not None:
+        yield
+        return
+    batch = {}
+    token = _batch.set(batch)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+    at = timezone.now()
+    values = {mouse_id: pending[1] for mouse_id, pending in batch.items() if pending[1] is not None}
+    for ids in id_batches([mouse_id for mouse_id in batch if mouse_id not in values]):
+        values.update((mouse_id, tuple(row)) for mouse_id, *row in Mouse.objects.filter(pk__in=ids).values_list(*MOUSE_FIELDS))
+    MouseEvent.objects.bulk_create(
+        [_event(mouse_id, batch[mouse_id][0], values[mouse_id], at) for mouse_id in sorted(batch) if mouse_id in values],
+        batch_size=1000,
+    )
+
+
+@receiver(post_save, sender=Mouse)
+def record_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changed = MouseEvent.CREATED | ALL_TRACKED if created else sum(bit for attname, bit in TRACKED.items() if instance.has_changed(attname))
+    if not changed:
+        return
+    values = (instance.strain_id, instance.state, instance.cage_id, instance.mouse_keeper_id)
+    batch = _batch.get()
+    if batch is None:
+        _event(instance.pk, changed, values).save()
+    else:
+        pending = batch.setdefault(instance.pk, [0, None])
+        pending[0] |= changed
+        pending[1] = values
+
+
+@receiver(post_delete, sender=Mouse)
+def record_on_delete(sender, instance, **kwargs):
+    batch = _batch.get()
+    if batch is not None:
+        # Removal supersedes the changes made earlier in the same transaction
+        batch.pop(instance.pk, None)
+    MouseEvent.objects.create(mouse_id=instance.pk, strain_id=instance.strain_id, changed=MouseEvent.REMOVED, state=0)
+
+
+@receiver(mice_bulk_changed)
+def record_on_bulk_change(sender, mouse_ids, fields=None, **kwargs):
+    changed = ALL_TRACKED if fields is None else sum(bit for attname, bit in TRACKED.items() if attname in fields)
+    if changed:
+        record_events(mouse_ids, changed)
+
+
+# Deleted cages and keepers are set to NULL on their mice without save signals
+@receiver(pre_delete, sender=Cage)
+@receiver(pre_delete, sender=User)
+def remember_mice_on_delete(sender, instance, **kwargs):
+    field = 'cage' if sender is Cage else 'mouse_keeper'
+    instance._emptied_mice = list(Mouse.objects.filter(**{field: instance.pk}).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Cage)
+@receiver(post_delete, sender=User)
+def record_on_set_null(sender, instance, **kwargs):
+    mouse_ids = getattr(instance, '_emptied_mice', None)
+    if mouse_ids:
+        record_events(mouse_ids, MouseEvent.CAGE if sender is Cage else MouseEvent.KEEPER)
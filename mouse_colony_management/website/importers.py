@@ -0,0 +1,401 @@
+"""Streaming CSV/TSV import of mice, genotypes, phenotypes and health readings.
+
+Rows are read one at a time, validated, and written in chunks with
+``bulk_create``, each chunk in its own transaction. Mice are identified by
+``(strain, tube_id)``; parents are given as tube IDs within the same strain
+and resolved through an in-memory index of the strain, so a parent may come
+from the database, an earlier row, or a later row of the same file. Invalid
+rows are reported by line number and skipped without aborting the import;
+so are lines the CSV reader cannot parse and lines that are not UTF-8 (the
+upload view and the command read files with ``errors='surrogateescape'`` so
+that such bytes reach ``read_rows``). Strains are only created for mice that
+are imported.
+
+Expected columns (header names are case-insensitive):
+
+    mice        strain, tube_id, dob, sex, [father_tube_id, mother_tube_id,
+                state, earmark, clipped_date, mouse_keeper, team]
+    genotypes   strain, tube_id, gene, allele_1, allele_2
+    phenotypes  strain, tube_id, characteristic, description
+    health      strain, tube_id, metric, value, observed_at, [device]
+
+Health readings are stored through ``website.health.ingest_observations``,
+which skips readings already present and refreshes the rollups.
+"""
+import csv
+import datetime as dt
+import itertools
+
+from django.db import transaction
+
+from .genetics import bump_genotype_versions, encode_genotypes
+from .health import check_reading, ingest_observations
+from .models import Genotype, HealthObservation, Mouse, Phenotype, Strain, Team, User
+from .search import index_mice
+from .signals import mice_bulk_changed
+
+CHUNK_SIZE = 1000
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+IMPORT_KINDS = [('mice', 'Mice'), ('genotypes', 'Genotypes'), ('phenotypes', 'Phenotypes'), ('health', 'Health readings')]
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.errors = []  # (line number, message)
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+    def __str__(self):
+        return f"{self.created} created, {len(self.errors)} errors"
+
+
+def read_rows(stream, delimiter=None, errors=None):
+    """Yield ``(line_number, row)`` for each data row of a CSV/TSV text stream.
+
+    The delimiter is guessed from the header line when not given. Lines that
+    cannot be read are skipped and added to ``errors`` as ``(line, message)``.
+    """
+    errors = [] if errors is None else errors
+    try:
+        header = stream.readline()
+    except UnicodeDecodeError:
+        errors.append((1, "The file is not UTF-8 text."))
+        return
+    if not header:
+        return
+    if delimiter is None:
+        delimiter = '\t' if '\t' in header else ','
+    reader = csv.reader(itertools.chain([header], stream), delimiter=delimiter)
+    fields = None
+    while True:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            errors.append((reader.line_num, f"Unreadable line: {error}."))
+            continue
+        except UnicodeDecodeError:
+            # A strict decoder cannot resume mid-file
+            errors.append((reader.line_num + 1, "The file is not UTF-8 text from here on; the rest was not read."))
+            return
+        try:
+            '\x1f'.join(values).encode()
+        except UnicodeEncodeError:
+            # Undecodable bytes, kept as surrogates by errors='surrogateescape'
+            errors.append((reader.line_num, "Line is not UTF-8 text."))
+            if fields is None:
+                return
+            continue
+        if fields is None:
+            fields = [name.strip().lower().replace(' ', '_') for name in values]
+        elif any(value.strip() for value in values):
+            yield reader.line_num, {name: value.strip() for name, value in zip(fields, values)}
+
+
+def _required(row, name, max_length=None):
+    value = row.get(name, '')
+    if not value:
+        raise RowError(f"Missing {name}.")
+    if max_length is not None and len(value) > max_length:
+        raise RowError(f"{name} must be at most {max_length} characters, got '{value}'.")
+    return value
+
+
+def _max_length(model, field):
+    return model._meta.get_field(field).max_length
+
+
+def _int(row, name, required=True):
+    value = _required(row, name) if required else row.get(name, '')
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise RowError(f"{name} must be a whole number, got '{value}'.")
+
+
+def _date(row, name, required=True):
+    value = _required(row, name) if required else row.get(name, '')
+    if not value:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return dt.datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise RowError(f"{name} must be a date (YYYY-MM-DD or DD/MM/YYYY), got '{value}'.")
+
+
+def _datetime(row, name):
+    value = _required(row, name)
+    try:
+        # A bare date means midnight
+        return dt.datetime.fromisoformat(value)
+    except ValueError:
+        raise RowError(f"{name} must be a date and time (YYYY-MM-DD HH:MM), got '{value}'.")
+
+
+def _choice(row, name, choices, default=None):
+    value = row.get(name, '') or default
+    if value is None:
+        raise RowError(f"Missing {name}.")
+    for key, label in choices:
+        if value.lower() in (key.lower(), label.lower()):
+            return key
+    raise RowError(f"Unknown {name} '{value}'.")
+
+
+class MouseIndex:
+    """``(strain_id, tube_id) -> (mouse_id, sex)``, loaded one strain at a time."""
+
+    def __init__(self):
+        self.strains = {}
+        self.mice = {}
+
+    def strain_id(self, name, create=False):
+        """Id of the strain ``name``; a RowError if it does not exist, unless ``create``."""
+        if self.strains.get(name) is None:
+            if create:
+                strain, _ = Strain.objects.get_or_create(name=name)
+            else:
+                strain = Strain.objects.filter(name=name).first()
+                if strain is None:
+                    self.strains[name] = None
+                    raise RowError(f"Unknown strain '{name}'.")
+            self.strains[name] = strain.pk
+            for tube_id, mouse_id, sex in Mouse.objects.filter(strain=strain).values_list('tube_id', 'mouse_id', 'sex'):
+                self.mice[strain.pk, tube_id] = (mouse_id, sex)
+        return self.strains[name]
+
+    def strain_ids(self):
+        return {strain_id for strain_id in self.strains.values() if strain_id is not None}
+
+    def get(self, strain_id, tube_id):
+        return self.mice.get((strain_id, tube_id))
+
+    def add(self, strain_id, tube_id, mouse_id, sex):
+        self.mice[strain_id, tube_id] = (mouse_id, sex)
+
+
+def _chunks(rows, size):
+    iterator = iter(rows)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _build_mouse(row, index, keepers, teams):
+    strain = _required(row, 'strain', _max_length(Strain, 'name'))
+    tube_id = _int(row, 'tube_id')
+    keeper = row.get('mouse_keeper')
+    if keeper and keeper not in keepers:
+        keepers[keeper] = User.objects.filter(username=keeper).values_list('pk', flat=True).first()
+    if keeper and keepers[keeper] is None:
+        raise RowError(f"Unknown mouse_keeper '{keeper}'.")
+    team = row.get('team')
+    if team and team not in teams:
+        teams[team] = Team.objects.filter(name=team).values_list('pk', flat=True).first()
+    if team and teams[team] is None:
+        raise RowError(f"Unknown team '{team}'.")
+    mouse = Mouse(
+        tube_id=tube_id,
+        dob=_date(row, 'dob'),
+        sex=_choice(row, 'sex', Mouse.SEX_CHOICES),
+        state=_choice(row, 'state', Mouse.STATE_CHOICES, default='alive'),
+        earmark=_choice(row, 'earmark', Mouse.CLIPPED_CHOICES) if row.get('earmark') else '',
+        clipped_date=_date(row, 'clipped_date', required=False),
+        mouse_keeper_id=keepers[keeper] if keeper else None,
+        team_id=teams[team] if team else None,
+    )
+    mouse.inherits_team = not team
+    parents = [
+        ('father', _int(row, 'father_tube_id', required=False), 'M'),
+        ('mother', _int(row, 'mother_tube_id', required=False), 'F'),
+    ]
+    if tube_id in (parents[0][1], parents[1][1]):
+        raise RowError(f"Tube {tube_id} cannot be its own parent.")
+    # Last, so that only rows that are otherwise valid create their strain
+    mouse.strain_id = index.strain_id(strain, create=True)
+    if index.get(mouse.strain_id, tube_id) is not None:
+        raise RowError(f"Tube {tube_id} already exists in strain {strain}.")
+    return mouse, [(field, tube_id, sex) for field, tube_id, sex in parents if tube_id is not None]
+
+
+def _link_parents(links, index, report):
+    """Point mice at parents that are now in the index.
+
+    Returns the links that still cannot be resolved and the mice that changed.
+    """
+    unresolved = []
+    linked = {}
+    for line, mouse, field, tube_id, sex in links:
+        parent = index.get(mouse.strain_id, tube_id)
+        if parent is None or parent[0] is None:
+            unresolved.append((line, mouse, field, tube_id, sex))
+        elif parent[1] != sex:
+            report.error(line, f"{field} tube {tube_id} is not {'male' if sex == 'M' else 'female'}; mouse imported without a {field}.")
+        else:
+            setattr(mouse, f'{field}_id', parent[0])
+            linked[mouse.pk] = mouse
+    return unresolved, list(linked.values())
+
+
+def _inherit_teams(mice):
+    """Give mice imported without a team their mother's (or father's) team, as ``Mouse.save`` does."""
+    inheriting = sorted((mouse for mouse in mice if mouse.inherits_team), key=lambda mouse: mouse.pk)
+    teams = dict(Mouse.objects.filter(pk__in={mouse.mother_id or mouse.father_id for mouse in inheriting}).values_list('pk', 'team_id'))
+    # Parents linked in the same chunk pass their team on before it is written
+    for mouse in inheriting:
+        mouse.team_id = teams[mouse.pk] = teams.get(mouse.mother_id or mouse.father_id)
+
+
+def import_mice(rows, chunk_size=CHUNK_SIZE):
+    report = ImportReport()
+    index = MouseIndex()
+    keepers = {}
+    teams = {}
+    links = []  # (line, mouse, 'father'/'mother', parent tube_id, expected sex)
+
+    for chunk in _chunks(rows, chunk_size):
+        mice = []
+        for line, row in chunk:
+            try:
+                mouse, parents = _build_mouse(row, index, keepers, teams)
+            except RowError as error:
+                report.error(line, str(error))
+                continue
+            # Reserve the key so a duplicate later in the file is rejected
+            index.add(mouse.strain_id, mouse.tube_id, None, mouse.sex)
+            mice.append(mouse)
+            links.extend((line, mouse, field, tube_id, sex) for field, tube_id, sex in parents)
+
+        with transaction.atomic():
+            Mouse.objects.bulk_create(mice)
+            if mice and mice[0].pk is None:
+                _fetch_ids(mice)
+            for mouse in mice:
+                index.add(mouse.strain_id, mouse.tube_id, mouse.pk, mouse.sex)
+            links, linked = _link_parents(links, index, report)
+            _inherit_teams(linked)
+            Mouse.objects.bulk_update(linked, ['father', 'mother', 'team'])
+            # Each chunk commits on its own, so its derived data must too
+            if mice:
+                mice_bulk_changed.send(sender=Mouse, mouse_ids=[mouse.pk for mouse in mice], strain_ids={mouse.strain_id for mouse in mice})
+            created = {mouse.pk for mouse in mice}
+            relinked = [mouse for mouse in linked if mouse.pk not in created]
+            if relinked:
+                mice_bulk_changed.send(
+                    sender=Mouse, mouse_ids=[mouse.pk for mouse in relinked],
+                    strain_ids={mouse.strain_id for mouse in relinked}, fields={'father_id', 'mother_id', 'team_id'},
+                )
+        report.created += len(mice)
+
+    for line, mouse, field, tube_id, sex in links:
+        report.error(line, f"{field} tube {tube_id} was not found; mouse imported without a {field}.")
+    return report
+
+
+def _fetch_ids(mice):
+    """Fill in primary keys on backends where bulk_create does not return them."""
+    by_strain = {}
+    for mouse in mice:
+        by_strain.setdefault(mouse.strain_id, {})[mouse.tube_id] = mouse
+    for strain_id, tubes in by_strain.items():
+        for tube_id, mouse_id in Mouse.objects.filter(strain_id=strain_id, tube_id__in=list(tubes)).values_list('tube_id', 'mouse_id'):
+            tubes[tube_id].pk = mouse_id
+
+
+def _import_mouse_records(rows, build, model, chunk_size, prepare=None):
+    report = ImportReport()
+    index = MouseIndex()
+    for chunk in _chunks(rows, chunk_size):
+        records = []
+        for line, row in chunk:
+            try:
+                strain_id = index.strain_id(_required(row, 'strain'))
+                tube_id = _int(row, 'tube_id')
+                mouse = index.get(strain_id, tube_id)
+                if mouse is None:
+                    raise RowError(f"No mouse with tube {tube_id} in strain {row['strain']}.")
+                records.append(build(mouse[0], row))
+            except RowError as error:
+                report.error(line, str(error))
+        with transaction.atomic():
+            if prepare:
+                prepare(records)
+            model.objects.bulk_create(records)
+            index_mice({record.mouse_id for record in records})
+        report.created += len(records)
+    return report, index.strain_ids()
+
+
+def import_genotypes(rows, chunk_size=CHUNK_SIZE):
+    def build(mouse_id, row):
+        return Genotype(
+            mouse_id=mouse_id,
+            gene=_required(row, 'gene', _max_length(Genotype, 'gene')),
+            allele_1=_required(row, 'allele_1', _max_length(Genotype, 'allele_1')),
+            allele_2=_required(row, 'allele_2', _max_length(Genotype, 'allele_2')),
+        )
+    report, strain_ids = _import_mouse_records(rows, build, Genotype, chunk_size, prepare=encode_genotypes)
+    if report.created:
+        bump_genotype_versions(strain_ids)
+    return report
+
+
+def import_phenotypes(rows, chunk_size=CHUNK_SIZE):
+    def build(mouse_id, row):
+        return Phenotype(
+            mouse_id=mouse_id,
+            characteristic=_required(row, 'characteristic', _max_length(Phenotype, 'characteristic')),
+            description=_required(row, 'description', _max_length(Phenotype, 'description')),
+        )
+    return _import_mouse_records(rows, build, Phenotype, chunk_size)[0]
+
+
+def import_health(rows, chunk_size=CHUNK_SIZE):
+    report = ImportReport()
+    index = MouseIndex()
+    for chunk in _chunks(rows, chunk_size):
+        by_device = {}
+        for line, row in chunk:
+            try:
+                strain_id = index.strain_id(_required(row, 'strain'))
+                tube_id = _int(row, 'tube_id')
+                mouse = index.get(strain_id, tube_id)
+                if mouse is None:
+                    raise RowError(f"No mouse with tube {tube_id} in strain {row['strain']}.")
+                metric = _required(row, 'metric').lower()
+                value = check_reading(metric, _required(row, 'value'))
+                device = row.get('device', '')
+                if len(device) > _max_length(HealthObservation, 'device'):
+                    raise RowError(f"device must be at most {_max_length(HealthObservation, 'device')} characters, got '{device}'.")
+                by_device.setdefault(device, []).append((mouse[0], metric, value, _datetime(row, 'observed_at')))
+            except ValueError as error:
+                report.error(line, str(error))
+        for device, readings in by_device.items():
+            report.created += ingest_observations(readings, device=device, chunk_size=chunk_size)
+    return report
+
+
+IMPORTERS = {
+    'mice': import_mice,
+    'genotypes': import_genotypes,
+    'phenotypes': import_phenotypes,
+    'health': import_health,
+}
+
+
+def import_colony(kind, stream, delimiter=None, chunk_size=CHUNK_SIZE):
+    """Import a CSV/TSV text stream of ``kind`` ('mice', 'genotypes', 'phenotypes' or 'health')."""
+    unreadable = []
+    report = IMPORTERS[kind](read_rows(stream, delimiter, unreadable), chunk_size=chunk_size)
+    report.errors = sorted(unreadable + report.errors, key=lambda error: error[0])
+    return report
@@ -0,0 +1,218 @@
+"""Wright inbreeding and kinship coefficients computed from compact pedigree arrays.
+
+A strain's pedigree is read in one query and stored as NumPy integer arrays
+in topological order (parents before offspring), with each mouse's sire and
+dam replaced by their row index (-1 when unknown). Coefficients come from the
+tabular method: the additive relationship matrix ``A`` is filled one row at a
+time, each row being the vectorised average of the parents' rows, over just the
+ancestors of the mice being asked about.
+
+    kinship(x, y)   = A[x, y] / 2   (coefficient of coancestry)
+    inbreeding(x)   = A[x, x] - 1   (equal to the kinship of x's parents)
+
+The dense matrix is only built over at most MAX_BATCH_ANCESTORS ancestors.
+Larger pedigrees use the recursive method instead: the kinship of a pair is
+half the sum of the younger mouse's parents' kinships with the other mouse,
+and a mouse's kinship with itself is (1 + F) / 2. Every pair reached is
+memoised on the pedigree, so later pairs reuse earlier work. One call adds at
+most MAX_COANCESTRY_STEPS new terms. A pair that needs more is returned as
+None (unknown); the terms found so far are kept, so asking again continues
+where the last call stopped.
+
+Ancestry is traced within a strain; parents recorded in another strain are
+treated as founders. Pedigrees are built from the cached strain snapshot and
+kept, with every coefficient computed so far, until the strain's snapshot
+version moves on.
+"""
+import numpy as np
+
+from .pedigree import topological_order
+from .snapshots import get_snapshot
+
+# Largest ancestor set solved as one dense matrix (~72 MB of float64)
+MAX_BATCH_ANCESTORS = 3000
+# New recursive terms one call may add, and the most a pedigree keeps
+MAX_COANCESTRY_STEPS = 200000
+MAX_COANCESTRY_TERMS = 2000000
+
+
+class StrainPedigree:
+    """Pedigree arrays and memoised coefficients for one strain."""
+
+    def __init__(self, mouse_ids, fathers, mothers):
+        parents = dict(zip(mouse_ids, zip(fathers, mothers)))
+        order = list(topological_order(parents))
+        self.mouse_ids = np.array(order, dtype=np.int64)
+        self.index = {mouse_id: position for position, mouse_id in enumerate(order)}
+        self.sire = np.array([self._parent_index(parents[m][0], i) for i, m in enumerate(order)], dtype=np.int32)
+        self.dam = np.array([self._parent_index(parents[m][1], i) for i, m in enumerate(order)], dtype=np.int32)
+        self._kinship = {}
+        # (position, position) -> kinship, lower position first, for the recursive method
+        self._coancestry = {}
+
+    def _parent_index(self, parent_id, child_position):
+        position = self.index.get(parent_id, -1)
+        # Parents outside the strain, or inside a parentage cycle, count as unknown
+        return position if position < child_position else -1
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        own = snapshot.own_rows()
+        return cls(
+            snapshot.mouse_ids[own].tolist(),
+            [parent or None for parent in snapshot.father_ids[own].tolist()],
+            [parent or None for parent in snapshot.mother_ids[own].tolist()],
+        )
+
+    def ancestry(self, positions):
+        """Sorted row indexes of ``positions`` and all of their ancestors."""
+        included = np.zeros(len(self.mouse_ids), dtype=bool)
+        frontier = np.unique(np.asarray(positions, dtype=np.int64))
+        included[frontier] = True
+        while frontier.size:
+            parents = np.concatenate((self.sire[frontier], self.dam[frontier]))
+            parents = np.unique(parents[parents >= 0])
+            frontier = parents[~included[parents]]
+            included[frontier] = True
+        return np.flatnonzero(included)
+
+    def relationship_matrix(self, subset):
+        """Additive relationship matrix over ``subset``, which must be closed under ancestry."""
+        size = len(subset)
+        local = np.full(len(self.mouse_ids), -1, dtype=np.int64)
+        local[subset] = np.arange(size)
+        sire = np.where(self.sire[subset] >= 0, local[self.sire[subset]], -1)
+        dam = np.where(self.dam[subset] >= 0, local[self.dam[subset]], -1)
+
+        matrix = np.zeros((size, size))
+        for i in range(size):
+            s, d = sire[i], dam[i]
+            row = np.zeros(i)
+            if s >= 0:
+                row += 0.5 * matrix[s, :i]
+            if d >= 0:
+                row += 0.5 * matrix[d, :i]
+            matrix[i, :i] = row
+            matrix[:i, i] = row
+            matrix[i, i] = 1.0 + (0.5 * matrix[s, d] if s >= 0 and d >= 0 else 0.0)
+        return matrix
+
+    def coancestry(self, first, second, budget=MAX_COANCESTRY_STEPS):
+        """Kinship of the rows ``first`` and ``second`` by memoised recursion, or None past ``budget`` new terms."""
+        memo = self._coancestry
+        if len(memo) > MAX_COANCESTRY_TERMS:
+            memo.clear()
+        start = len(memo)
+        stack = [(min(first, second), max(first, second))]
+        while stack:
+            older, younger = key = stack[-1]
+            if key in memo:
+                stack.pop()
+                continue
+            if older == younger:
+                s, d = int(self.sire[older]), int(self.dam[older])
+                needed = [(min(s, d), max(s, d))] if s >= 0 and d >= 0 else []
+            else:
+                # Parents come before their offspring, so the younger mouse is expanded
+                needed = [(min(parent, older), max(parent, older)) for parent in (int(self.sire[younger]), int(self.dam[younger])) if parent >= 0]
+            missing = [term for term in needed if term not in memo]
+            if missing:
+                if len(memo) - start >= budget:
+                    return None
+                stack.extend(missing)
+                continue
+            stack.pop()
+            if older == younger:
+                memo[key] = 0.5 * (1 + (memo[needed[0]] if needed else 0.0))
+            else:
+                memo[key] = 0.5 * sum(memo[term] for term in needed)
+        return memo[(min(first, second), max(first, second))]
+
+    def kinships(self, pairs):
+        """Coefficient of coancestry for each ``(mouse_id, mouse_id)`` pair.
+
+        Mice that are not part of this pedigree are treated as unrelated. On
+        large pedigrees a pair may come back as None when it needs more work
+        than one call allows.
+        """
+        results = [None] * len(pairs)
+        todo = []
+        for n, (first, second) in enumerate(pairs):
+            key = (min(first, second), max(first, second))
+            if key in self._kinship:
+                results[n] = self._kinship[key]
+            elif first not in self.index or second not in self.index:
+                results[n] = 0.0
+            else:
+                todo.append((n, key))
+        if not todo:
+            return results
+
+        positions = {self.index[mouse_id] for _, key in todo for mouse_id in key}
+        subset = self.ancestry(list(positions))
+        if len(subset) > MAX_BATCH_ANCESTORS:
+            # Too many ancestors for a dense matrix; recurse over just the terms each pair needs
+            for n, key in todo:
+                value = self.coancestry(self.index[key[0]], self.index[key[1]])
+                if value is not None:
+                    self._kinship[key] = value
+                results[n] = value
+            return results
+
+        matrix = self.relationship_matrix(subset)
+        local = {position: row for row, position in enumerate(subset)}
+        for n, key in todo:
+            value = float(matrix[local[self.index[key[0]]], local[self.index[key[1]]]] / 2)
+            self._kinship[key] = value
+            results[n] = value
+        return results
+
+    def inbreeding(self, mouse_id):
+        """Wright inbreeding coefficient of ``mouse_id`` (None when not worked out yet, see ``kinships``)."""
+        position = self.index.get(mouse_id)
+        if position is None or self.sire[position] < 0 or self.dam[position] < 0:
+            return 0.0
+        father_id = int(self.mouse_ids[self.sire[position]])
+        mother_id = int(self.mouse_ids[self.dam[position]])
+        return self.kinships([(father_id, mother_id)])[0]
+
+
+_pedigrees = {}
+
+
+def strain_pedigree(strain_id):
+    """StrainPedigree for ``strain_id``, rebuilt when its snapshot changes."""
+    snapshot = get_snapshot(strain_id)
+    if snapshot is None:
+        return StrainPedigree([], [], [])
+    version, pedigree = _pedigrees.get(strain_id, (None, None))
+    if version != snapshot.version:
+        pedigree = StrainPedigree.from_snapshot(snapshot)
+        _pedigrees[strain_id] = (snapshot.version, pedigree)
+    return pedigree
+
+
+def kinship(first, second):
+    """Coefficient of coancestry between two mice (0 for different strains, None if deferred)."""
+    if first.strain_id != second.strain_id:
+        return 0.0
+    return strain_pedigree(first.strain_id).kinships([(first.mouse_id, second.mouse_id)])[0]
+
+
+def kinship_many(pairs):
+    """Kinship for many ``(mouse, mouse)`` pairs, one matrix per strain."""
+    results = [0.0] * len(pairs)
+    by_strain = {}
+    for n, (first, second) in enumerate(pairs):
+        if first.strain_id == second.strain_id:
+            by_strain.setdefault(first.strain_id, []).append((n, (first.mouse_id, second.mouse_id)))
+    for strain_id, items in by_strain.items():
+        values = strain_pedigree(strain_id).kinships([key for _, key in items])
+        for (n, _), value in zip(items, values):
+            results[n] = value
+    return results
+
+
+def inbreeding(mouse):
+    """Wright inbreeding coefficient of an existing mouse."""
+    return strain_pedigree(mouse.strain_id).inbreeding(mouse.mouse_id)
@@ -0,0 +1,139 @@
+"""Maintenance of the MouseLineage closure table.
+
+Saving a mouse with new parents recomputes the closure rows of that mouse and
+its descendants; deleting a mouse recomputes its former descendants. Both are
+done in memory from a handful of batched reads and written back with
+``bulk_create``. ``rebuild_lineage`` regenerates the whole table and backs the
+``rebuild_lineage`` management command.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Mouse, MouseLineage
+from .pedigree import id_batches, topological_order
+from .signals import mice_bulk_changed
+
+WRITE_BATCH_SIZE = 5000
+
+
+def closure_rows(parents, known=None):
+    """Yield ``(ancestor_id, descendant_id, depth)`` for every mouse in ``parents``.
+
+    ``parents`` maps mouse_id -> (father_id, mother_id). ``known`` maps parents
+    outside that set to their already materialised ``{ancestor_id: depth}``.
+    Ancestor maps are dropped as soon as the last child has used them.
+    """
+    known = known or {}
+    remaining_children = defaultdict(int)
+    for pair in parents.values():
+        for parent in set(pair):
+            if parent in parents:
+                remaining_children[parent] += 1
+
+    computed = {}
+    for mouse_id in topological_order(parents):
+        ancestors = {}
+        for parent in set(parents[mouse_id]):
+            if parent is None:
+                continue
+            if parent in parents:
+                parent_ancestors = computed.get(parent, {})
+                remaining_children[parent] -= 1
+                if remaining_children[parent] == 0:
+                    computed.pop(parent, None)
+            else:
+                parent_ancestors = known.get(parent, {})
+            ancestors[parent] = 1
+            for ancestor, depth in parent_ancestors.items():
+                if depth + 1 < ancestors.get(ancestor, depth + 2):
+                    ancestors[ancestor] = depth + 1
+        for ancestor, depth in ancestors.items():
+            yield ancestor, mouse_id, depth
+        if remaining_children[mouse_id]:
+            computed[mouse_id] = ancestors
+
+
+def _write(rows):
+    batch = []
+    for ancestor, descendant, depth in rows:
+        batch.append(MouseLineage(ancestor_id=ancestor, descendant_id=descendant, depth=depth))
+        if len(batch) >= WRITE_BATCH_SIZE:
+            MouseLineage.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        MouseLineage.objects.bulk_create(batch)
+
+
+def refresh_lineage(mouse_ids):
+    """Recompute closure rows for ``mouse_ids`` and all of their descendants."""
+    roots = set(mouse_ids)
+    if not roots:
+        return
+    with transaction.atomic():
+        subtree = set(roots)
+        for batch in id_batches(roots):
+            subtree.update(MouseLineage.objects.filter(ancestor_id__in=batch).values_list('descendant_id', flat=True))
+
+        parents = {}
+        for batch in id_batches(subtree):
+            for mouse_id, father_id, mother_id in Mouse.objects.filter(mouse_id__in=batch).values_list('mouse_id', 'father_id', 'mother_id'):
+                parents[mouse_id] = (father_id, mother_id)
+
+        outside = {parent for pair in parents.values() for parent in pair if parent is not None and parent not in parents}
+        known = defaultdict(dict)
+        for batch in id_batches(outside):
+            for ancestor, descendant, depth in MouseLineage.objects.filter(descendant_id__in=batch).values_list('ancestor_id', 'descendant_id', 'depth'):
+                known[descendant][ancestor] = depth
+
+        for batch in id_batches(subtree):
+            MouseLineage.objects.filter(descendant_id__in=batch).delete()
+        _write(closure_rows(parents, known))
+
+
+def rebuild_lineage():
+    """Regenerate the whole closure table; returns the number of rows written."""
+    parents = {
+        mouse_id: (father_id, mother_id)
+        for mouse_id, father_id, mother_id in Mouse.objects.values_list('mouse_id', 'father_id', 'mother_id').iterator(chunk_size=WRITE_BATCH_SIZE)
+    }
+    written = 0
+
+    def counted(rows):
+        nonlocal written
+        for row in rows:
+            written += 1
+            yield row
+
+    with transaction.atomic():
+        MouseLineage.objects.all().delete()
+        _write(counted(closure_rows(parents)))
+    return written
+
+
+@receiver(post_save, sender=Mouse)
+def update_lineage_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or instance.has_changed('father_id', 'mother_id'):
+        refresh_lineage([instance.mouse_id])
+
+
+@receiver(pre_delete, sender=Mouse)
+def remember_descendants_on_delete(sender, instance, **kwargs):
+    instance._lineage_children = list(
+        Mouse.objects.filter(father_id=instance.mouse_id).values_list('mouse_id', flat=True)
+    ) + list(Mouse.objects.filter(mother_id=instance.mouse_id).values_list('mouse_id', flat=True))
+
+
+@receiver(post_delete, sender=Mouse)
+def update_lineage_on_delete(sender, instance, **kwargs):
+    refresh_lineage(getattr(instance, '_lineage_children', []))
+
+
+@receiver(mice_bulk_changed)
+def update_lineage_on_bulk_change(sender, mouse_ids, fields=None, **kwargs):
+    if fields is None or {'father_id', 'mother_id'} & set(fields):
+        refresh_lineage(mouse_ids)
@@ -0,0 +1,220 @@
+"""Litter records and the running breeding statistics built from them.
+
+A Litter is recorded automatically the first time a pup of a
+``(father, mother, dob)`` is saved, and its ``born`` count is raised to the
+number of pups on record whenever staff have entered fewer. Staff fill in
+``born``, ``wean_date`` and ``weaned`` through the admin.
+
+Saving or deleting a Litter recomputes its pair's PairLitterStats from the
+pair's few litters (one indexed aggregate) and moves the strain's
+StrainLitterStats by the difference with ``count = count + n`` updates, so
+breeding reports read precomputed rows instead of aggregating history.
+``reconcile_litter_stats`` rebuilds both tables from the Litter rows; it
+backs bulk writes and the nightly ``reconcile_rollups`` command.
+"""
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Breed, Litter, Mouse, PairLitterStats, StrainLitterStats
+from .pedigree import id_batches
+from .rollups import _bump
+from .signals import mice_bulk_changed
+
+COUNTED = ('litters', 'born', 'weaned_litters', 'born_in_weaned', 'weaned')
+PARENTAGE = ('father_id', 'mother_id', 'dob')
+
+
+TOTALS = {
+    'litters': Count('pk'),
+    'born': Coalesce(Sum('born'), 0),
+    'weaned_litters': Count('weaned'),
+    'born_in_weaned': Coalesce(Sum('born', filter=Q(weaned__isnull=False)), 0),
+    'weaned': Coalesce(Sum('weaned'), 0),
+    'first_birth': Min('birth_date'),
+    'last_birth': Max('birth_date'),
+    # A pair's litters all count towards the mother's strain
+    'strain_id': Max('strain_id'),
+}
+
+
+def _aliased():
+    # Annotations may not reuse the names of Litter's own fields
+    return {f'{field}_total': expression for field, expression in TOTALS.items()}
+
+
+def _unaliased(row):
+    return {field: row[f'{field}_total'] for field in TOTALS}
+
+
+def _contribution(stats):
+    """What a pair adds to its strain's totals, from a PairLitterStats-like dict."""
+    if not stats or not stats['litters']:
+        return {}
+    contribution = {field: stats[field] for field in COUNTED}
+    contribution['interval_days_total'] = (stats['last_birth'] - stats['first_birth']).days
+    contribution['intervals'] = stats['litters'] - 1
+    return contribution
+
+
+def breed_for(breeds, birth_date):
+    """Primary key of the breeding a litter born on ``birth_date`` came from.
+
+    ``breeds`` are the pair's ``(start_date, pk)``; the latest one started by
+    the birth is chosen, else the earliest.
+    """
+    breeds = sorted(breeds)
+    started = [pk for start_date, pk in breeds if start_date.date() <= birth_date]
+    if started:
+        return started[-1]
+    return breeds[0][1] if breeds else None
+
+
+def refresh_pair(father_id, mother_id):
+    """Recompute one pair's stats from its litters and apply the change to its strain."""
+    pair = {'father_id': father_id, 'mother_id': mother_id}
+    with transaction.atomic():
+        row = PairLitterStats.objects.select_for_update().filter(**pair).values().first()
+        stats = _unaliased(Litter.objects.filter(**pair).aggregate(**_aliased()))
+        before, after = _contribution(row), _contribution(stats)
+        if row and stats['litters'] and row['strain_id'] == stats['strain_id']:
+            _bump(StrainLitterStats, {'strain_id': row['strain_id']}, **{field: after[field] - before[field] for field in after})
+        else:
+            if row:
+                _bump(StrainLitterStats, {'strain_id': row['strain_id']}, **{field: -value for field, value in before.items()})
+            if stats['litters']:
+                _bump(StrainLitterStats, {'strain_id': stats['strain_id']}, **after)
+
+        if not stats['litters']:
+            PairLitterStats.objects.filter(**pair).delete()
+        else:
+            PairLitterStats.objects.update_or_create(defaults=stats, **pair)
+
+
+def record_litter(father_id, mother_id, dob):
+    """Make sure the pups of ``father_id`` x ``mother_id`` born on ``dob`` have a Litter."""
+    if father_id is None or mother_id is None:
+        return
+    recorded = Mouse.objects.filter(father_id=father_id, mother_id=mother_id, dob=dob).count()
+    litter = Litter.objects.filter(father_id=father_id, mother_id=mother_id, birth_date=dob).first()
+    if litter is None and recorded:
+        Litter(father_id=father_id, mother_id=mother_id, birth_date=dob, born=recorded).save()
+    elif litter is not None and litter.born < recorded:
+        litter.born = recorded
+        litter.save()
+
+
+def record_litters(triples):
+    """``record_litter`` for many ``(father_id, mother_id, dob)`` at once; returns the pairs touched."""
+    triples = {triple for triple in triples if None not in triple[:2]}
+    pairs = {(father_id, mother_id) for father_id, mother_id, _ in triples}
+    with transaction.atomic():
+        for fathers in id_batches({father_id for father_id, _ in pairs}):
+            recorded = {
+                (father_id, mother_id, dob): pups
+                for father_id, mother_id, dob, pups in Mouse.objects.filter(father_id__in=fathers, mother__isnull=False)
+                .values('father_id', 'mother_id', 'dob').annotate(pups=Count('pk')).order_by()
+                .values_list('father_id', 'mother_id', 'dob', 'pups')
+                if (father_id, mother_id, dob) in triples
+            }
+            existing = {
+                (litter.father_id, litter.mother_id, litter.birth_date): litter
+                for litter in Litter.objects.filter(father_id__in=fathers)
+            }
+            batch = set(fathers)
+            mothers = {mother_id for father_id, mother_id in pairs if father_id in batch}
+            strains = dict(Mouse.objects.filter(pk__in=list(mothers)).values_list('pk', 'strain_id'))
+            breeds = {}
+            for male_id, female_id, start_date, pk in Breed.objects.filter(male_id__in=fathers).values_list('male_id', 'female_id', 'start_date', 'pk'):
+                breeds.setdefault((male_id, female_id), []).append((start_date, pk))
+
+            created, grown = [], []
+            for (father_id, mother_id, dob), pups in recorded.items():
+                litter = existing.get((father_id, mother_id, dob))
+                if litter is None:
+                    created.append(Litter(
+                        father_id=father_id, mother_id=mother_id, strain_id=strains[mother_id], birth_date=dob, born=pups,
+                        breed_id=breed_for(breeds.get((father_id, mother_id), []), dob),
+                    ))
+                elif litter.born < pups:
+                    litter.born = pups
+                    grown.append(litter)
+            Litter.objects.bulk_create(created)
+            Litter.objects.bulk_update(grown, ['born'])
+    return pairs
+
+
+def _pair_stats(row):
+    return PairLitterStats(father_id=row['father_id'], mother_id=row['mother_id'], **_unaliased(row))
+
+
+def reconcile_litter_stats(pairs=None):
+    """Rebuild pair stats (for every pair or just ``pairs``) and the strain stats they feed."""
+    totals = Litter.objects.values('father_id', 'mother_id').annotate(**_aliased()).order_by()
+    with transaction.atomic():
+        if pairs is None:
+            strain_ids = None
+            PairLitterStats.objects.all().delete()
+            PairLitterStats.objects.bulk_create(_pair_stats(row) for row in totals)
+        else:
+            pairs, strain_ids = set(pairs), set()
+            for fathers in id_batches({father_id for father_id, _ in pairs}):
+                stale = [
+                    (pk, strain_id) for pk, father_id, mother_id, strain_id
+                    in PairLitterStats.objects.filter(father_id__in=fathers).values_list('pk', 'father_id', 'mother_id', 'strain_id')
+                    if (father_id, mother_id) in pairs
+                ]
+                PairLitterStats.objects.filter(pk__in=[pk for pk, _ in stale]).delete()
+                fresh = [_pair_stats(row) for row in totals.filter(father_id__in=fathers) if (row['father_id'], row['mother_id']) in pairs]
+                PairLitterStats.objects.bulk_create(fresh)
+                strain_ids.update(strain_id for _, strain_id in stale)
+                strain_ids.update(row.strain_id for row in fresh)
+        _reconcile_strains(strain_ids)
+
+
+def _reconcile_strains(strain_ids=None):
+    rows = PairLitterStats.objects.values()
+    stale = StrainLitterStats.objects.all()
+    if strain_ids is not None:
+        rows = rows.filter(strain_id__in=list(strain_ids))
+        stale = stale.filter(strain_id__in=list(strain_ids))
+    strains = {}
+    for row in rows.iterator():
+        strain = strains.setdefault(row['strain_id'], {})
+        for field, value in _contribution(row).items():
+            strain[field] = strain.get(field, 0) + value
+    stale.delete()
+    StrainLitterStats.objects.bulk_create(StrainLitterStats(strain_id=strain_id, **fields) for strain_id, fields in strains.items())
+
+
+@receiver(post_save, sender=Mouse)
+def record_litter_of_pup(sender, instance, created, raw=False, **kwargs):
+    if not raw and (created or instance.has_changed(*PARENTAGE)):
+        record_litter(instance.father_id, instance.mother_id, instance.dob)
+
+
+@receiver(post_save, sender=Litter)
+def update_litter_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if not created and instance.has_changed('father_id', 'mother_id'):
+        refresh_pair(instance.loaded_value('father_id'), instance.loaded_value('mother_id'))
+    if created or instance.has_changed('father_id', 'mother_id', 'birth_date', 'born', 'weaned', 'strain_id'):
+        refresh_pair(instance.father_id, instance.mother_id)
+
+
+@receiver(post_delete, sender=Litter)
+def update_litter_stats_on_delete(sender, instance, **kwargs):
+    refresh_pair(instance.loaded_value('father_id'), instance.loaded_value('mother_id'))
+
+
+@receiver(mice_bulk_changed)
+def record_litters_after_bulk_change(sender, mouse_ids, strain_ids, fields=None, **kwargs):
+    if fields is not None and not set(PARENTAGE) & set(fields):
+        return
+    triples = set()
+    for batch in id_batches(mouse_ids):
+        triples.update(Mouse.objects.filter(pk__in=batch, father__isnull=False, mother__isnull=False).values_list(*PARENTAGE))
+    reconcile_litter_stats(record_litters(triples))
@@ -0,0 +1,247 @@
+"""Periodic colony maintenance sweeps and the DB-backed job table that schedules them.
+
+Each entry of ``SWEEPS`` is a job that ``run_maintenance`` workers pick up
+from the ``MaintenanceJob`` table. A worker claims a due job with
+``SELECT ... FOR UPDATE SKIP LOCKED`` and takes a lease on it
+(``locked_until``), so any number of workers can run side by side. No two
+of them run the same job, and a job whose worker died is picked up again
+once the lease runs out. Leases are renewed after every chunk; a worker
+whose lease was taken over in the meantime stops its sweep there.
+
+Sweeps never scan or lock a whole table. They walk the matching rows in
+keyset-paginated chunks over the primary key, using the partial and
+composite indexes of the filters. Each chunk is handled in its own short
+transaction: its rows are re-read with ``SKIP LOCKED`` (rows someone is
+editing are left for the next run), and written back with one bulk
+statement. Derived data is brought up to date as for other bulk writes
+(``mice_bulk_changed``, ``reconcile_*``).
+
+    wean_litters           litters past weaning age with no weaning recorded
+                           (``weaned`` stays empty when no pups were entered as mice)
+    flag_cull_age          alive mice older than their strain's cull age -> to_be_culled
+    end_stale_breeds       active breeds older than MAX_BREEDING_DAYS are ended
+    expire_approved        requests approved but not completed within the expiry -> rejected
+    snapshot_colony        a ColonySnapshot as of the start of the day, for "as of" queries
+    stamp_replication      the primary's ReplicationHeartbeat, which replica lag is measured against
+"""
+import datetime as dt
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q, Value
+from django.db.models.functions import Coalesce, Concat
+from django.utils import timezone
+
+from .bulk_requests import process_requests
+from .history import take_snapshot
+from .litters import reconcile_litter_stats
+from .models import Breed, Litter, MaintenanceJob, Mouse, Request, Strain
+from .rollups import reconcile_cages
+from .routers import stamp_heartbeat
+from .signals import mice_bulk_changed
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+# How long a claimed job stays locked without its worker checking in
+LEASE = dt.timedelta(minutes=10)
+
+
+class LeaseLost(Exception):
+    """The job was taken over by another worker after this one's lease ran out."""
+
+
+def _setting(name, default):
+    return dt.timedelta(days=getattr(settings, name, default))
+
+
+def keyset_chunks(queryset, size=CHUNK_SIZE):
+    """Primary keys of ``queryset`` in ascending chunks of ``size``, one indexed query per chunk."""
+    key = queryset.model._meta.pk.attname
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        chunk = list(page.order_by(key).values_list(key, flat=True)[:size])
+        if not chunk:
+            return
+        yield chunk
+        last = chunk[-1]
+
+
+def _lock(queryset, chunk):
+    """The rows of ``chunk`` that still match ``queryset`` and nobody else holds."""
+    return queryset.select_for_update(skip_locked=True).filter(pk__in=chunk)
+
+
+def wean_litters(heartbeat=lambda: None, today=None):
+    """Record litters past weaning age as weaned today, with their pups still alive.
+
+    Litters recorded only by count have no pups to go by; they get a wean date
+    but ``weaned`` stays empty, so their survival is not counted as known.
+    """
+    today = today or timezone.localdate()
+    overdue = Litter.objects.filter(weaned__isnull=True, wean_date__isnull=True, birth_date__lte=today - _setting('WEANING_AGE_DAYS', 21))
+    done = 0
+    for chunk in keyset_chunks(overdue):
+        with transaction.atomic():
+            litters = list(_lock(overdue, chunk))
+            if not litters:
+                continue
+            alive = {
+                (father_id, mother_id, dob): pups
+                for father_id, mother_id, dob, pups in Mouse.objects.filter(
+                    father_id__in={litter.father_id for litter in litters}, mother__isnull=False,
+                ).values('father_id', 'mother_id', 'dob').annotate(pups=Count('pk', filter=~Q(state='deceased'))).order_by()
+                .values_list('father_id', 'mother_id', 'dob', 'pups')
+            }
+            for litter in litters:
+                litter.wean_date = today
+                pups = alive.get((litter.father_id, litter.mother_id, litter.birth_date))
+                if pups is not None:
+                    litter.weaned = min(litter.born, pups)
+            Litter.objects.bulk_update(litters, ['wean_date', 'weaned'])
+            reconcile_litter_stats({(litter.father_id, litter.mother_id) for litter in litters})
+        done += len(litters)
+        heartbeat()
+    return done
+
+
+def flag_cull_age(heartbeat=lambda: None, today=None):
+    """Mark alive mice older than their strain's cull age as to be culled."""
+    today = today or timezone.localdate()
+    done = 0
+    for strain_id, cull_age_days in Strain.objects.filter(cull_age_days__isnull=False).values_list('pk', 'cull_age_days'):
+        # Served by the (strain, state) index
+        overdue = Mouse.objects.filter(strain_id=strain_id, state='alive', dob__lte=today - dt.timedelta(days=cull_age_days))
+        for chunk in keyset_chunks(overdue):
+            with transaction.atomic():
+                mouse_ids = list(_lock(overdue, chunk).values_list('pk', flat=True))
+                if not mouse_ids:
+                    continue
+                Mouse.objects.filter(pk__in=mouse_ids).update(state='to_be_culled')
+                mice_bulk_changed.send(sender=Mouse, mouse_ids=mouse_ids, strain_ids={strain_id}, fields={'state'})
+            done += len(mouse_ids)
+            heartbeat()
+    return done
+
+
+def end_stale_breeds(heartbeat=lambda: None, now=None):
+    """End breeds active for longer than MAX_BREEDING_DAYS and return their mice to 'alive'."""
+    now = now or timezone.now()
+    stale = Breed.objects.filter(end_date__isnull=True, start_date__lte=now - _setting('MAX_BREEDING_DAYS', 270))
+    done = 0
+    for chunk in keyset_chunks(stale):
+        with transaction.atomic():
+            breeds = list(_lock(stale, chunk).values_list('pk', 'male_id', 'female_id', 'cage_id'))
+            if not breeds:
+                continue
+            Breed.objects.filter(pk__in=[breed[0] for breed in breeds]).update(end_date=now)
+            parents = {mouse_id for breed in breeds for mouse_id in breed[1:3]}
+            # A mouse still in another active breed keeps breeding
+            still_breeding = set(
+                Breed.objects.filter(Q(male_id__in=parents) | Q(female_id__in=parents), end_date__isnull=True).values_list('male_id', 'female_id')
+            )
+            retired = parents - {mouse_id for pair in still_breeding for mouse_id in pair}
+            mice = Mouse.objects.filter(pk__in=retired, state='breeding')
+            strain_ids = set(mice.values_list('strain_id', flat=True))
+            mouse_ids = list(mice.values_list('pk', flat=True))
+            Mouse.objects.filter(pk__in=mouse_ids).update(state='alive')
+            reconcile_cages({breed[3] for breed in breeds})
+            mice_bulk_changed.send(sender=Mouse, mouse_ids=mouse_ids, strain_ids=strain_ids, fields={'state'})
+        done += len(breeds)
+        heartbeat()
+    return done
+
+
+def expire_approved(heartbeat=lambda: None, now=None):
+    """Reject requests left approved for longer than APPROVED_REQUEST_EXPIRY_DAYS."""
+    now = now or timezone.now()
+    expiry = _setting('APPROVED_REQUEST_EXPIRY_DAYS', 14)
+    stuck = Request.objects.filter(status='approved', updated_at__lte=now - expiry)
+    note = f"\nExpired: approved but not completed within {expiry.days} days."
+    done = 0
+    for chunk in keyset_chunks(stuck):
+        with transaction.atomic():
+            request_ids = list(_lock(stuck, chunk).values_list('pk', flat=True))
+            report = process_requests(request_ids, 'reject')
+            Request.objects.filter(pk__in=report.done).update(comments=Concat(Coalesce('comments', Value('')), Value(note)))
+        done += len(report.done)
+        heartbeat()
+    return done
+
+
+def snapshot_colony(heartbeat=lambda: None):
+    """Snapshot the colony as of the start of today unless that snapshot exists; returns its mice."""
+    return take_snapshot().mice
+
+
+def stamp_replication(heartbeat=lambda: None):
+    """Stamp the primary's replication heartbeat (see website.routers)."""
+    stamp_heartbeat()
+    return 1
+
+
+# job name -> (sweep, default interval between runs)
+SWEEPS = {
+    'wean_litters': (wean_litters, dt.timedelta(hours=6)),
+    'flag_cull_age': (flag_cull_age, dt.timedelta(hours=6)),
+    'end_stale_breeds': (end_stale_breeds, dt.timedelta(days=1)),
+    'expire_approved': (expire_approved, dt.timedelta(hours=1)),
+    'snapshot_colony': (snapshot_colony, dt.timedelta(hours=6)),
+    'stamp_replication': (stamp_replication, dt.timedelta(minutes=1)),
+}
+
+
+def ensure_jobs():
+    """Create a MaintenanceJob row for every sweep that does not have one yet."""
+    existing = set(MaintenanceJob.objects.values_list('name', flat=True))
+    MaintenanceJob.objects.bulk_create(
+        [MaintenanceJob(name=name, interval=interval) for name, (_, interval) in SWEEPS.items() if name not in existing],
+        ignore_conflicts=True,
+    )
+
+
+def claim_job(worker, names=None, now=None):
+    """Lease the most overdue enabled job (optionally one of ``names``) to ``worker``, or return None."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = (
+            MaintenanceJob.objects.select_for_update(skip_locked=True)
+            .filter(enabled=True, next_run_at__lte=now)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .order_by('next_run_at')
+        )
+        if names:
+            due = due.filter(name__in=names)
+        job = due.first()
+        if job is not None:
+            job.locked_by, job.locked_until, job.last_started_at = worker, now + LEASE, now
+            job.save(update_fields=['locked_by', 'locked_until', 'last_started_at'])
+    return job
+
+
+def run_job(job, worker):
+    """Run a claimed job's sweep, record the outcome and release the lease. Returns the rows handled."""
+    def heartbeat():
+        if not MaintenanceJob.objects.filter(pk=job.pk, locked_by=worker).update(locked_until=timezone.now() + LEASE):
+            raise LeaseLost(job.name)
+
+    sweep, _ = SWEEPS[job.name]
+    done, failed = 0, False
+    try:
+        done = sweep(heartbeat)
+        result = f"{done} rows"
+    except LeaseLost:
+        # The new holder records the outcome and releases the job
+        logger.warning("Maintenance job %s was taken over from %s", job.name, worker)
+        return 0
+    except Exception as error:
+        logger.exception("Maintenance job %s failed", job.name)
+        failed, result = True, f"Failed: {error}"[:255]
+    finished = timezone.now()
+    MaintenanceJob.objects.filter(pk=job.pk, locked_by=worker).update(
+        locked_by='', locked_until=None, last_finished_at=finished, last_result=result,
+        next_run_at=finished + job.interval, failures=job.failures + 1 if failed else 0,
+    )
+    return done
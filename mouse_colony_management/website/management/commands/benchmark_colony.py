@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from website.benchmarks import HOT_PATHS, benchmark_paths, compare, load_baseline, save_baseline
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / 'benchmark_baseline.json'
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the hot code paths (wall time, queries, peak memory) on synthetic colonies of "
+        "several sizes and compare them with the stored baseline. Generated data is rolled back. "
+        "Run locally with DB_ENGINE=sqlite."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1000,10000', help="Comma-separated colony sizes in mice (default: 1000,10000).")
+        parser.add_argument('--path', action='append', choices=sorted(HOT_PATHS), help="Only run this path (repeatable).")
+        parser.add_argument('--repeat', type=int, default=3, help="Warm runs per path.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument('--tolerance', type=float, default=0.5, help="Allowed slowdown or memory growth as a fraction (default: 0.5).")
+        parser.add_argument('--save-baseline', action='store_true', help="Write these results as the new baseline instead of comparing.")
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',') if scale.strip()]
+        except ValueError:
+            raise CommandError("--scales must be a comma-separated list of whole numbers.")
+
+        results = benchmark_paths(scales, options['path'], options['repeat'], options['seed'])
+        for result in results:
+            self.stdout.write(str(result))
+
+        if options['save_baseline']:
+            save_baseline(options['baseline'], results)
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['baseline']}."))
+            return
+        if not Path(options['baseline']).exists():
+            self.stdout.write(self.style.WARNING(f"No baseline at {options['baseline']}; run with --save-baseline to create one."))
+            return
+        regressions = compare(results, load_baseline(options['baseline']), options['tolerance'])
+        if regressions:
+            raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
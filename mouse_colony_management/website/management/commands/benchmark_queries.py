@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from website.benchmarks import HOT_QUERIES, benchmark_queries
+from website.synthetic import generate_colony
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the hot colony lookups and print their query plans. With --generate, a synthetic "
+        "colony is created first and rolled back afterwards unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', type=int, metavar='MICE', help="Generate a synthetic colony of this many mice (e.g. 100000).")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help="Keep the generated colony instead of rolling it back.")
+        parser.add_argument('--query', action='append', choices=sorted(HOT_QUERIES), help="Only run this query (repeatable).")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--output', help="Also write the results as JSON to this file.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['generate']:
+                summary = generate_colony(options['generate'], seed=options['seed'])
+                self.stdout.write(f"Generated {summary}.")
+            results = benchmark_queries(options['query'], options['repeat'])
+            if options['generate'] and not options['keep']:
+                transaction.set_rollback(True)
+
+        for result in results:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{result.name}: {result.rows} rows, best {result.best_ms:.2f} ms, median {result.median_ms:.2f} ms"))
+            self.stdout.write(result.plan)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                json.dump([result.as_dict() for result in results], handle, indent=2)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from website.exporters import CHUNK_SIZE, DATASETS, EXPORT_FORMATS, export_colony
+from website.routers import replica_stream
+
+
+class Command(BaseCommand):
+    help = "Stream a colony dataset (mice, genotypes, phenotypes or breeds) to a file or stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS))
+        parser.add_argument('--format', dest='export_format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help="File to write (defaults to stdout).")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        chunks = replica_stream(export_colony(options['dataset'], options['export_format'], options['chunk_size']))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as handle:
+                handle.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
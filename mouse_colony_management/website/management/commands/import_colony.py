@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from website.importers import CHUNK_SIZE, IMPORTERS, import_colony
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV/TSV export of mice, genotypes, phenotypes or health readings into the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help="CSV or TSV file with a header row.")
+        parser.add_argument('--delimiter', help="Field delimiter (guessed from the header when omitted).")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        delimiter = options['delimiter']
+        if delimiter == '\\t':
+            delimiter = '\t'
+        try:
+            with open(options['path'], encoding='utf-8-sig', errors='surrogateescape', newline='') as stream:
+                report = import_colony(options['kind'], stream, delimiter, options['chunk_size'])
+        except OSError as error:
+            raise CommandError(error)
+
+        for line, message in report.errors:
+            self.stderr.write(f"Line {line}: {message}")
+        self.stdout.write(self.style.SUCCESS(f"Imported {options['kind']}: {report}."))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from website.genetics import bump_genotype_versions, encode_genotypes
+from website.models import Genotype
+
+BATCH_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = "Fill in the gene/allele dictionary codes and zygosity of genotypes recorded before they existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-encode every genotype, not only those without codes.")
+
+    def handle(self, *args, **options):
+        genotypes = Genotype.objects.select_related('mouse').only('pk', 'gene', 'allele_1', 'allele_2', 'mouse__strain_id').order_by('pk')
+        if not options['all']:
+            genotypes = genotypes.filter(locus__isnull=True)
+        updated, strain_ids, last = 0, set(), 0
+        while batch := list(genotypes.filter(pk__gt=last)[:BATCH_SIZE]):
+            with transaction.atomic():
+                Genotype.objects.bulk_update(encode_genotypes(batch), ['gene', 'allele_1', 'allele_2', 'locus', 'allele_1_code', 'allele_2_code', 'zygosity'])
+            strain_ids.update(genotype.mouse.strain_id for genotype in batch)
+            updated += len(batch)
+            last = batch[-1].pk
+        bump_genotype_versions(strain_ids)
+        self.stdout.write(self.style.SUCCESS(f"Encoded {updated} genotypes."))
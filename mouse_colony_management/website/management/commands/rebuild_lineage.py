@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from website.lineage import rebuild_lineage
+
+
+class Command(BaseCommand):
+    help = "Rebuild the MouseLineage ancestor/descendant closure table from Mouse.father/mother."
+
+    def handle(self, *args, **options):
+        rows = rebuild_lineage()
+        self.stdout.write(self.style.SUCCESS(f"Lineage rebuilt: {rows} ancestor/descendant rows."))
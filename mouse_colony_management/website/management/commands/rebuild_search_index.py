@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from website.search import get_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search documents of every strain and mouse (needed after changing SEARCH_BACKEND)."
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        documents = rebuild_index(backend)
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt with the {backend.name} backend: {documents} documents."))
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from website.breeding import parse_targets, recommend_pairs
+from website.models import Cage, Strain
+
+
+class Command(BaseCommand):
+    help = "Suggest new breeding pairs among a strain's unpaired adults, ranked on target genotype yield, age and kinship."
+
+    def add_arguments(self, parser):
+        parser.add_argument('strain', help="Strain name.")
+        parser.add_argument('--target', action='append', default=[], help="Desired pup genotype, e.g. Apoe:tm1/tm1 or Apoe:homozygous (repeatable).")
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--location', help="Only assign free cages in this location.")
+        parser.add_argument('--cage-type', help="Only assign free cages of this type.")
+        parser.add_argument('--json', action='store_true', help="Print the recommendations as JSON.")
+
+    def handle(self, *args, **options):
+        strain = Strain.objects.filter(name=options['strain']).first()
+        if strain is None:
+            raise CommandError(f"Unknown strain '{options['strain']}'.")
+        try:
+            desired = parse_targets(options['target'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        recommendations = recommend_pairs(strain.pk, desired, options['limit'], options['location'], options['cage_type'])
+        if options['json']:
+            self.stdout.write(json.dumps([recommendation.as_dict() for recommendation in recommendations], indent=2))
+            return
+        cages = dict(Cage.objects.filter(pk__in=[r.cage_id for r in recommendations]).values_list('pk', 'cage_number'))
+        for recommendation in recommendations:
+            line = (
+                f"{recommendation.father_id} x {recommendation.mother_id}: score {recommendation.score:.3f}, "
+                f"kinship {recommendation.kinship:.3f}, cage {cages.get(recommendation.cage_id, 'none free')}"
+            )
+            if recommendation.probability is not None:
+                line += f", {recommendation.probability:.0%} per pup, {recommendation.expected_pups:.1f} expected per litter"
+            self.stdout.write(line)
+        if not recommendations:
+            self.stdout.write(self.style.WARNING("No suitable pairs."))
@@ -0,0 +1,25 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from website.cages import recount_cages
+from website.health import reconcile_health_rollups
+from website.litters import reconcile_litter_stats
+from website.rollups import reconcile_all
+
+
+class Command(BaseCommand):
+    help = "Recompute the dashboard rollup tables, litter statistics, cage occupancy counters and recent health rollups from scratch. Intended to run nightly (e.g. from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--health-days', type=int, default=7, help="Rebuild the health rollups of this many past days (default 7; 0 skips them).")
+
+    def handle(self, *args, **options):
+        reconcile_all()
+        reconcile_litter_stats()
+        recount_cages()
+        if options['health_days'] > 0:
+            today = timezone.localdate()
+            reconcile_health_rollups(today - dt.timedelta(days=options['health_days'] - 1), today)
+        self.stdout.write(self.style.SUCCESS("Dashboard rollups, litter statistics, cage occupancy and health rollups reconciled."))
@@ -0,0 +1,46 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from website.maintenance import SWEEPS, claim_job, ensure_jobs, run_job
+from website.models import MaintenanceJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the colony maintenance sweeps (weaning, cull age, stale breeds, expired approvals, snapshots, replication heartbeat) as they fall due. "
+        "Jobs are leased through the MaintenanceJob table, so several workers may run at once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', action='append', choices=sorted(SWEEPS), help="Only run this job (repeatable).")
+        parser.add_argument('--once', action='store_true', help="Run the jobs that are due, then exit.")
+        parser.add_argument('--force', action='store_true', help="Treat the selected jobs as due now.")
+        parser.add_argument('--sleep', type=float, default=30.0, help="Seconds to wait when no job is due (default: 30).")
+        parser.add_argument('--worker', default=f'{socket.gethostname()}:{os.getpid()}', help="Name recorded on leased jobs.")
+
+    def handle(self, *args, **options):
+        ensure_jobs()
+        if options['force']:
+            jobs = MaintenanceJob.objects.all()
+            if options['job']:
+                jobs = jobs.filter(name__in=options['job'])
+            jobs.update(next_run_at=timezone.now())
+
+        try:
+            while True:
+                close_old_connections()
+                job = claim_job(options['worker'], options['job'])
+                if job is not None:
+                    done = run_job(job, options['worker'])
+                    self.stdout.write(f"{job.name}: {done} rows")
+                elif options['once']:
+                    return
+                else:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
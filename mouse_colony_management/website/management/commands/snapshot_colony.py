@@ -0,0 +1,23 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from website.history import take_snapshot
+
+
+class Command(BaseCommand):
+    help = "Take a colony snapshot for point-in-time queries. The first run records the baseline from the mice table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Snapshot the start of this day (YYYY-MM-DD) instead of today.")
+
+    def handle(self, *args, **options):
+        cutoff = None
+        if options['date']:
+            try:
+                cutoff = timezone.make_aware(dt.datetime.combine(dt.date.fromisoformat(options['date']), dt.time.min))
+            except ValueError as error:
+                raise CommandError(str(error))
+        snapshot = take_snapshot(cutoff)
+        self.stdout.write(self.style.SUCCESS(f"Snapshot of {snapshot.mice} mice at {snapshot.taken_at:%Y-%m-%d %H:%M}."))
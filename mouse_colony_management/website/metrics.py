@@ -0,0 +1,215 @@
+"""In-process request metrics: latency histograms, query counts and N+1 detection.
+
+``MetricsMiddleware`` times each request and wraps every database connection
+with ``execute_wrapper`` to count its queries, their total time, the slowest
+statement and statements repeated with the same shape (the usual sign of an
+N+1 loop). Results are folded into per-view counters, which only grow by
+the number of views, and the latest requests are kept in a bounded ring
+buffer. ``render_prometheus`` formats the counters in the Prometheus text
+exposition format for ``/ops/metrics``.
+
+Metrics are per process; a scraper sees each worker separately.
+"""
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+# Upper bounds of the latency histogram, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# The same statement shape this many times in one request counts as an N+1
+DUPLICATE_THRESHOLD = 5
+MAX_SQL_LENGTH = 500
+
+
+def _shape(sql):
+    """``sql`` with IN lists of any length collapsed, so batches compare equal."""
+    return re.sub(r'(%s, )+%s', '%s, ...', sql)
+
+
+class QueryRecorder:
+    """``execute_wrapper`` that tallies the statements run during one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.slowest = ('', 0.0)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            self.shapes[_shape(sql)] += 1
+            if elapsed > self.slowest[1]:
+                self.slowest = (sql, elapsed)
+
+    def duplicates(self):
+        return [(sql[:MAX_SQL_LENGTH], count) for sql, count in self.shapes.most_common() if count >= DUPLICATE_THRESHOLD]
+
+
+class Sample:
+    """One finished request, as kept in the ring buffer."""
+
+    def __init__(self, view, method, status, seconds, recorder):
+        self.at = time.time()
+        self.view = view
+        self.method = method
+        self.status = status
+        self.seconds = seconds
+        self.queries = recorder.count
+        self.query_seconds = recorder.seconds
+        self.duplicates = recorder.duplicates()
+        self.slowest_sql = recorder.slowest[0][:MAX_SQL_LENGTH]
+        self.slowest_sql_seconds = recorder.slowest[1]
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class ViewStats:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.duplicate_requests = 0
+        self.slowest_sql = ''
+        self.slowest_sql_seconds = 0.0
+
+    def add(self, sample):
+        for n, bound in enumerate(BUCKETS):
+            if sample.seconds <= bound:
+                self.buckets[n] += 1
+        self.count += 1
+        self.seconds += sample.seconds
+        self.queries += sample.queries
+        self.query_seconds += sample.query_seconds
+        self.duplicate_requests += bool(sample.duplicates)
+        if sample.slowest_sql_seconds > self.slowest_sql_seconds:
+            self.slowest_sql, self.slowest_sql_seconds = sample.slowest_sql, sample.slowest_sql_seconds
+
+
+class MetricsStore:
+    def __init__(self, size=1000):
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=size)
+        self.views = {}
+
+    def record(self, sample):
+        with self.lock:
+            self.recent.append(sample)
+            self.views.setdefault(sample.view, ViewStats()).add(sample)
+
+    def samples(self):
+        with self.lock:
+            return list(self.recent)
+
+    def stats(self):
+        with self.lock:
+            return {view: vars(stats).copy() for view, stats in self.views.items()}
+
+    def reset(self):
+        with self.lock:
+            self.recent.clear()
+            self.views.clear()
+
+
+store = MetricsStore(getattr(settings, 'METRICS_BUFFER_SIZE', 1000))
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(stats=None):
+    """The per-view counters in Prometheus text exposition format (version 0.0.4)."""
+    stats = store.stats() if stats is None else stats
+    lines = [
+        '# HELP colony_request_duration_seconds Request latency by view.',
+        '# TYPE colony_request_duration_seconds histogram',
+    ]
+    for view, row in sorted(stats.items()):
+        view = _label(view)
+        for bound, count in zip(BUCKETS, row['buckets']):
+            lines.append(f'colony_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {count}')
+        lines.append(f'colony_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {row["count"]}')
+        lines.append(f'colony_request_duration_seconds_sum{{view="{view}"}} {row["seconds"]:.6f}')
+        lines.append(f'colony_request_duration_seconds_count{{view="{view}"}} {row["count"]}')
+
+    counters = [
+        ('colony_db_queries_total', 'counter', 'ORM queries run by view.', 'queries', '{}'),
+        ('colony_db_query_seconds_total', 'counter', 'Time spent in the database by view.', 'query_seconds', '{:.6f}'),
+        ('colony_duplicate_query_requests_total', 'counter', f'Requests repeating a statement {DUPLICATE_THRESHOLD}+ times (likely N+1).', 'duplicate_requests', '{}'),
+        ('colony_slowest_query_seconds', 'gauge', 'Slowest single statement seen by view.', 'slowest_sql_seconds', '{:.6f}'),
+    ]
+    for name, kind, description, field, number in counters:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for view, row in sorted(stats.items()):
+            lines.append(f'{name}{{view="{_label(view)}"}} {number.format(row[field])}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    """Record latency and query metrics for every request outside ``/ops/``.
+
+    Works under WSGI and ASGI: async views are awaited directly, so they are
+    not pushed onto a thread just to be timed.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _wrap_queries(self, stack, recorder):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+
+    def _record(self, request, response, started, recorder):
+        seconds = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        store.record(Sample(view, request.method, response.status_code, seconds, recorder))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.path.startswith('/ops/'):
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            self._wrap_queries(stack, recorder)
+            response = self.get_response(request)
+        self._record(request, response, started, recorder)
+        return response
+
+    async def __acall__(self, request):
+        if request.path.startswith('/ops/'):
+            return await self.get_response(request)
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        # Connections are per thread and the async ORM runs its queries on
+        # the thread-sensitive sync thread, so the wrappers go on there
+        stack = ExitStack()
+        await sync_to_async(self._wrap_queries)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self._record(request, response, started, recorder)
+        return response
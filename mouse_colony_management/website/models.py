@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser, Group, Permission
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -13,16 +15,127 @@ import datetime as dt
 #     def __str__(self):
 #         return self.name
     
+# ---------- Change Tracking ----------
+class ChangeTrackingModel(models.Model):
+    """Remembers field values as loaded so save signals can tell what changed."""
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {f.attname: self.__dict__[f.attname] for f in self._meta.concrete_fields if f.attname in self.__dict__}
+
+    def has_changed(self, *attnames):
+        """True if any of ``attnames`` differs from the stored row (always True for new objects)."""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return True
+        return any(attname not in loaded or loaded[attname] != getattr(self, attname) for attname in attnames)
+
+    def loaded_value(self, attname):
+        """Value of ``attname`` as last read from or written to the database."""
+        return getattr(self, '_loaded_values', {}).get(attname, getattr(self, attname))
+
+    def mark_saved(self, *attnames):
+        """Record ``attnames`` as stored after they were written with a queryset update."""
+        if hasattr(self, '_loaded_values'):
+            self._loaded_values.update((attname, getattr(self, attname)) for attname in attnames)
+
+
+# ---------- Team Scope ----------
+class TeamScopedQuerySet(models.QuerySet):
+    """Rows visible to a user: those of their teams plus colony-wide rows without a team."""
+
+    def visible_to(self, scope):
+        """Filter by a resolved ``TeamScope``; superusers see everything."""
+        if scope.sees_everything:
+            return self
+        return self.filter(models.Q(team_id__in=scope.team_ids) | models.Q(team__isnull=True))
+
+
+# ---------- Cage Type Model ----------
+class CageType(models.Model):
+    DEFAULT_CAPACITY = 5  # adult mice per standard cage when the type has no entry
+
+    name = models.CharField(max_length=25, unique=True)  # matches Cage.cage_type
+    capacity = models.PositiveIntegerField(default=DEFAULT_CAPACITY)
+
+    def __str__(self):
+        return f"{self.name} (holds {self.capacity})"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Cage.objects.filter(cage_type=self.name).update(capacity=self.capacity)
+
+
 # ---------- Cage Model ----------
+class CageQuerySet(TeamScopedQuerySet):
+    def with_space(self, places=1):
+        return self.filter(occupancy__lte=F('capacity') - places)
+
+    def empty(self):
+        return self.filter(occupancy=0)
+
+    def find_empty(self, location, cage_type=None):
+        """First empty cage in ``location`` (optionally of ``cage_type``), via the occupancy index."""
+        cages = self.filter(location=location).empty()
+        if cage_type:
+            cages = cages.filter(cage_type=cage_type)
+        return cages.order_by('cage_number').first()
+
+    def occupancy_by_location(self):
+        """Per location: cages, full and empty cages, mice housed and places, from the occupancy counters."""
+        return self.values('location').annotate(
+            cages=models.Count('pk'),
+            full=models.Count('pk', filter=models.Q(occupancy__gte=F('capacity'))),
+            empty=models.Count('pk', filter=models.Q(occupancy=0)),
+            mice=models.Sum('occupancy'),
+            free=models.Sum(models.Case(models.When(occupancy__lt=F('capacity'), then=F('capacity') - F('occupancy')), default=0)),
+        ).order_by('location')
+
+
 class Cage(models.Model):
     cage_id = models.AutoField(primary_key=True)
     cage_number = models.CharField(max_length=10, unique=True)
     cage_type = models.CharField(max_length=25)
     location = models.CharField(max_length=25)
+    # Copied from CageType, and kept current by website.cages as mice move in and out
+    capacity = models.PositiveIntegerField(default=CageType.DEFAULT_CAPACITY, editable=False)
+    occupancy = models.PositiveIntegerField(default=0, editable=False)
+    team = models.ForeignKey('Team', on_delete=models.SET_NULL, null=True, blank=True, related_name='cages')
+
+    objects = CageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['location', 'cage_type', 'occupancy'], name='cage_location_occupancy_idx'),
+            models.Index(fields=['team', 'location'], name='cage_team_location_idx'),
+        ]
 
     def __str__(self):
         return self.cage_number
 
+    def save(self, *args, **kwargs):
+        capacity = CageType.objects.filter(name=self.cage_type).values_list('capacity', flat=True).first()
+        self.capacity = capacity if capacity is not None else CageType.DEFAULT_CAPACITY
+        super().save(*args, **kwargs)
+
+    def breeding_problem(self, *mice):
+        """Why ``mice`` cannot be paired in this cage, or None if they can."""
+        incoming = sum(1 for mouse in mice if mouse.cage_id != self.cage_id)
+        if self.occupancy + incoming > self.capacity:
+            return f"Cage {self.cage_number} is full ({self.occupancy} of {self.capacity} places taken)."
+        if CageRollup.objects.filter(cage=self, active_breeds__gt=0).exists():
+            return f"Cage {self.cage_number} already holds an active breeding pair."
+        return None
+
 
 # ---------- User Model ----------
 class User(AbstractUser):
@@ -32,6 +145,9 @@ class User(AbstractUser):
         ('new_staff', 'New Staff'),
     ]
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='new_staff')
+    # Random stamp changed whenever a membership of the user is added or removed;
+    # sessions holding team IDs with another stamp resolve them again (see website.teams)
+    team_scope_version = models.BigIntegerField(default=0, editable=False)
 
     # Enforce email validation
     def clean(self):
@@ -53,7 +169,7 @@ class Team(models.Model):
         return self.name
     
 # ---------- Team Membership ----------
-class TeamMembership(models.Model):
+class TeamMembership(ChangeTrackingModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     team = models.ForeignKey(Team, on_delete=models.CASCADE)
     
@@ -82,7 +198,7 @@ class TeamMembership(models.Model):
 
 
 # ---------- Mouse Model ----------
-class Mouse(models.Model):
+class Mouse(ChangeTrackingModel):
     SEX_CHOICES = [('M', 'Male'), ('F', 'Female')]
     CLIPPED_CHOICES = [
         ('TL', 'Top Left'),
@@ -104,32 +220,106 @@ class Mouse(models.Model):
     state = models.CharField(max_length=12, choices=STATE_CHOICES)
     cull_date = models.DateTimeField(null=True, blank=True)
     mouse_keeper = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='kept_mice')
+    cage = models.ForeignKey(Cage, on_delete=models.SET_NULL, null=True, blank=True, related_name='mice')
+    team = models.ForeignKey('Team', on_delete=models.SET_NULL, null=True, blank=True, related_name='mice', help_text="Defaults to the mother's (or father's) team.")
+
+    objects = TeamScopedQuerySet.as_manager()
 
     class Meta:
         unique_together = ('strain', 'tube_id')
+        indexes = [
+            models.Index(fields=['team', 'state'], name='mouse_team_state_idx'),
+            models.Index(fields=['state', 'sex'], name='mouse_state_sex_idx'),
+            models.Index(fields=['strain', 'state'], name='mouse_strain_state_idx'),
+            models.Index(fields=['mouse_keeper', 'state'], name='mouse_keeper_state_idx'),
+        ]
 
     def __str__(self):
         return f"Mouse {self.mouse_id} - {self.strain} - Tube {self.tube_id}"
-    
-    def get_ancestors(self):
-        ancestors = []
-        if self.mother:
-            ancestors.append(self.mother)
-            ancestors.extend(self.mother.get_ancestors())
-        if self.father:
-            ancestors.append(self.father)
-            ancestors.extend(self.father.get_ancestors())
-        return ancestors
-
-    def get_descendants(self):
-        descendants = list(self.mother_of.all()) + list(self.father_of.all())
-        for child in descendants:
-            descendants.extend(child.get_descendants())
-        return descendants
+
+    def clean(self):
+        super().clean()
+        if self.cage_id and self.has_changed('cage_id'):
+            cage = Cage.objects.get(pk=self.cage_id)
+            if cage.occupancy >= cage.capacity:
+                raise ValidationError({'cage': f"Cage {cage.cage_number} is full."})
+
+    def save(self, *args, **kwargs):
+        # Pups stay with their parents' team unless told otherwise
+        if self.team_id is None and self._state.adding and (self.mother_id or self.father_id):
+            self.team_id = Mouse.objects.filter(pk=self.mother_id or self.father_id).values_list('team_id', flat=True).first()
+        # Cage counters and history are written by post_save receivers; commit them with the row
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+    def get_ancestors(self, max_depth=None, limit=None):
+        """Return this mouse's ancestors, nearest generation first.
+
+        Each ancestor appears once and has a ``generation`` attribute
+        (1 for parents, 2 for grandparents, ...). ``limit`` caps how many
+        are returned.
+        """
+        from .pedigree import ancestor_generations, load_generations
+        return load_generations(ancestor_generations([self.mouse_id], max_depth, {self.mouse_id: self.strain_id}), limit)
+
+    def get_descendants(self, max_depth=None, limit=None):
+        """Return this mouse's descendants, nearest generation first."""
+        from .pedigree import descendant_generations, load_generations
+        return load_generations(descendant_generations([self.mouse_id], max_depth, {self.mouse_id: self.strain_id}), limit)
+
+    def get_inbreeding_coefficient(self):
+        """Wright inbreeding coefficient, from the cached strain pedigree."""
+        from .kinship import inbreeding
+        return inbreeding(self)
+
+    def is_descendant_of(self, other):
+        """Single indexed lookup against the lineage closure table."""
+        return MouseLineage.objects.filter(ancestor=other, descendant=self).exists()
+
+    def all_descendants(self):
+        """Queryset of every descendant, read from the lineage closure table."""
+        return Mouse.objects.filter(ancestor_links__ancestor=self)
+
+    def common_ancestors(self, other):
+        """Queryset of the ancestors this mouse shares with ``other``."""
+        return Mouse.objects.filter(descendant_links__descendant=self).filter(descendant_links__descendant=other)
+
+
+# ---------- Cage Assignment Model ----------
+class CageAssignment(models.Model):
+    """History of which cage each mouse was in; ``removed_at`` is null for the current one."""
+    mouse = models.ForeignKey(Mouse, on_delete=models.CASCADE, related_name='cage_assignments')
+    cage = models.ForeignKey(Cage, on_delete=models.CASCADE, related_name='assignments')
+    assigned_at = models.DateTimeField(default=timezone.now)
+    removed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['mouse', 'removed_at'], name='assignment_current_idx')]
+
+    def __str__(self):
+        return f"{self.mouse_id} in {self.cage_id} from {self.assigned_at:%Y-%m-%d}"
+
+
+# ---------- Lineage Closure Model ----------
+class MouseLineage(models.Model):
+    """Materialised ancestor/descendant pairs, kept in sync by website.lineage.
+
+    ``depth`` is the shortest number of generations between the two mice.
+    """
+    ancestor = models.ForeignKey(Mouse, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Mouse, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [models.Index(fields=['descendant', 'ancestor'], name='lineage_descendant_idx')]
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
 
 
 # ---------- Request Model ----------
-class Request(models.Model):
+class Request(ChangeTrackingModel):
     REQUEST_TYPES = [
         ('breed', 'Breeding Request'),
         ('cull', 'Culling Request'),
@@ -151,6 +341,19 @@ class Request(models.Model):
     submitted_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     comments = models.TextField(blank=True, null=True)
+    inbreeding_coefficient = models.FloatField(null=True, blank=True, editable=False, help_text="Wright inbreeding coefficient of the planned litter, i.e. the kinship of the two mice.")
+    team = models.ForeignKey('Team', on_delete=models.SET_NULL, null=True, blank=True, related_name='requests', help_text="Defaults to the mouse's team.")
+
+    objects = TeamScopedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['team', 'status'], name='request_team_status_idx'),
+            models.Index(fields=['status', 'request_type'], name='request_status_type_idx'),
+            models.Index(fields=['status', '-submitted_at'], name='request_status_submitted_idx'),
+            # The approval queue; MySQL has no partial indexes and uses the one above
+            models.Index(fields=['-submitted_at'], condition=models.Q(status='pending'), name='request_pending_idx'),
+        ]
 
     def clean(self):
         """Custom validation for the request model."""
@@ -164,6 +367,10 @@ class Request(models.Model):
             # Ensure a cage is provided for breeding requests
             if not self.cage:
                 raise ValidationError("A cage must be specified for breeding requests.")
+            # Ensure the cage has room for the pair and is not already breeding
+            problem = self.cage.breeding_problem(self.mouse, self.second_mouse)
+            if problem:
+                raise ValidationError(problem)
         elif self.request_type == 'cull':
             if self.second_mouse:
                 raise ValidationError("Culling requests should not have a second mouse.")
@@ -173,10 +380,20 @@ class Request(models.Model):
 
         super().clean()
 
+    def save(self, *args, **kwargs):
+        # Work out the planned litter's inbreeding when the pair is set so approvers can read it straight off the row
+        if self.inbreeding_coefficient is None or self.has_changed('mouse_id', 'second_mouse_id', 'request_type'):
+            from .kinship import kinship
+            is_pair = self.request_type == 'breed' and self.second_mouse_id
+            self.inbreeding_coefficient = kinship(self.mouse, self.second_mouse) if is_pair else None
+        if self.team_id is None and self._state.adding:
+            self.team_id = Mouse.objects.filter(pk=self.mouse_id).values_list('team_id', flat=True).first()
+        super().save(*args, **kwargs)
+
     def __str__(self):
         if self.request_type == 'breed':
-            return f"Breeding Request: {self.mouse.mouse_id} with {self.second_mouse.mouse_id} by {self.requester.username}"
-        return f"{self.request_type} Request by {self.requester.username} for Mouse {self.mouse.mouse_id}"
+            return f"Breeding Request: {self.mouse_id} with {self.second_mouse_id} by {self.requester.username}"
+        return f"{self.request_type} Request by {self.requester.username} for Mouse {self.mouse_id}"
 
     def approve(self):
         self.status = 'approved'
@@ -186,29 +403,38 @@ class Request(models.Model):
         self.status = 'rejected'
         self.save()
 
+    @transaction.atomic
     def complete(self):
-        self.status = 'completed'
-        self.save()
-
-        # Handle culling request completion
-        if self.request_type == 'cull':
-            self.mouse.state = 'deceased'
-            self.mouse.cull_date = dt.datetime.now()
-            self.mouse.save()
-
-        # Handle breeding request completion
-        if self.request_type == 'breed':
-            self.mouse.state = 'breeding'  # Update first mouse to breeding state
-            self.second_mouse.state = 'breeding'  # Update second mouse to breeding state
-            self.mouse.save()
-            self.second_mouse.save()
-
-            # Create a new Breed instance
-            Breed.objects.create(
-                male=self.mouse,
-                female=self.second_mouse,
-                cage=self.cage,
-            )
+        from .cages import move_mice
+        from .history import batched_events
+        # The pair changes cage and state in two steps; log each mouse once
+        with batched_events():
+            self.status = 'completed'
+            self.save()
+
+            # Handle culling request completion
+            if self.request_type == 'cull':
+                self.mouse.state = 'deceased'
+                self.mouse.cull_date = dt.datetime.now()
+                self.mouse.cage = None  # frees its place in the cage
+                self.mouse.save()
+
+            # Handle breeding request completion
+            if self.request_type == 'breed':
+                # Move the pair into the breeding cage; raises ValidationError if it has no room
+                move_mice([self.mouse, self.second_mouse], self.cage)
+                self.mouse.state = 'breeding'  # Update first mouse to breeding state
+                self.second_mouse.state = 'breeding'  # Update second mouse to breeding state
+                self.mouse.save()
+                self.second_mouse.save()
+
+                # Create a new Breed instance, whichever of the pair was named first
+                male, female = sorted([self.mouse, self.second_mouse], key=lambda mouse: mouse.sex != 'M')
+                Breed.objects.create(
+                    male=male,
+                    female=female,
+                    cage=self.cage,
+                )
 
         # # Handle end breeding request completion
         # if self.request_type == 'end_breed':
@@ -219,7 +445,7 @@ class Request(models.Model):
            
 
 # ---------- Breed Model ----------
-class Breed(models.Model):
+class Breed(ChangeTrackingModel):
     breed_id = models.AutoField(primary_key=True)
     male = models.ForeignKey(Mouse, on_delete=models.CASCADE, limit_choices_to={'sex': 'M'}, related_name='male_breeds')
     female = models.ForeignKey(Mouse, on_delete=models.CASCADE, limit_choices_to={'sex': 'F'}, related_name='female_breeds')
@@ -227,6 +453,13 @@ class Breed(models.Model):
     start_date = models.DateTimeField(auto_now_add=True)
     end_date = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Active pairs; MySQL has no partial indexes and falls back to the cage foreign key index
+            models.Index(fields=['cage'], condition=models.Q(end_date__isnull=True), name='breed_active_cage_idx'),
+            models.Index(fields=['male', 'female'], name='breed_pair_idx'),
+        ]
+
     def end_breeding(self):
         """Set the breeding as finished and update mouse states."""
         self.end_date = dt.datetime.now()
@@ -237,25 +470,111 @@ class Breed(models.Model):
         self.save()
     
     def __str__(self):
-        return f"Breeding {self.male.mouse_id} x {self.female.mouse_id}"
+        return f"Breeding {self.male_id} x {self.female_id}"
+
+# ---------- Litter Model ----------
+class Litter(ChangeTrackingModel):
+    """One birth to a pair. Its pups are the mice with this father, mother and ``dob``."""
+    litter_id = models.AutoField(primary_key=True)
+    breed = models.ForeignKey(Breed, on_delete=models.SET_NULL, null=True, blank=True, related_name='litters')
+    father = models.ForeignKey(Mouse, on_delete=models.CASCADE, related_name='sired_litters', limit_choices_to={'sex': 'M'})
+    mother = models.ForeignKey(Mouse, on_delete=models.CASCADE, related_name='litters', limit_choices_to={'sex': 'F'})
+    # The mother's strain, which the litter's statistics count towards
+    strain = models.ForeignKey('Strain', on_delete=models.CASCADE, related_name='+', editable=False)
+    birth_date = models.DateField()
+    born = models.PositiveIntegerField(default=0, help_text="Pups born, including any lost before weaning.")
+    wean_date = models.DateField(null=True, blank=True)
+    weaned = models.PositiveIntegerField(null=True, blank=True, help_text="Pups alive at weaning; empty until the litter is weaned, or if it was weaned without its pups recorded as mice.")
+
+    class Meta:
+        unique_together = ('father', 'mother', 'birth_date')
+        indexes = [
+            models.Index(fields=['strain', 'birth_date'], name='litter_strain_birth_idx'),
+            # The weaning sweep; MySQL has no partial indexes and uses the unique pair index
+            models.Index(fields=['birth_date'], condition=models.Q(weaned__isnull=True, wean_date__isnull=True), name='litter_unweaned_idx'),
+        ]
+
+    def clean(self):
+        if self.weaned is not None and self.weaned > self.born:
+            raise ValidationError("More pups weaned than were born.")
+        if self.wean_date and self.wean_date < self.birth_date:
+            raise ValidationError("A litter cannot be weaned before it is born.")
+        super().clean()
+
+    def save(self, *args, **kwargs):
+        self.strain_id = self.mother.strain_id
+        if self.breed_id is None:
+            from .litters import breed_for
+            self.breed_id = breed_for(Breed.objects.filter(male_id=self.father_id, female_id=self.mother_id).values_list('start_date', 'pk'), self.birth_date)
+        super().save(*args, **kwargs)
+
+    def pups(self):
+        return Mouse.objects.filter(father_id=self.father_id, mother_id=self.mother_id, dob=self.birth_date)
+
+    def __str__(self):
+        return f"Litter of {self.father_id} x {self.mother_id} born {self.birth_date}"
 
 # ---------- Strain Model ----------
 class Strain(models.Model):
     name = models.CharField(max_length=15, unique=True)
+    cull_age_days = models.PositiveIntegerField(null=True, blank=True, help_text="Alive mice older than this are flagged to be culled by the maintenance worker.")
+    # Re-stamped whenever a mouse of the strain changes; keys the cached pedigree snapshot
+    pedigree_version = models.BigIntegerField(default=0, editable=False)
+    # Re-stamped whenever a genotype of the strain changes; keys the cached genotype matrix
+    genotype_version = models.BigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
     
+# ---------- Gene Dictionary Models ----------
+class Gene(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Allele(models.Model):
+    """An allele symbol of a gene; its primary key is the integer code used in genotype matrices."""
+    gene = models.ForeignKey(Gene, on_delete=models.CASCADE, related_name='alleles')
+    symbol = models.CharField(max_length=50)
+
+    class Meta:
+        unique_together = ('gene', 'symbol')
+
+    def __str__(self):
+        return f"{self.gene.name} {self.symbol}"
+
+
 # ---------- Genotype Model ----------
 class Genotype(models.Model):
+    ZYGOSITY_CHOICES = [('homozygous', 'Homozygous'), ('heterozygous', 'Heterozygous')]
+
     mouse = models.ForeignKey(Mouse, on_delete=models.CASCADE, related_name='genotypes')
     gene = models.CharField(max_length=50)  # The gene or marker being tested
     allele_1 = models.CharField(max_length=50)  # First allele
     allele_2 = models.CharField(max_length=50)  # Second allele
     test_date = models.DateField(auto_now_add=True)  # Date the test was performed
+    # Dictionary-coded copies of gene/allele_1/allele_2, filled in by website.genetics
+    locus = models.ForeignKey(Gene, on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='genotypes')
+    allele_1_code = models.ForeignKey(Allele, on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='+')
+    allele_2_code = models.ForeignKey(Allele, on_delete=models.PROTECT, null=True, blank=True, editable=False, related_name='+')
+    zygosity = models.CharField(max_length=12, choices=ZYGOSITY_CHOICES, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['gene'], name='genotype_gene_idx'),
+            models.Index(fields=['mouse', 'gene'], name='genotype_mouse_gene_idx'),
+            models.Index(fields=['locus', 'zygosity'], name='genotype_locus_zygosity_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.mouse.mouse_id} - {self.gene}: {self.allele_1}/{self.allele_2}"
+        return f"{self.mouse_id} - {self.gene}: {self.allele_1}/{self.allele_2}"
+
+    def save(self, *args, **kwargs):
+        from .genetics import encode_genotypes
+        encode_genotypes([self])
+        super().save(*args, **kwargs)
 
 
 # ---------- Phenotype Model ----------
@@ -265,6 +584,278 @@ class Phenotype(models.Model):
     description = models.CharField(max_length=255)  # A description of the phenotype
     observation_date = models.DateField(auto_now_add=True)  # Date the phenotype was observed
 
+    class Meta:
+        indexes = [models.Index(fields=['characteristic'], name='phenotype_characteristic_idx')]
+
     def __str__(self):
-        return f"{self.mouse.mouse_id} - {self.characteristic}: {self.description}"
+        return f"{self.mouse_id} - {self.characteristic}: {self.description}"
+
+
+# ---------- Search Models ----------
+class SearchDocument(models.Model):
+    """Denormalized searchable text of a mouse or strain, kept current by website.search."""
+    KIND_CHOICES = [('mouse', 'Mouse'), ('strain', 'Strain')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    team = models.ForeignKey(Team, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    title = models.CharField(max_length=255)
+    text = models.TextField()
+
+    objects = TeamScopedQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+    def __str__(self):
+        return self.title
+
+
+class SearchTerm(models.Model):
+    """One distinct token of a document; prefix lookups scan the (term, document) index."""
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='terms')
+    term = models.CharField(max_length=50)
+
+    class Meta:
+        indexes = [models.Index(fields=['term', 'document'], name='search_term_idx')]
+
+
+# ---------- Colony Rollup Models ----------
+# Running totals for the dashboard, kept up to date by website.rollups and
+# rebuilt nightly by the reconcile_rollups command.
+class MouseCountRollup(models.Model):
+    strain = models.ForeignKey(Strain, on_delete=models.CASCADE, related_name='+')
+    state = models.CharField(max_length=12, choices=Mouse.STATE_CHOICES)
+    sex = models.CharField(max_length=1, choices=Mouse.SEX_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('strain', 'state', 'sex')
+
+
+class CageRollup(models.Model):
+    cage = models.OneToOneField(Cage, on_delete=models.CASCADE, primary_key=True, related_name='rollup')
+    active_breeds = models.IntegerField(default=0)
+
+
+class BreedingPairRollup(models.Model):
+    father = models.ForeignKey(Mouse, on_delete=models.CASCADE, related_name='+')
+    mother = models.ForeignKey(Mouse, on_delete=models.CASCADE, related_name='+')
+    litters = models.IntegerField(default=0)  # distinct birth dates
+    pups = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('father', 'mother')
+
+
+class RequestRollup(models.Model):
+    request_type = models.CharField(max_length=10, choices=Request.REQUEST_TYPES)
+    status = models.CharField(max_length=10, choices=Request.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('request_type', 'status')
+
+
+# ---------- Breeding Performance Models ----------
+# Running litter statistics, kept up to date from Litter rows by website.litters
+# and rebuilt by the reconcile_rollups command.
+class LitterTotals(models.Model):
+    litters = models.IntegerField(default=0)
+    born = models.IntegerField(default=0)
+    weaned_litters = models.IntegerField(default=0)
+    born_in_weaned = models.IntegerField(default=0)  # born, counting weaned litters only
+    weaned = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def pups_per_litter(self):
+        return self.born / self.litters if self.litters else None
+
+    @property
+    def wean_survival(self):
+        return self.weaned / self.born_in_weaned if self.born_in_weaned else None
 
+
+class PairLitterStats(LitterTotals):
+    father = models.ForeignKey(Mouse, on_delete=models.CASCADE, related_name='+')
+    mother = models.ForeignKey(Mouse, on_delete=models.CASCADE, related_name='+')
+    strain = models.ForeignKey(Strain, on_delete=models.CASCADE, related_name='+')
+    first_birth = models.DateField(null=True)
+    last_birth = models.DateField(null=True)
+
+    class Meta:
+        unique_together = ('father', 'mother')
+
+    @property
+    def interval_days(self):
+        """Mean days between the pair's litters."""
+        return (self.last_birth - self.first_birth).days / (self.litters - 1) if self.litters > 1 else None
+
+
+class StrainLitterStats(LitterTotals):
+    strain = models.OneToOneField(Strain, on_delete=models.CASCADE, primary_key=True, related_name='litter_stats')
+    # Summed over pairs: days from first to last litter, and the gaps in between
+    interval_days_total = models.IntegerField(default=0)
+    intervals = models.IntegerField(default=0)
+
+    @property
+    def interval_days(self):
+        return self.interval_days_total / self.intervals if self.intervals else None
+
+
+# ---------- Colony History Models ----------
+# Append-only record of mouse state, cage and keeper changes, written by
+# website.history, plus periodic snapshots that "as of" queries replay from.
+class MouseEvent(models.Model):
+    """A mouse's state, cage and keeper just after a change; rows are never updated."""
+    # Bits of ``changed``
+    CREATED, STATE, CAGE, KEEPER, REMOVED = 1, 2, 4, 8, 16
+    # ``state`` is stored as a code; 0 means the mouse was deleted
+    STATE_CODES = [(0, 'Removed')] + [(code, label) for code, (_, label) in enumerate(Mouse.STATE_CHOICES, start=1)]
+
+    id = models.BigAutoField(primary_key=True)
+    # Plain ids, so history outlives deleted mice, cages and users
+    mouse = models.ForeignKey(Mouse, on_delete=models.DO_NOTHING, db_constraint=False, related_name='events')
+    strain_id = models.PositiveIntegerField()
+    at = models.DateTimeField(default=timezone.now)
+    changed = models.PositiveSmallIntegerField()
+    state = models.PositiveSmallIntegerField(choices=STATE_CODES)
+    cage_id = models.PositiveIntegerField(null=True, blank=True)
+    keeper_id = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['at'], name='mouse_event_at_idx'),
+            models.Index(fields=['mouse', 'at'], name='mouse_event_mouse_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"Mouse {self.mouse_id} {self.get_state_display()} at {self.at:%Y-%m-%d %H:%M}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError("Mouse events are append-only.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError("Mouse events are append-only.")
+
+
+class ColonySnapshot(models.Model):
+    """Every mouse's strain, state, cage and keeper at ``taken_at``, as compressed NumPy arrays."""
+    taken_at = models.DateTimeField(unique=True)
+    mice = models.PositiveIntegerField(default=0)
+    data = models.BinaryField()
+
+    def __str__(self):
+        return f"Colony at {self.taken_at:%Y-%m-%d %H:%M} ({self.mice} mice)"
+
+
+# ---------- Health Observation Models ----------
+# Numeric health readings, and their daily/weekly summaries per mouse, cage
+# and strain kept up to date by website.health.
+class HealthObservation(ChangeTrackingModel):
+    """One reading of a numeric health metric, e.g. a weight from a bench balance."""
+    METRIC_CHOICES = [
+        ('weight', 'Weight (g)'),
+        ('body_condition', 'Body condition score'),
+        ('temperature', 'Temperature (°C)'),
+    ]
+    # Plausible values; readings outside them are rejected as device or typing errors
+    METRIC_RANGES = {
+        'weight': (0.5, 100.0),
+        'body_condition': (1.0, 5.0),
+        'temperature': (25.0, 45.0),
+    }
+
+    id = models.BigAutoField(primary_key=True)
+    # Plain ids, so cage and strain summaries outlive deleted mice; the cage is
+    # where the mouse was when measured
+    mouse = models.ForeignKey(Mouse, on_delete=models.DO_NOTHING, db_constraint=False, related_name='health_observations')
+    cage_id = models.PositiveIntegerField(null=True, blank=True)
+    strain_id = models.PositiveIntegerField()
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    value = models.FloatField()
+    observed_at = models.DateTimeField(default=timezone.now)
+    device = models.CharField(max_length=50, blank=True)  # Bench device that sent the reading, if any
+    recorded_by = models.ForeignKey('User', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        unique_together = ('mouse', 'metric', 'observed_at')
+        indexes = [
+            models.Index(fields=['cage_id', 'metric', 'observed_at'], name='health_obs_cage_idx'),
+            models.Index(fields=['strain_id', 'metric', 'observed_at'], name='health_obs_strain_idx'),
+        ]
+
+    def __str__(self):
+        return f"Mouse {self.mouse_id} {self.metric} {self.value:g} at {self.observed_at:%Y-%m-%d %H:%M}"
+
+    def clean(self):
+        if self.metric not in self.METRIC_RANGES or self.value is None:
+            return
+        low, high = self.METRIC_RANGES[self.metric]
+        if not low <= self.value <= high:
+            raise ValidationError({'value': f"{self.get_metric_display()} must be between {low:g} and {high:g}."})
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.strain_id:
+            self.cage_id, self.strain_id = Mouse.objects.filter(pk=self.mouse_id).values_list('cage_id', 'strain_id').get()
+        super().save(*args, **kwargs)
+
+
+class HealthRollup(models.Model):
+    """Count, sum, sum of squares, minimum and maximum of one metric over a day or week."""
+    SCOPE_CHOICES = [('mouse', 'Mouse'), ('cage', 'Cage'), ('strain', 'Strain')]
+    PERIOD_CHOICES = [('day', 'Day'), ('week', 'Week')]
+
+    scope = models.CharField(max_length=6, choices=SCOPE_CHOICES)
+    scope_id = models.PositiveIntegerField()
+    metric = models.CharField(max_length=20, choices=HealthObservation.METRIC_CHOICES)
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    period_start = models.DateField()  # Weeks start on Monday
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0)
+    total_sq = models.FloatField(default=0)
+    minimum = models.FloatField()
+    maximum = models.FloatField()
+
+    class Meta:
+        unique_together = ('scope', 'scope_id', 'metric', 'period', 'period_start')
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+# ---------- Replication Heartbeat Model ----------
+class ReplicationHeartbeat(models.Model):
+    """A single row stamped on the primary; how far a replica's copy trails it measures its lag (see website.routers)."""
+    beat_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Heartbeat at {self.beat_at:%Y-%m-%d %H:%M:%S}"
+
+
+# ---------- Maintenance Job Model ----------
+class MaintenanceJob(models.Model):
+    """A periodic sweep from website.maintenance, leased to one worker at a time."""
+    name = models.CharField(max_length=50, unique=True)
+    enabled = models.BooleanField(default=True)
+    interval = models.DurationField(default=dt.timedelta(hours=1))
+    next_run_at = models.DateTimeField(default=timezone.now)
+    # Lease held by the worker running the job; expired leases may be taken over
+    locked_by = models.CharField(max_length=100, blank=True, editable=False)
+    locked_until = models.DateTimeField(null=True, blank=True, editable=False)
+    last_started_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_finished_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_result = models.CharField(max_length=255, blank=True, editable=False)
+    failures = models.PositiveIntegerField(default=0, editable=False)  # consecutive
+
+    class Meta:
+        indexes = [models.Index(fields=['enabled', 'next_run_at'], name='job_due_idx')]
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,123 @@
+"""Breadth-first pedigree traversal over the Mouse father/mother graph.
+
+Walks expand one generation at a time over the cached strain snapshots in
+``website.snapshots``, so repeated lookups on the same breeders do not touch
+the Mouse table at all. Shared ancestors (common in inbred lines) are only
+visited once and keep the generation they were first reached at.
+"""
+from collections import defaultdict, deque
+
+from .models import Mouse
+from .snapshots import PedigreeGraph
+
+# Keep IN lists well below the bound-parameter limits of SQLite and MySQL.
+IN_BATCH_SIZE = 2000
+# Upper bound on the nodes returned by one lazy tree request
+TREE_PAGE_SIZE = 50
+MAX_TREE_PAGE_SIZE = 200
+# Upper bound on the relatives listed up front by the genetic tree page
+MAX_TREE_LISTING = 500
+
+
+def id_batches(ids):
+    """Split ``ids`` into IN-list sized chunks."""
+    ids = list(ids)
+    for start in range(0, len(ids), IN_BATCH_SIZE):
+        yield ids[start:start + IN_BATCH_SIZE]
+
+
+def _walk(start_ids, step, max_depth):
+    start_ids = set(start_ids)
+    generations = {}
+    frontier = start_ids
+    generation = 0
+    while frontier and (max_depth is None or generation < max_depth):
+        generation += 1
+        frontier = {mouse_id for mouse_id in step(frontier) if mouse_id not in generations and mouse_id not in start_ids}
+        for mouse_id in frontier:
+            generations[mouse_id] = generation
+    return generations
+
+
+def ancestor_generations(mouse_ids, max_depth=None, strains=None):
+    """Map every ancestor of ``mouse_ids`` to its generation (parents are 1).
+
+    ``strains`` may give the already known ``{mouse_id: strain_id}`` of the
+    starting mice to save a lookup.
+    """
+    return _walk(mouse_ids, PedigreeGraph(strains).parents, max_depth)
+
+
+def descendant_generations(mouse_ids, max_depth=None, strains=None):
+    """Map every descendant of ``mouse_ids`` to its generation (children are 1)."""
+    return _walk(mouse_ids, PedigreeGraph(strains).children, max_depth)
+
+
+def load_generations(generations, limit=None):
+    """Fetch the mice in ``generations`` ordered nearest generation first.
+
+    Each returned Mouse carries a ``generation`` attribute. ``limit`` keeps
+    only the nearest ``limit`` mice.
+    """
+    if limit is not None:
+        nearest = sorted(generations, key=lambda mouse_id: (generations[mouse_id], mouse_id))[:limit]
+        generations = {mouse_id: generations[mouse_id] for mouse_id in nearest}
+    mice = []
+    for batch in id_batches(generations):
+        mice.extend(Mouse.objects.filter(mouse_id__in=batch).select_related('strain'))
+    for mouse in mice:
+        mouse.generation = generations[mouse.mouse_id]
+    mice.sort(key=lambda mouse: (mouse.generation, mouse.mouse_id))
+    return mice
+
+
+def tree_page(mouse, direction, after=None, limit=TREE_PAGE_SIZE, scope=None):
+    """One page of ``mouse``'s parents or children for the lazily expanded tree.
+
+    Returns ``(nodes, next_cursor)`` where nodes are ordered by mouse_id and
+    ``next_cursor`` is the last mouse_id of the page when more remain. With a
+    TeamScope, relatives outside it are left out of the page.
+    """
+    graph = PedigreeGraph({mouse.mouse_id: mouse.strain_id})
+    step = graph.parents if direction == 'parents' else graph.children
+    ids = sorted(mouse_id for mouse_id in step([mouse.mouse_id]) if after is None or mouse_id > after)
+    page = ids[:limit]
+    child_counts = graph.child_counts(page)
+    with_parents = graph.with_parents(page)
+    relatives = Mouse.objects.all() if scope is None else Mouse.objects.visible_to(scope)
+    nodes = [
+        {
+            'mouse_id': relative.mouse_id,
+            'label': str(relative),
+            'sex': relative.sex,
+            'state': relative.state,
+            'dob': relative.dob.isoformat(),
+            'has_parents': relative.mouse_id in with_parents,
+            'child_count': child_counts[relative.mouse_id],
+        }
+        for relative in relatives.filter(mouse_id__in=page).select_related('strain').order_by('mouse_id')
+    ]
+    return nodes, (page[-1] if len(ids) > limit else None)
+
+
+def topological_order(parents):
+    """Yield the keys of ``parents`` (mouse_id -> (father_id, mother_id)) parents first."""
+    children = defaultdict(list)
+    waiting = {}
+    for mouse_id, pair in parents.items():
+        in_set = [parent for parent in set(pair) if parent in parents]
+        waiting[mouse_id] = len(in_set)
+        for parent in in_set:
+            children[parent].append(mouse_id)
+    queue = deque(mouse_id for mouse_id, count in waiting.items() if count == 0)
+    while queue:
+        mouse_id = queue.popleft()
+        yield mouse_id
+        for child in children[mouse_id]:
+            waiting[child] -= 1
+            if waiting[child] == 0:
+                queue.append(child)
+    # Anything left is part of a parentage cycle (bad data); emit it anyway
+    for mouse_id, count in waiting.items():
+        if count > 0:
+            yield mouse_id
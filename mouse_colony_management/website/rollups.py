@@ -0,0 +1,175 @@
+"""Incremental maintenance of the dashboard rollup tables.
+
+Each save or delete of a Mouse, Breed or Request applies a +1/-1 delta to the
+affected rollup rows with an ``UPDATE ... SET count = count + n``, so the
+dashboard only ever reads a few small tables. The ``reconcile_*`` functions
+recompute the rollups from the source tables; they back the nightly
+``reconcile_rollups`` command and bulk operations that bypass save signals.
+"""
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Breed, BreedingPairRollup, CageRollup, Mouse, MouseCountRollup, Request, RequestRollup
+from .pedigree import id_batches
+from .signals import mice_bulk_changed
+
+
+def _bump(model, keys, **deltas):
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas or None in keys.values():
+        return
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**keys).update(**updates):
+        return
+    # Only increments may start a row; a decrement of a missing row is left for the reconcile
+    if all(delta > 0 for delta in deltas.values()):
+        _, created = model.objects.get_or_create(defaults=deltas, **keys)
+        if not created:
+            model.objects.filter(**keys).update(**updates)
+
+
+def _count_mouse(strain_id, state, sex, delta):
+    _bump(MouseCountRollup, {'strain_id': strain_id, 'state': state, 'sex': sex}, count=delta)
+
+
+def _count_pup(father_id, mother_id, dob, delta, exclude_pk):
+    if father_id is None or mother_id is None:
+        return
+    # A pup starts (or ends) a litter when it has no full sibling born the same day
+    littermates = Mouse.objects.filter(father_id=father_id, mother_id=mother_id, dob=dob).exclude(pk=exclude_pk).exists()
+    _bump(BreedingPairRollup, {'father_id': father_id, 'mother_id': mother_id}, pups=delta, litters=0 if littermates else delta)
+
+
+@receiver(post_save, sender=Mouse)
+def update_mouse_rollups(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    counted = ('strain_id', 'state', 'sex')
+    if created:
+        _count_mouse(instance.strain_id, instance.state, instance.sex, 1)
+    elif instance.has_changed(*counted):
+        _count_mouse(*(instance.loaded_value(field) for field in counted), -1)
+        _count_mouse(instance.strain_id, instance.state, instance.sex, 1)
+
+    parentage = ('father_id', 'mother_id', 'dob')
+    if created:
+        _count_pup(instance.father_id, instance.mother_id, instance.dob, 1, instance.pk)
+    elif instance.has_changed(*parentage):
+        _count_pup(*(instance.loaded_value(field) for field in parentage), -1, instance.pk)
+        _count_pup(instance.father_id, instance.mother_id, instance.dob, 1, instance.pk)
+
+
+@receiver(post_delete, sender=Mouse)
+def update_mouse_rollups_on_delete(sender, instance, **kwargs):
+    _count_mouse(*(instance.loaded_value(field) for field in ('strain_id', 'state', 'sex')), -1)
+    _count_pup(*(instance.loaded_value(field) for field in ('father_id', 'mother_id', 'dob')), -1, instance.pk)
+
+
+@receiver(post_save, sender=Breed)
+def update_cage_rollup(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    was_active = not created and instance.loaded_value('end_date') is None
+    before = instance.loaded_value('cage_id') if was_active else None
+    after = instance.cage_id if instance.end_date is None else None
+    if before != after:
+        _bump(CageRollup, {'cage_id': before}, active_breeds=-1)
+        _bump(CageRollup, {'cage_id': after}, active_breeds=1)
+
+
+@receiver(post_delete, sender=Breed)
+def update_cage_rollup_on_delete(sender, instance, **kwargs):
+    if instance.loaded_value('end_date') is None:
+        _bump(CageRollup, {'cage_id': instance.loaded_value('cage_id')}, active_breeds=-1)
+
+
+@receiver(post_save, sender=Request)
+def update_request_rollup(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if not created and not instance.has_changed('request_type', 'status'):
+        return
+    if not created:
+        _bump(RequestRollup, {'request_type': instance.loaded_value('request_type'), 'status': instance.loaded_value('status')}, count=-1)
+    _bump(RequestRollup, {'request_type': instance.request_type, 'status': instance.status}, count=1)
+
+
+@receiver(post_delete, sender=Request)
+def update_request_rollup_on_delete(sender, instance, **kwargs):
+    _bump(RequestRollup, {'request_type': instance.loaded_value('request_type'), 'status': instance.loaded_value('status')}, count=-1)
+
+
+@receiver(mice_bulk_changed)
+def reconcile_after_bulk_change(sender, mouse_ids, strain_ids, fields=None, **kwargs):
+    if fields is None or {'strain_id', 'state', 'sex'} & set(fields):
+        reconcile_mouse_counts(strain_ids)
+    if fields is not None and not {'father_id', 'mother_id', 'dob'} & set(fields):
+        return
+    pairs = set()
+    for batch in id_batches(mouse_ids):
+        pairs.update(Mouse.objects.filter(pk__in=batch, father__isnull=False, mother__isnull=False).values_list('father_id', 'mother_id'))
+    reconcile_pairs(pairs)
+
+
+def reconcile_mouse_counts(strain_ids=None):
+    mice = Mouse.objects.all()
+    rollups = MouseCountRollup.objects.all()
+    if strain_ids is not None:
+        mice = mice.filter(strain_id__in=list(strain_ids))
+        rollups = rollups.filter(strain_id__in=list(strain_ids))
+    with transaction.atomic():
+        rollups.delete()
+        MouseCountRollup.objects.bulk_create(
+            MouseCountRollup(**row) for row in mice.values('strain_id', 'state', 'sex').annotate(count=Count('pk')).order_by()
+        )
+
+
+def reconcile_pairs(pairs=None):
+    """Recompute litter/pup totals, for every pair or just ``(father_id, mother_id)`` pairs."""
+    mice = Mouse.objects.filter(father__isnull=False, mother__isnull=False)
+    totals = mice.values('father_id', 'mother_id').annotate(pups=Count('pk'), litters=Count('dob', distinct=True)).order_by()
+    if pairs is None:
+        with transaction.atomic():
+            BreedingPairRollup.objects.all().delete()
+            BreedingPairRollup.objects.bulk_create(BreedingPairRollup(**row) for row in totals)
+        return
+
+    pairs = set(pairs)
+    with transaction.atomic():
+        for fathers in id_batches({father for father, _ in pairs}):
+            stale = [
+                pk for pk, father_id, mother_id in BreedingPairRollup.objects.filter(father_id__in=fathers).values_list('pk', 'father_id', 'mother_id')
+                if (father_id, mother_id) in pairs
+            ]
+            BreedingPairRollup.objects.filter(pk__in=stale).delete()
+            BreedingPairRollup.objects.bulk_create(
+                BreedingPairRollup(**row) for row in totals.filter(father_id__in=fathers) if (row['father_id'], row['mother_id']) in pairs
+            )
+
+
+def reconcile_cages(cage_ids=None):
+    breeds = Breed.objects.filter(end_date__isnull=True)
+    rollups = CageRollup.objects.all()
+    if cage_ids is not None:
+        breeds = breeds.filter(cage_id__in=list(cage_ids))
+        rollups = rollups.filter(cage_id__in=list(cage_ids))
+    active = breeds.values('cage_id').annotate(active_breeds=Count('pk')).order_by()
+    with transaction.atomic():
+        rollups.delete()
+        CageRollup.objects.bulk_create(CageRollup(**row) for row in active)
+
+
+def reconcile_requests():
+    totals = Request.objects.values('request_type', 'status').annotate(count=Count('pk')).order_by()
+    with transaction.atomic():
+        RequestRollup.objects.all().delete()
+        RequestRollup.objects.bulk_create(RequestRollup(**row) for row in totals)
+
+
+def reconcile_all():
+    reconcile_mouse_counts()
+    reconcile_pairs()
+    reconcile_cages()
+    reconcile_requests()
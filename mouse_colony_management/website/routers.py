@@ -0,0 +1,194 @@
+"""Read/write splitting between the primary database and its read replicas.
+
+Every write, and by default every read, goes to the ``default`` (primary)
+database. Code that only reads, and can live with data a few seconds old,
+opts in to the replicas in ``REPLICA_DATABASES`` with ``replica_reads()``.
+That covers read-only views, exports, reports and lineage traversal.
+``replica_reads()`` works as a decorator or a context manager. Inside it,
+reads go to one replica, picked once per request, unless
+
+    pinned      the client wrote within the last REPLICA_STICKY_SECONDS:
+                ``ReplicaRoutingMiddleware`` sets a short-lived cookie on the
+                response of any request that wrote, so users read their own
+                writes (a new request, an approval) on their next pages
+    wrote       something was already written in this request
+    lagging     no replica is within REPLICA_MAX_LAG_SECONDS of the primary
+
+Lag is measured with the single ``ReplicationHeartbeat`` row, which the
+``stamp_replication`` maintenance job stamps on the primary every minute.
+How far the replica's copy of the row trails the primary's is the lag. Checks
+only read, and run at most every LAG_CHECK_SECONDS per process. A replica
+that cannot be reached, or has no heartbeat yet, counts as lagging.
+
+Sessions are always read from the primary, since a login must be visible at
+once.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+from django.utils import timezone
+
+from .models import ReplicationHeartbeat
+
+STICKY_COOKIE = 'db_primary'
+LAG_CHECK_SECONDS = 5
+# Apps whose rows are never read from a replica, and whose writes do not pin the client
+PRIMARY_ONLY_APPS = {'sessions'}
+
+_routing = ContextVar('db_routing', default=None)
+# alias -> (time.monotonic() of the check, lag in seconds or None when unreachable)
+_lag_checks = {}
+
+
+class RoutingState:
+    """How the current request or ``replica_reads`` block reads."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.replica_reads = False
+        self.wrote = False
+        self.replica = None
+
+    @property
+    def use_primary(self):
+        return self.pinned or self.wrote or not self.replica_reads
+
+
+@contextmanager
+def replica_reads():
+    """Send reads to a replica inside the block (or the decorated function)."""
+    state = _routing.get()
+    token = None
+    if state is None:
+        state = RoutingState()
+        token = _routing.set(state)
+    previous = state.replica_reads
+    state.replica_reads = True
+    try:
+        yield state
+    finally:
+        state.replica_reads = previous
+        if token is not None:
+            _routing.reset(token)
+
+
+def replica_stream(chunks):
+    """Iterate ``chunks`` with replica reads, e.g. a streamed export consumed after its view returned."""
+    pinned = getattr(_routing.get(), 'pinned', False)
+
+    def stream():
+        previous = _routing.get()
+        state = RoutingState(pinned=pinned)
+        state.replica_reads = True
+        # Set rather than reset: the server may close the stream from another context
+        _routing.set(state)
+        try:
+            yield from chunks
+        finally:
+            _routing.set(previous)
+    return stream()
+
+
+def _beat_at(alias):
+    return ReplicationHeartbeat.objects.using(alias).filter(pk=1).values_list('beat_at', flat=True).first()
+
+
+def stamp_heartbeat(now=None):
+    """Stamp the primary's heartbeat; replicas that copied it are up to date to ``now``."""
+    now = now or timezone.now()
+    if not ReplicationHeartbeat.objects.using(DEFAULT_DB_ALIAS).filter(pk=1).update(beat_at=now):
+        ReplicationHeartbeat.objects.using(DEFAULT_DB_ALIAS).get_or_create(pk=1, defaults={'beat_at': now})
+
+
+def replica_lag(alias):
+    """Seconds ``alias`` trails the primary, or None when it cannot be reached or neither has a heartbeat."""
+    primary = _beat_at(DEFAULT_DB_ALIAS)
+    try:
+        beat_at = _beat_at(alias)
+    except DatabaseError:
+        return None
+    if primary is None or beat_at is None:
+        return None
+    return max((primary - beat_at).total_seconds(), 0.0)
+
+
+def check_replicas(force=False):
+    """``{alias: lag}`` of the configured replicas, rechecking those not checked for LAG_CHECK_SECONDS."""
+    lags = {}
+    for alias in getattr(settings, 'REPLICA_DATABASES', []):
+        checked = _lag_checks.get(alias)
+        if force or checked is None or time.monotonic() - checked[0] > LAG_CHECK_SECONDS:
+            checked = _lag_checks[alias] = (time.monotonic(), replica_lag(alias))
+        lags[alias] = checked[1]
+    return lags
+
+
+def healthy_replicas():
+    max_lag = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5)
+    return [alias for alias, lag in check_replicas().items() if lag is not None and lag <= max_lag]
+
+
+class PrimaryReplicaRouter:
+    """Reads go to a replica inside ``replica_reads()``; everything else goes to the primary."""
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or state.use_primary or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            replicas = healthy_replicas()
+            # Lagging replicas are skipped for the rest of the request
+            state.replica = random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None and model._meta.app_label not in PRIMARY_ONLY_APPS:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    """Pins a client's reads to the primary for REPLICA_STICKY_SECONDS after a request of theirs wrote."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _pin(self, response, state):
+        if state.wrote:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=getattr(settings, 'REPLICA_STICKY_SECONDS', 10), httponly=True, samesite='Lax')
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState(pinned=STICKY_COOKIE in request.COOKIES)
+        token = _routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self._pin(response, state)
+
+    async def __acall__(self, request):
+        # The ORM's sync thread runs in a copy of this context, so it sees the same state
+        state = RoutingState(pinned=STICKY_COOKIE in request.COOKIES)
+        token = _routing.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _routing.reset(token)
+        return self._pin(response, state)
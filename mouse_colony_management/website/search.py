@@ -0,0 +1,295 @@
+"""Indexed prefix search over mice, strains, genotypes and phenotypes.
+
+Each mouse has one ``SearchDocument`` holding its tube ID, strain, sex, state,
+earmark, genotypes and phenotype observations as plain text, and each strain
+has one holding its name. Documents are rebuilt incrementally from save and
+delete signals (and ``mice_bulk_changed`` / the importers for bulk writes),
+a whole batch of mice with three queries, so a search never touches
+``Mouse``, ``Genotype`` or ``Phenotype``. Mice changed by signals are
+collected and reindexed together once their transaction commits, so a
+request that saves the same mice several times rebuilds each document once,
+outside the transaction.
+
+A query is split into tokens that must all match; tokens of ``MIN_PREFIX`` or
+more characters also match as prefixes, so ``coat col`` finds "Coat Color"
+and ``12`` finds tube 123. Two backends answer queries:
+
+    fts5    an SQLite FTS5 table (``website_search_fts``) with prefix
+            indexes, ranked by bm25 with exact tokens weighted up; the
+            default on SQLite
+    terms   the portable ``SearchTerm`` inverted index: one row per distinct
+            token of a document, searched with ``term LIKE 'abc%'`` range
+            scans on the (term, document) index and ranked by how many
+            tokens matched exactly; the default elsewhere (MySQL)
+
+``SEARCH_BACKEND`` ('auto', 'fts5' or 'terms') picks one. After switching,
+or after writes that bypassed the signals, run ``rebuild_search_index``.
+"""
+import re
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Max, Q, Sum, When
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from .maintenance import keyset_chunks
+from .models import Genotype, Mouse, Phenotype, SearchDocument, SearchTerm, Strain
+from .pedigree import id_batches
+from .signals import mice_bulk_changed
+
+TOKEN = re.compile(r'\w+')
+MIN_PREFIX = 2
+MAX_QUERY_TOKENS = 6
+SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+# Mouse attributes that appear in its document
+INDEXED_FIELDS = ('tube_id', 'strain_id', 'sex', 'state', 'earmark', 'team_id')
+SEX_LABELS = dict(Mouse.SEX_CHOICES)
+STATE_LABELS = dict(Mouse.STATE_CHOICES)
+EARMARK_LABELS = dict(Mouse.CLIPPED_CHOICES)
+
+# Mouse ids waiting for the commit of the transaction that changed them
+_pending = threading.local()
+
+
+def tokenize(text):
+    """Distinct lower-case tokens of ``text``, in order of first appearance."""
+    max_length = SearchTerm._meta.get_field('term').max_length
+    return list(dict.fromkeys(token[:max_length] for token in TOKEN.findall(text.lower())))
+
+
+class TermBackend:
+    """Inverted index in ``SearchTerm``; works on every database."""
+    name = 'terms'
+
+    def ensure_table(self):
+        pass
+
+    def index(self, documents):
+        SearchTerm.objects.bulk_create(
+            [SearchTerm(document_id=document.pk, term=term) for document in documents for term in tokenize(document.text)],
+            batch_size=1000,
+        )
+
+    def remove(self, document_ids):
+        # Terms go with their documents (on_delete=CASCADE)
+        pass
+
+    def clear(self):
+        SearchTerm.objects.all().delete()
+
+    def search(self, tokens, scope, limit):
+        matches = [Q(term__startswith=token) if len(token) >= MIN_PREFIX else Q(term=token) for token in tokens]
+        terms = SearchTerm.objects.filter(Q.create(matches, connector=Q.OR))
+        if not scope.sees_everything:
+            terms = terms.filter(Q(document__team_id__in=scope.team_ids) | Q(document__team_id__isnull=True))
+        hits = {f'hit_{n}': Max(Case(When(match, then=1), default=0, output_field=IntegerField())) for n, match in enumerate(matches)}
+        return list(
+            terms.values('document_id').annotate(**hits).filter(**dict.fromkeys(hits, 1))
+            .annotate(exact=Sum(Case(When(term__in=tokens, then=1), default=0, output_field=IntegerField())))
+            .order_by('-exact', 'document_id').values_list('document_id', flat=True)[:limit]
+        )
+
+
+class FTS5Backend:
+    """SQLite FTS5 table keyed by SearchDocument id, with 2- and 3-character prefix indexes."""
+    name = 'fts5'
+    table = 'website_search_fts'
+
+    def ensure_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5(text, tokenize='unicode61', prefix='2 3')")
+
+    def index(self, documents):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"INSERT INTO {self.table} (rowid, text) VALUES (%s, %s)", [(document.pk, document.text) for document in documents])
+
+    def remove(self, document_ids):
+        with connection.cursor() as cursor:
+            for batch in id_batches(document_ids):
+                cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({', '.join(['%s'] * len(batch))})", batch)
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+
+    def search(self, tokens, scope, limit):
+        # Tokens are \w+ runs, so quoting them is enough to keep FTS5 syntax out.
+        # The exact term is OR'd in beside the prefix so bm25 ranks exact matches first.
+        match = ' AND '.join(f'("{token}" OR "{token}"*)' if len(token) >= MIN_PREFIX else f'"{token}"' for token in tokens)
+        documents = SearchDocument._meta.db_table
+        sql = f"SELECT d.id FROM {self.table} JOIN {documents} d ON d.id = {self.table}.rowid WHERE {self.table} MATCH %s"
+        params = [match]
+        if not scope.sees_everything:
+            team_ids = list(scope.team_ids)
+            in_list = f"d.team_id IN ({', '.join(['%s'] * len(team_ids))}) OR " if team_ids else ''
+            sql += f" AND ({in_list}d.team_id IS NULL)"
+            params += team_ids
+        sql += f" ORDER BY bm25({self.table}), d.id LIMIT %s"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [limit])
+            return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {'terms': TermBackend, 'fts5': FTS5Backend}
+
+
+def get_backend():
+    name = getattr(settings, 'SEARCH_BACKEND', 'auto')
+    if name == 'auto':
+        name = 'fts5' if connection.vendor == 'sqlite' else 'terms'
+    return BACKENDS[name]()
+
+
+def _mouse_documents(mouse_ids):
+    """Unsaved SearchDocuments for the existing mice among ``mouse_ids``."""
+    genotypes, phenotypes = {}, {}
+    for mouse_id, gene, allele_1, allele_2 in Genotype.objects.filter(mouse_id__in=mouse_ids).values_list('mouse_id', 'gene', 'allele_1', 'allele_2'):
+        genotypes.setdefault(mouse_id, []).append(f"{gene} {allele_1}/{allele_2}")
+    for mouse_id, characteristic, description in Phenotype.objects.filter(mouse_id__in=mouse_ids).values_list('mouse_id', 'characteristic', 'description'):
+        phenotypes.setdefault(mouse_id, []).append(f"{characteristic}: {description}")
+    rows = Mouse.objects.filter(pk__in=mouse_ids).values_list('pk', 'tube_id', 'strain__name', 'sex', 'state', 'earmark', 'team_id')
+    return [
+        SearchDocument(
+            kind='mouse', object_id=mouse_id, team_id=team_id, title=f"{strain} tube {tube_id}",
+            text=' '.join([
+                str(tube_id), strain, SEX_LABELS.get(sex, sex), STATE_LABELS.get(state, state), EARMARK_LABELS.get(earmark, earmark),
+                *genotypes.get(mouse_id, ()), *phenotypes.get(mouse_id, ()),
+            ]),
+        )
+        for mouse_id, tube_id, strain, sex, state, earmark, team_id in rows
+    ]
+
+
+def _strain_documents(strain_ids):
+    return [
+        SearchDocument(kind='strain', object_id=strain_id, title=name, text=name)
+        for strain_id, name in Strain.objects.filter(pk__in=strain_ids).values_list('pk', 'name')
+    ]
+
+
+def _replace(kind, object_ids, documents, backend=None):
+    """Swap the stored documents of ``object_ids`` for ``documents``."""
+    backend = backend or get_backend()
+    with transaction.atomic():
+        stale = SearchDocument.objects.filter(kind=kind, object_id__in=object_ids)
+        backend.remove(list(stale.values_list('pk', flat=True)))
+        stale.delete()
+        SearchDocument.objects.bulk_create(documents)
+        if documents and documents[0].pk is None:
+            # MySQL's bulk_create does not return primary keys
+            ids = dict(SearchDocument.objects.filter(kind=kind, object_id__in=object_ids).values_list('object_id', 'pk'))
+            for document in documents:
+                document.pk = ids[document.object_id]
+        backend.index(documents)
+
+
+def index_mice(mouse_ids, backend=None):
+    """Rebuild the documents of ``mouse_ids``; mice that no longer exist are dropped."""
+    for batch in id_batches(set(mouse_ids)):
+        _replace('mouse', batch, _mouse_documents(batch), backend)
+
+
+def _index_pending():
+    mouse_ids = getattr(_pending, 'mouse_ids', set())
+    _pending.mouse_ids = set()
+    if mouse_ids:
+        index_mice(mouse_ids)
+
+
+def index_mice_on_commit(mouse_ids):
+    """Reindex ``mouse_ids`` once the current transaction commits (at once outside one).
+
+    Every change registers a callback, but the first to run indexes all the
+    mice collected so far and the rest find nothing left. Ids collected in a
+    transaction that rolled back are reindexed with the next commit, which
+    is harmless.
+    """
+    if not hasattr(_pending, 'mouse_ids'):
+        _pending.mouse_ids = set()
+    _pending.mouse_ids.update(mouse_ids)
+    transaction.on_commit(_index_pending)
+
+
+def index_strains(strain_ids, backend=None):
+    for batch in id_batches(set(strain_ids)):
+        _replace('strain', batch, _strain_documents(batch), backend)
+
+
+def rebuild_index(backend=None):
+    """Index every strain and mouse from scratch; returns the number of documents."""
+    backend = backend or get_backend()
+    backend.ensure_table()
+    backend.clear()
+    SearchDocument.objects.all().delete()
+    index_strains(Strain.objects.values_list('pk', flat=True), backend)
+    for chunk in keyset_chunks(Mouse.objects.all(), 2000):
+        index_mice(chunk, backend)
+    return SearchDocument.objects.count()
+
+
+def _result(document):
+    url = reverse('genetic_tree', args=[document.object_id]) if document.kind == 'mouse' else None
+    return {'kind': document.kind, 'id': document.object_id, 'title': document.title, 'url': url}
+
+
+def search(query, scope, limit=SEARCH_LIMIT):
+    """Best matches for ``query`` visible in ``scope``, as JSON-ready dicts."""
+    tokens = tokenize(query)[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return []
+    document_ids = get_backend().search(tokens, scope, min(limit, MAX_SEARCH_LIMIT))
+    documents = SearchDocument.objects.in_bulk(document_ids)
+    return [_result(documents[document_id]) for document_id in document_ids if document_id in documents]
+
+
+@receiver(post_migrate)
+def create_search_table(sender, using='default', **kwargs):
+    if sender.name == 'website' and using == connection.alias:
+        get_backend().ensure_table()
+
+
+@receiver(post_save, sender=Mouse)
+def index_on_mouse_save(sender, instance, created, raw=False, **kwargs):
+    if not raw and (created or instance.has_changed(*INDEXED_FIELDS)):
+        index_mice_on_commit([instance.pk])
+
+
+@receiver(post_delete, sender=Mouse)
+def remove_on_mouse_delete(sender, instance, **kwargs):
+    # Reindexing a mouse that no longer exists drops its document
+    index_mice_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Genotype)
+@receiver(post_delete, sender=Genotype)
+@receiver(post_save, sender=Phenotype)
+@receiver(post_delete, sender=Phenotype)
+def index_on_record_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_mice_on_commit([instance.mouse_id])
+
+
+@receiver(post_save, sender=Strain)
+def index_on_strain_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    renamed = not created and SearchDocument.objects.filter(kind='strain', object_id=instance.pk).exclude(title=instance.name).exists()
+    index_strains([instance.pk])
+    if renamed:
+        for chunk in keyset_chunks(Mouse.objects.filter(strain_id=instance.pk), 2000):
+            index_mice(chunk)
+
+
+@receiver(post_delete, sender=Strain)
+def remove_on_strain_delete(sender, instance, **kwargs):
+    _replace('strain', [instance.pk], [])
+
+
+@receiver(mice_bulk_changed)
+def index_on_bulk_change(sender, mouse_ids, fields=None, **kwargs):
+    if fields is None or set(INDEXED_FIELDS) & set(fields):
+        index_mice_on_commit(mouse_ids)
@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent by bulk operations that write mice without going through Mouse.save()
+# (imports, batch approvals, sweeps). Receivers get ``mouse_ids`` and
+# ``strain_ids`` keyword arguments and bring their derived data up to date.
+# An optional ``fields`` argument names the attributes that were written
+# (e.g. ``{'state', 'cage_id'}``) so receivers can skip unaffected data;
+# when it is missing, anything may have changed, as for newly created rows.
+mice_bulk_changed = Signal()
@@ -0,0 +1,204 @@
+"""Cached per-strain pedigree snapshots held as parallel NumPy arrays.
+
+A snapshot covers every mouse of a strain plus any children those mice have
+in other strains, as sorted ``mouse_ids`` with matching ``father_ids``,
+``mother_ids`` (0 when unknown), ``sex``, ``state`` and ``strain_ids`` arrays.
+Snapshots are kept in process memory and in the Django cache, keyed by
+``Strain.pedigree_version``. Saving or deleting a mouse bumps the version of
+every strain whose snapshot it appears in, so checking freshness costs one
+small primary-key query per traversal rather than a walk over the ORM.
+
+Versions are random 63-bit stamps rather than ``+1`` counters: a bump that is
+rolled back would otherwise let a later bump reuse a version whose snapshot
+was cached from the uncommitted data.
+
+``PedigreeGraph`` answers parent/child lookups for sets of mice across
+however many snapshots a traversal touches.
+"""
+import secrets
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Mouse, Strain
+from .signals import mice_bulk_changed
+
+CACHE_TIMEOUT = 60 * 60 * 24
+SEX_CODES = {'M': 1, 'F': 2}
+STATE_CODES = {state: code for code, (state, _) in enumerate(Mouse.STATE_CHOICES, start=1)}
+PEDIGREE_FIELDS = ('father_id', 'mother_id', 'sex', 'state', 'strain_id')
+
+
+class PedigreeSnapshot:
+    def __init__(self, strain_id, version, rows):
+        self.strain_id = strain_id
+        self.version = version
+        rows = sorted(rows)
+        columns = list(zip(*rows)) if rows else [()] * 6
+        self.mouse_ids = np.array(columns[0], dtype=np.int64)
+        self.father_ids = np.array([parent or 0 for parent in columns[1]], dtype=np.int64)
+        self.mother_ids = np.array([parent or 0 for parent in columns[2]], dtype=np.int64)
+        self.sex = np.array([SEX_CODES.get(sex, 0) for sex in columns[3]], dtype=np.int8)
+        self.state = np.array([STATE_CODES.get(state, 0) for state in columns[4]], dtype=np.int8)
+        self.strain_ids = np.array(columns[5], dtype=np.int64)
+
+    @classmethod
+    def load(cls, strain_id, version):
+        rows = Mouse.objects.filter(
+            Q(strain_id=strain_id) | Q(father__strain_id=strain_id) | Q(mother__strain_id=strain_id)
+        ).values_list('mouse_id', 'father_id', 'mother_id', 'sex', 'state', 'strain_id')
+        return cls(strain_id, version, rows)
+
+    def __len__(self):
+        return len(self.mouse_ids)
+
+    def positions(self, mouse_ids):
+        """Row positions of ``mouse_ids``, dropping ids that are not in the snapshot."""
+        mouse_ids = np.asarray(mouse_ids, dtype=np.int64)
+        positions = np.searchsorted(self.mouse_ids, mouse_ids)
+        positions = positions[positions < len(self.mouse_ids)]
+        return positions[np.isin(self.mouse_ids[positions], mouse_ids)]
+
+    def own_rows(self):
+        """Boolean mask of the rows that belong to this strain."""
+        return self.strain_ids == self.strain_id
+
+
+def _cache_key(strain_id, version):
+    return f'pedigree-snapshot:{strain_id}:{version}'
+
+
+_local = {}
+
+
+def get_snapshots(strain_ids):
+    """``{strain_id: PedigreeSnapshot}`` at each strain's current version."""
+    snapshots = {}
+    versions = Strain.objects.filter(pk__in=list(strain_ids)).values_list('pk', 'pedigree_version')
+    for strain_id, version in versions:
+        snapshot = _local.get(strain_id)
+        if snapshot is None or snapshot.version != version:
+            snapshot = cache.get(_cache_key(strain_id, version))
+            if snapshot is None:
+                snapshot = PedigreeSnapshot.load(strain_id, version)
+                cache.set(_cache_key(strain_id, version), snapshot, CACHE_TIMEOUT)
+            _local[strain_id] = snapshot
+        snapshots[strain_id] = snapshot
+    return snapshots
+
+
+def get_snapshot(strain_id):
+    return get_snapshots([strain_id]).get(strain_id)
+
+
+def bump_versions(strain_ids):
+    strain_ids = {strain_id for strain_id in strain_ids if strain_id is not None}
+    if strain_ids:
+        Strain.objects.filter(pk__in=strain_ids).update(pedigree_version=secrets.randbits(63))
+        for strain_id in strain_ids:
+            _local.pop(strain_id, None)
+
+
+class PedigreeGraph:
+    """Parent/child lookups over the snapshots of the strains a traversal reaches.
+
+    ``strains`` optionally seeds the known ``{mouse_id: strain_id}`` of the
+    starting mice; any other mouse whose strain is not yet known costs one
+    batched query the first time it is reached.
+    """
+
+    def __init__(self, strains=None):
+        self.strain_of = dict(strains or {})
+        self.snapshots = {}
+
+    def _group(self, mouse_ids):
+        unknown = [mouse_id for mouse_id in mouse_ids if mouse_id not in self.strain_of]
+        if unknown:
+            self.strain_of.update(Mouse.objects.filter(pk__in=unknown).values_list('pk', 'strain_id'))
+        groups = {}
+        for mouse_id in mouse_ids:
+            if mouse_id in self.strain_of:
+                groups.setdefault(self.strain_of[mouse_id], []).append(mouse_id)
+        missing = [strain_id for strain_id in groups if strain_id not in self.snapshots]
+        if missing:
+            self.snapshots.update(get_snapshots(missing))
+        return [(self.snapshots[strain_id], ids) for strain_id, ids in groups.items() if strain_id in self.snapshots]
+
+    def _learn(self, snapshot, positions):
+        self.strain_of.update(zip(snapshot.mouse_ids[positions].tolist(), snapshot.strain_ids[positions].tolist()))
+
+    def parents(self, mouse_ids):
+        found = set()
+        for snapshot, ids in self._group(mouse_ids):
+            positions = snapshot.positions(ids)
+            parents = np.concatenate((snapshot.father_ids[positions], snapshot.mother_ids[positions]))
+            parents = np.unique(parents[parents > 0])
+            self._learn(snapshot, snapshot.positions(parents))
+            found.update(parents.tolist())
+        return found
+
+    def children(self, mouse_ids):
+        found = set()
+        for snapshot, ids in self._group(mouse_ids):
+            ids = np.asarray(ids, dtype=np.int64)
+            positions = np.flatnonzero(np.isin(snapshot.father_ids, ids) | np.isin(snapshot.mother_ids, ids))
+            self._learn(snapshot, positions)
+            found.update(snapshot.mouse_ids[positions].tolist())
+        return found
+
+    def child_counts(self, mouse_ids):
+        """``{mouse_id: number of children}`` for each of ``mouse_ids``."""
+        counts = dict.fromkeys(mouse_ids, 0)
+        for snapshot, ids in self._group(mouse_ids):
+            parents = np.concatenate((snapshot.father_ids, snapshot.mother_ids))
+            found, totals = np.unique(parents[np.isin(parents, ids)], return_counts=True)
+            counts.update(zip(found.tolist(), totals.tolist()))
+        return counts
+
+    def with_parents(self, mouse_ids):
+        """The subset of ``mouse_ids`` that have at least one recorded parent."""
+        found = set()
+        for snapshot, ids in self._group(mouse_ids):
+            positions = snapshot.positions(ids)
+            known = (snapshot.father_ids[positions] > 0) | (snapshot.mother_ids[positions] > 0)
+            found.update(snapshot.mouse_ids[positions[known]].tolist())
+        return found
+
+
+def _parent_strains(*parent_ids):
+    parent_ids = [parent_id for parent_id in parent_ids if parent_id is not None]
+    if not parent_ids:
+        return set()
+    return set(Mouse.objects.filter(pk__in=parent_ids).values_list('strain_id', flat=True))
+
+
+@receiver(post_save, sender=Mouse)
+def bump_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if not created and not instance.has_changed(*PEDIGREE_FIELDS):
+        return
+    strains = {instance.strain_id, instance.loaded_value('strain_id')}
+    # The mouse also appears as a child in its parents' strain snapshots
+    strains |= _parent_strains(instance.father_id, instance.mother_id, instance.loaded_value('father_id'), instance.loaded_value('mother_id'))
+    bump_versions(strains)
+
+
+@receiver(pre_delete, sender=Mouse)
+def remember_strains_on_delete(sender, instance, **kwargs):
+    children = Mouse.objects.filter(Q(father_id=instance.pk) | Q(mother_id=instance.pk)).values_list('strain_id', flat=True)
+    instance._snapshot_strains = {instance.strain_id} | set(children) | _parent_strains(instance.father_id, instance.mother_id)
+
+
+@receiver(post_delete, sender=Mouse)
+def bump_on_delete(sender, instance, **kwargs):
+    bump_versions(getattr(instance, '_snapshot_strains', {instance.strain_id}))
+
+
+@receiver(mice_bulk_changed)
+def bump_on_bulk_change(sender, strain_ids, fields=None, **kwargs):
+    if fields is None or set(PEDIGREE_FIELDS) & set(fields):
+        bump_versions(strain_ids)
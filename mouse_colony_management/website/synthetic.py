@@ -0,0 +1,233 @@
+"""Deterministic synthetic colonies for tests and benchmarks.
+
+``generate_colony`` writes strains, keepers, cages, mice, breeds, litters,
+requests, genotypes and phenotypes with ``bulk_create``. Each strain starts from a set
+of founders and grows for a number of generations. Every generation is made
+of litters of a realistic size from pairs of the previous generation, so pups
+share their parents and birth date the way real litters do. The same
+``seed`` always produces the same rows. Primary keys are assigned
+explicitly, above the current maximum, so parents can be linked without a
+round trip on backends where ``bulk_create`` does not return keys.
+
+Rollups, litter statistics, cage occupancy and snapshot versions are brought up to date
+afterwards. The lineage closure is not: it is large for deep pedigrees, so
+run ``rebuild_lineage`` when a benchmark needs it.
+"""
+import datetime as dt
+import random
+
+from django.db import transaction
+from django.db.models import Max
+
+from .cages import recount_cages
+from .genetics import bump_genotype_versions, encode_genotypes
+from .litters import reconcile_litter_stats
+from .models import Breed, Cage, Genotype, Litter, Mouse, Phenotype, Request, Strain, User
+from .rollups import reconcile_all
+from .search import index_mice, index_strains
+from .snapshots import bump_versions
+
+BATCH_SIZE = 5000
+FOUNDER_SHARE = 0.05
+# (pups, weight): laboratory strains mostly wean litters of 5 to 8
+LITTER_SIZES = [(2, 2), (3, 4), (4, 8), (5, 14), (6, 18), (7, 18), (8, 14), (9, 10), (10, 7), (11, 3), (12, 2)]
+GENERATION_DAYS = 90
+# (pups lost before weaning, weight)
+LOSSES = [(0, 70), (1, 20), (2, 10)]
+WEANING_DAYS = 21
+# The two youngest generations are mostly alive; older ones mostly culled
+CURRENT_STATES = [('alive', 70), ('breeding', 15), ('to_be_culled', 5), ('deceased', 10)]
+OLDER_STATES = [('alive', 10), ('deceased', 90)]
+GENES = ['Apoe', 'Lepr', 'Trp53']
+ALLELES = ['+', '-']
+PHENOTYPES = [('Coat Colour', ['Black', 'Agouti', 'Albino']), ('Tail', ['Normal', 'Kinked'])]
+START_DATE = dt.date(2015, 1, 1)
+
+
+def _next_pk(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def _weighted(rng, weights):
+    return rng.choices([value for value, _ in weights], [weight for _, weight in weights])[0]
+
+
+def _split(total, parts):
+    """``total`` spread over ``parts`` as evenly as possible."""
+    return [total // parts + (1 if n < total % parts else 0) for n in range(parts)]
+
+
+class ColonySummary:
+    def __init__(self):
+        self.counts = {}
+        self.founders = []  # mouse id of the first founder of each strain
+        self.youngest = []  # mouse id of the last pup of each strain
+
+    def add(self, name, count):
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def __str__(self):
+        return ', '.join(f"{count} {name}" for name, count in self.counts.items())
+
+
+class _Pedigree:
+    """Plans mice strain by strain, generation by generation, litter by litter."""
+
+    def __init__(self, rng, first_mouse, generations):
+        self.rng = rng
+        self.next_id = first_mouse
+        self.generations = generations
+        self.rows = []  # (mouse_id, strain_id, tube_id, dob, sex, father_id, mother_id, state)
+        self.pairs = []  # (father_id, mother_id, generation of their pups)
+
+    def _add(self, strain_id, tube_id, dob, father_id, mother_id, generation):
+        mouse_id = self.next_id
+        self.next_id += 1
+        sex = 'M' if self.rng.random() < 0.5 else 'F'
+        states = CURRENT_STATES if generation >= self.generations - 1 else OLDER_STATES
+        self.rows.append((mouse_id, strain_id, tube_id, dob, sex, father_id, mother_id, _weighted(self.rng, states)))
+        return mouse_id, sex
+
+    def strain(self, strain_id, quota):
+        founders = min(quota, max(2, round(quota * FOUNDER_SHARE)))
+        tube_id = 1
+        previous = {'M': [], 'F': []}
+        for _ in range(founders):
+            mouse_id, sex = self._add(strain_id, tube_id, START_DATE, None, None, 0)
+            previous[sex].append(mouse_id)
+            tube_id += 1
+
+        for generation, size in enumerate(_split(quota - founders, self.generations), start=1):
+            current = {'M': [], 'F': []}
+            start = START_DATE + dt.timedelta(days=generation * GENERATION_DAYS)
+            while size > 0:
+                father_id = mother_id = None
+                # A single-sex generation cannot breed; its successors are new founders
+                if previous['M'] and previous['F']:
+                    father_id = self.rng.choice(previous['M'])
+                    mother_id = self.rng.choice(previous['F'])
+                    self.pairs.append((father_id, mother_id, generation))
+                dob = start + dt.timedelta(days=self.rng.randrange(GENERATION_DAYS // 3))
+                for _ in range(min(size, _weighted(self.rng, LITTER_SIZES))):
+                    mouse_id, sex = self._add(strain_id, tube_id, dob, father_id, mother_id, generation)
+                    current[sex].append(mouse_id)
+                    tube_id += 1
+                    size -= 1
+            if current['M'] or current['F']:
+                previous = current
+
+
+def generate_colony(mice=100000, strains=20, generations=8, seed=0, batch_size=BATCH_SIZE):
+    """Create a synthetic colony of exactly ``mice`` mice; returns a ColonySummary."""
+    rng = random.Random(seed)
+    summary = ColonySummary()
+    prefix = f'S{seed}-'
+
+    with transaction.atomic():
+        first_strain = _next_pk(Strain)
+        strain_ids = list(range(first_strain, first_strain + strains))
+        Strain.objects.bulk_create(Strain(pk=strain_id, name=f'{prefix}{n:03}') for n, strain_id in enumerate(strain_ids))
+        summary.add('strains', len(strain_ids))
+
+        first_user = _next_pk(User)
+        keepers = User.objects.bulk_create(
+            User(pk=first_user + n, username=f'{prefix}keeper{n}', email=f'{prefix}keeper{n}@example.org', role='staff')
+            for n in range(max(1, mice // 5000))
+        )
+        keeper_ids = [keeper.pk for keeper in keepers]
+
+        first_cage = _next_pk(Cage)
+        cage_count = max(1, mice // 4)
+        Cage.objects.bulk_create((
+            Cage(pk=first_cage + n, cage_number=f'{prefix}{n}', cage_type='Breeding' if n % 5 == 0 else 'Stock', location=f'Room {n % 10 + 1:02}')
+            for n in range(cage_count)
+        ), batch_size=batch_size)
+        summary.add('cages', cage_count)
+
+        pedigree = _Pedigree(rng, _next_pk(Mouse), generations)
+        for strain_id, quota in zip(strain_ids, _split(mice, strains)):
+            if quota:
+                summary.founders.append(pedigree.next_id)
+                pedigree.strain(strain_id, quota)
+                summary.youngest.append(pedigree.next_id - 1)
+
+        rows, strain_of = [], {}
+        for n, (mouse_id, strain_id, tube_id, dob, sex, father_id, mother_id, state) in enumerate(pedigree.rows):
+            strain_of[mouse_id] = strain_id
+            rows.append(Mouse(
+                mouse_id=mouse_id,
+                strain_id=strain_id,
+                tube_id=tube_id,
+                dob=dob,
+                sex=sex,
+                father_id=father_id,
+                mother_id=mother_id,
+                state=state,
+                mouse_keeper_id=keeper_ids[rng.randrange(len(keeper_ids))],
+                # Round robin keeps every cage within its default capacity
+                cage_id=None if state == 'deceased' else first_cage + n % cage_count,
+            ))
+            if len(rows) >= batch_size:
+                Mouse.objects.bulk_create(rows)
+                rows = []
+        Mouse.objects.bulk_create(rows)
+        summary.add('mice', len(pedigree.rows))
+
+        breeds, requests, breed_ids = [], [], {}
+        first_breed = _next_pk(Breed)
+        for father_id, mother_id, generation in dict.fromkeys(pedigree.pairs):
+            breed_ids.setdefault((father_id, mother_id), first_breed + len(breeds))
+            breeds.append(Breed(
+                pk=first_breed + len(breeds),
+                male_id=father_id,
+                female_id=mother_id,
+                cage_id=first_cage + rng.randrange(cage_count),
+                # Pairs producing the youngest generation are still together
+                end_date=None if generation == generations else dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc),
+            ))
+            requests.append(Request(
+                requester_id=keeper_ids[rng.randrange(len(keeper_ids))],
+                mouse_id=father_id,
+                second_mouse_id=mother_id,
+                cage_id=breeds[-1].cage_id,
+                request_type='breed',
+                status='completed' if rng.random() < 0.7 else rng.choice(['pending', 'approved', 'rejected']),
+            ))
+        Breed.objects.bulk_create(breeds, batch_size=batch_size)
+        Request.objects.bulk_create(requests, batch_size=batch_size)
+        summary.add('breeds', len(breeds))
+        summary.add('requests', len(requests))
+
+        litters = {}
+        for _, _, _, dob, _, father_id, mother_id, _ in pedigree.rows:
+            if father_id is not None:
+                litters[(father_id, mother_id, dob)] = litters.get((father_id, mother_id, dob), 0) + 1
+        Litter.objects.bulk_create((
+            Litter(
+                breed_id=breed_ids[(father_id, mother_id)], father_id=father_id, mother_id=mother_id, strain_id=strain_of[mother_id],
+                birth_date=dob, born=pups + _weighted(rng, LOSSES), wean_date=dob + dt.timedelta(days=WEANING_DAYS), weaned=pups,
+            )
+            for (father_id, mother_id, dob), pups in litters.items()
+        ), batch_size=batch_size)
+        summary.add('litters', len(litters))
+
+        genotypes, phenotypes = [], []
+        for mouse_id, *_ in pedigree.rows:
+            gene = GENES[mouse_id % len(GENES)]
+            genotypes.append(Genotype(mouse_id=mouse_id, gene=gene, allele_1=rng.choice(ALLELES), allele_2=rng.choice(ALLELES)))
+            if mouse_id % 4 == 0:
+                characteristic, descriptions = PHENOTYPES[mouse_id % len(PHENOTYPES)]
+                phenotypes.append(Phenotype(mouse_id=mouse_id, characteristic=characteristic, description=rng.choice(descriptions)))
+        Genotype.objects.bulk_create(encode_genotypes(genotypes), batch_size=batch_size)
+        Phenotype.objects.bulk_create(phenotypes, batch_size=batch_size)
+        summary.add('genotypes', len(genotypes))
+        summary.add('phenotypes', len(phenotypes))
+
+        reconcile_all()
+        reconcile_litter_stats()
+        recount_cages()
+        bump_versions(strain_ids)
+        bump_genotype_versions(strain_ids)
+        index_strains(strain_ids)
+        index_mice([row[0] for row in pedigree.rows])
+    return summary
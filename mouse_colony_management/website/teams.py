@@ -0,0 +1,76 @@
+"""Team scope of a user, resolved once per session.
+
+Mice, cages and requests carry a ``team``; ``TeamScopedQuerySet.visible_to``
+limits a listing to the rows of the user's teams (plus colony-wide rows with
+no team) with one ``team_id IN (...)`` filter on an indexed column, instead
+of joining through ``TeamMembership`` on every query.
+
+The user's team IDs are read from ``TeamMembership`` the first time a session
+needs them and kept in the session with the user's ``team_scope_version``.
+The authentication middleware loads the user row on every request anyway, so
+checking the stamp is free. Adding or removing a membership changes the stamp
+and sessions of that user resolve their scope again on the next request.
+"""
+import secrets
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import TeamMembership, User
+
+SESSION_KEY = 'team_scope'
+
+
+class TeamScope:
+    """The teams and role a user acts with."""
+
+    def __init__(self, team_ids, role=None, sees_everything=False):
+        self.team_ids = frozenset(team_ids)
+        self.role = role
+        self.sees_everything = sees_everything
+
+    def includes(self, team_id):
+        """True if a row of ``team_id`` is visible in this scope."""
+        return self.sees_everything or team_id is None or team_id in self.team_ids
+
+    def __repr__(self):
+        return f"TeamScope(team_ids={sorted(self.team_ids)}, role={self.role!r})"
+
+
+# Anonymous users only see colony-wide rows
+NO_TEAMS = TeamScope(())
+
+
+def team_scope(user, session=None):
+    """``user``'s TeamScope, from the user object, then ``session``, then the database."""
+    if not user.is_authenticated:
+        return NO_TEAMS
+    scope = getattr(user, '_team_scope', None)
+    if scope is not None:
+        return scope
+    stored = session.get(SESSION_KEY) if session is not None else None
+    if stored and stored['user'] == user.pk and stored['version'] == user.team_scope_version:
+        team_ids = stored['teams']
+    else:
+        team_ids = list(TeamMembership.objects.filter(user_id=user.pk).values_list('team_id', flat=True))
+        if session is not None:
+            session[SESSION_KEY] = {'user': user.pk, 'version': user.team_scope_version, 'teams': team_ids}
+    user._team_scope = TeamScope(team_ids, user.role, user.is_superuser)
+    return user._team_scope
+
+
+def request_scope(request):
+    """The TeamScope of the user making ``request``."""
+    return team_scope(request.user, request.session)
+
+
+def bump_scopes(user_ids):
+    """Make sessions of ``user_ids`` resolve their team scope again."""
+    User.objects.filter(pk__in=list(user_ids)).update(team_scope_version=secrets.randbits(63))
+
+
+@receiver(post_save, sender=TeamMembership)
+@receiver(post_delete, sender=TeamMembership)
+def bump_on_membership_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_scopes({instance.user_id, instance.loaded_value('user_id')})
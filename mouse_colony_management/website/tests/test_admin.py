@@ -0,0 +1,64 @@
+from django.test import TestCase
+from django.urls import reverse
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from website.models import *
+from website.admin import EstimatedCountPaginator
+import datetime as dt
+
+# Queries for one changelist page: session, user, the page and its count,
+# list filter choices and the like, but nothing per row
+QUERY_BUDGET = 12
+
+class AdminChangelistTest(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', email='admin@abdn.ac.uk', password='password')
+        self.client.login(username='admin', password='password')
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.team = Team.objects.create(name='Team A')
+        self.count = 0
+
+    def add_rows(self, n):
+        for _ in range(n):
+            self.count += 1
+            cage = Cage.objects.create(cage_number=f'C{self.count:03}', cage_type='Breeding', location='Room 101')
+            male = Mouse.objects.create(strain=self.strain, tube_id=2 * self.count, dob=dt.date(2023, 1, 1), sex='M', state='alive', cage=cage)
+            female = Mouse.objects.create(strain=self.strain, tube_id=2 * self.count + 1, dob=dt.date(2023, 1, 1), sex='F', state='alive')
+            Request.objects.create(requester=self.admin, mouse=male, second_mouse=female, cage=cage, request_type='breed')
+            Breed.objects.create(male=male, female=female, cage=cage)
+            Genotype.objects.create(mouse=male, gene='Gene A', allele_1='+', allele_2='-')
+            Phenotype.objects.create(mouse=female, characteristic='Coat Colour', description='Black')
+            user = User.objects.create_user(username=f'user{self.count}', email=f'user{self.count}@abdn.ac.uk', password='password')
+            TeamMembership.objects.create(user=user, team=self.team)
+
+    def queries(self, model):
+        url = reverse(f'admin:website_{model}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_budget(self):
+        models = ['mouse', 'request', 'breed', 'genotype', 'phenotype', 'teammembership', 'cage']
+        self.add_rows(2)
+        few = {model: self.queries(model) for model in models}
+        self.add_rows(10)
+        many = {model: self.queries(model) for model in models}
+        self.assertEqual(few, many)
+        for model, count in many.items():
+            self.assertLessEqual(count, QUERY_BUDGET, model)
+
+    def test_mouse_autocomplete(self):
+        self.add_rows(3)
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'website', 'model_name': 'request', 'field_name': 'mouse', 'term': '4',
+        })
+        # Matches mouse_id 4 or tube 4, without listing every mouse
+        expected = Mouse.objects.filter(Q(pk=4) | Q(tube_id=4)).order_by('pk')
+        self.assertEqual([result['text'] for result in response.json()['results']], [str(mouse) for mouse in expected])
+
+    def test_estimated_count_falls_back_to_exact(self):
+        self.add_rows(3)
+        self.assertEqual(EstimatedCountPaginator(Mouse.objects.order_by('pk'), 50).count, 6)
@@ -0,0 +1,76 @@
+from django.test import TestCase
+from django.urls import reverse
+from website.models import *
+from website.metrics import store
+import datetime as dt
+
+class AsyncApiTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='tech', email='tech@abdn.ac.uk', password='password')
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.cage = Cage.objects.create(cage_number='C001', cage_type='Breeding', location='Room 101')
+        self.spare = Cage.objects.create(cage_number='C002', cage_type='Standard', location='Room 102')
+        self.father = Mouse.objects.create(strain=self.strain, tube_id=1, dob=dt.date(2023, 1, 1), sex='M', state='alive', cage=self.cage)
+        self.mother = Mouse.objects.create(strain=self.strain, tube_id=2, dob=dt.date(2023, 1, 1), sex='F', state='alive', cage=self.cage)
+        self.pup = Mouse.objects.create(strain=self.strain, tube_id=3, dob=dt.date(2023, 6, 1), sex='F', state='alive', father=self.father, mother=self.mother)
+        self.grandpup = Mouse.objects.create(strain=self.strain, tube_id=4, dob=dt.date(2024, 1, 1), sex='M', state='alive', mother=self.pup)
+        Genotype.objects.create(mouse=self.pup, gene='Apoe', allele_1='tm1', allele_2='+')
+        Phenotype.objects.create(mouse=self.pup, characteristic='Coat', description='Black')
+        self.breed = Breed.objects.create(male=self.father, female=self.mother, cage=self.cage)
+        for mouse in (self.father, self.mother, self.pup):
+            Request.objects.create(requester=self.user, mouse=mouse, request_type='cull')
+
+    async def test_anonymous_requests_are_rejected(self):
+        response = await self.async_client.get(reverse('api_mouse', args=[self.pup.mouse_id]))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_mouse_detail(self):
+        await self.async_client.aforce_login(self.user)
+        data = (await self.async_client.get(reverse('api_mouse', args=[self.pup.mouse_id]))).json()
+        self.assertEqual(data['father_id'], self.father.mouse_id)
+        self.assertEqual(data['strain__name'], 'C57BL/6')
+        self.assertEqual([(g['gene'], g['zygosity']) for g in data['genotypes']], [('Apoe', 'heterozygous')])
+        self.assertEqual(data['phenotypes'][0]['description'], 'Black')
+        self.assertEqual(data['offspring'], 1)
+        self.assertIsNone(data['cage'])
+        response = await self.async_client.get(reverse('api_mouse', args=[99999]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_lineage_gathers_ancestors_and_descendants(self):
+        await self.async_client.aforce_login(self.user)
+        data = (await self.async_client.get(reverse('api_mouse_lineage', args=[self.pup.mouse_id]), {'depth': 2})).json()
+        self.assertEqual(sorted(m['mouse_id'] for m in data['ancestors']), [self.father.mouse_id, self.mother.mouse_id])
+        self.assertEqual([(m['mouse_id'], m['generation']) for m in data['descendants']], [(self.grandpup.mouse_id, 1)])
+        response = await self.async_client.get(reverse('api_mouse_lineage', args=[self.pup.mouse_id]), {'depth': 'deep'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_cages(self):
+        await self.async_client.aforce_login(self.user)
+        data = (await self.async_client.get(reverse('api_cage', args=[self.cage.cage_id]))).json()
+        self.assertEqual(data['occupancy'], 2)
+        self.assertEqual(sorted(m['tube_id'] for m in data['mice']), [1, 2])
+        self.assertEqual(data['active_breed']['breed_id'], self.breed.breed_id)
+        data = (await self.async_client.get(reverse('api_cages'), {'location': 'Room 102'})).json()
+        self.assertEqual([c['cage_number'] for c in data['results']], ['C002'])
+        self.assertIsNone(data['next_cursor'])
+
+    async def test_requests_are_keyset_paginated(self):
+        await self.async_client.aforce_login(self.user)
+        first = (await self.async_client.get(reverse('api_requests'), {'status': 'pending', 'limit': 2})).json()
+        self.assertEqual(first['total'], 3)
+        self.assertEqual(len(first['results']), 2)
+        second = (await self.async_client.get(reverse('api_requests'), {'status': 'pending', 'limit': 2, 'cursor': first['next_cursor']})).json()
+        self.assertEqual(len(second['results']), 1)
+        self.assertIsNone(second['next_cursor'])
+        self.assertGreater(second['results'][0]['request_id'], first['results'][-1]['request_id'])
+        response = await self.async_client.get(reverse('api_requests'), {'status': 'lost'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_metrics_are_recorded_for_async_views(self):
+        store.reset()
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.get(reverse('api_cages'))
+        stats = store.stats()['api_cages']
+        self.assertEqual(stats['count'], 1)
+        self.assertGreater(stats['queries'], 0)
@@ -0,0 +1,70 @@
+from django.test import TestCase
+from django.core.management import call_command
+from django.db import transaction
+from website.models import *
+from django.db.models import Sum
+from website.benchmarks import HOT_PATHS, HOT_QUERIES, PathTiming, benchmark_paths, benchmark_queries, compare
+from website.synthetic import generate_colony
+from io import StringIO
+
+class SyntheticColonyTest(TestCase):
+
+    def test_generated_colony_is_consistent(self):
+        summary = generate_colony(mice=400, strains=4, seed=7)
+        self.assertEqual(summary.counts['mice'], 400)
+        self.assertEqual(Mouse.objects.count(), 400)
+        self.assertEqual(Genotype.objects.count(), 400)
+        # Parents are of the right sex, in the same strain and born earlier
+        for mouse in Mouse.objects.filter(father__isnull=False).select_related('father', 'mother')[:50]:
+            self.assertEqual((mouse.father.sex, mouse.mother.sex), ('M', 'F'))
+            self.assertEqual({mouse.father.strain_id, mouse.mother.strain_id}, {mouse.strain_id})
+            self.assertLess(max(mouse.father_id, mouse.mother_id), mouse.mouse_id)
+        self.assertFalse(Cage.objects.filter(occupancy__gt=F('capacity')).exists())
+        self.assertEqual(sum(MouseCountRollup.objects.values_list('count', flat=True)), 400)
+        # Pups come in litters of full siblings born on the same day
+        litters, pups = BreedingPairRollup.objects.aggregate(litters=Sum('litters'), pups=Sum('pups')).values()
+        self.assertLess(litters * 3, pups)
+        self.assertEqual(Mouse.objects.filter(father__isnull=True).count(), 4 * 5)
+
+    def test_same_seed_same_colony(self):
+        def colony():
+            return list(Mouse.objects.order_by('tube_id', 'strain__name').values_list('tube_id', 'sex', 'state', 'dob', 'strain__name'))
+        with transaction.atomic():
+            generate_colony(mice=200, strains=2, seed=3)
+            first = colony()
+            transaction.set_rollback(True)
+        generate_colony(mice=200, strains=2, seed=3)
+        self.assertEqual(first, colony())
+
+    def test_benchmark_queries(self):
+        generate_colony(mice=200, strains=2)
+        results = benchmark_queries(repeat=2)
+        self.assertEqual([result.name for result in results], list(HOT_QUERIES))
+        active = next(result for result in results if result.name == 'active_breeds')
+        self.assertEqual(active.rows, Breed.objects.filter(end_date__isnull=True).count())
+        self.assertTrue(active.plan)
+
+    def test_command_rolls_back_generated_colony(self):
+        out = StringIO()
+        call_command('benchmark_queries', generate=100, repeat=1, stdout=out)
+        self.assertIn('pending_requests', out.getvalue())
+        self.assertEqual(Mouse.objects.count(), 0)
+
+    def test_benchmark_paths(self):
+        results = benchmark_paths([300], repeat=1)
+        self.assertEqual([result.name for result in results], list(HOT_PATHS))
+        for result in results:
+            self.assertGreater(result.queries, 0)
+            self.assertGreater(result.peak_kib, 0)
+        # Everything generated or written during the run is rolled back
+        self.assertEqual(Mouse.objects.count(), 0)
+        self.assertEqual(Breed.objects.count(), 0)
+
+    def test_compare_with_baseline(self):
+        baseline = {('get_ancestors', 1000): {'cold_ms': 10.0, 'warm_ms': 4.0, 'queries': 3, 'peak_kib': 100.0}}
+        same = PathTiming('get_ancestors', 1000, 11.0, 5.0, 3, 120.0)
+        self.assertEqual(compare([same], baseline), [])
+        worse = PathTiming('get_ancestors', 1000, 11.0, 20.0, 4, 400.0)
+        regressions = compare([worse], baseline)
+        self.assertEqual(len(regressions), 3)
+        self.assertIn('4 queries, baseline 3', regressions[0])
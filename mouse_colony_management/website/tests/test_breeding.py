@@ -0,0 +1,145 @@
+from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.urls import reverse
+from website.models import *
+from website.breeding import DEFAULT_LITTER_SIZE, mean_litter_size, predict_pairs, predict_requests, rank_pairs, recommend_pairs
+from io import StringIO
+import datetime as dt
+
+class OffspringPredictionTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.user = User.objects.create_user(username='leader', password='secret', role='leader')
+        self.het_male = self.make(1, 'M', Apoe=('+', 'tm1'), Lepr=('+', 'db'))
+        self.wild_male = self.make(2, 'M', Apoe=('+', '+'))
+        self.het_female = self.make(3, 'F', Apoe=('tm1', '+'), Lepr=('db', 'db'))
+        self.ko_female = self.make(4, 'F', Apoe=('tm1', 'tm1'))
+        self.untested_female = self.make(5, 'F')
+
+    def make(self, tube_id, sex, **genotypes):
+        mouse = Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob=dt.date(2023, 1, 1), sex=sex, state='alive')
+        for gene, (allele_1, allele_2) in genotypes.items():
+            Genotype.objects.create(mouse=mouse, gene=gene, allele_1=allele_1, allele_2=allele_2)
+        return mouse
+
+    def test_mendelian_ratios(self):
+        cross, backcross, untested = predict_pairs([
+            (self.het_male.pk, self.het_female.pk),
+            (self.wild_male.pk, self.ko_female.pk),
+            (self.het_male.pk, self.untested_female.pk),
+        ])
+        self.assertEqual(cross.genotypes, {
+            'Apoe': {'+/+': 0.25, '+/tm1': 0.5, 'tm1/tm1': 0.25},
+            'Lepr': {'+/db': 0.5, 'db/db': 0.5},
+        })
+        # Only genes tested in both parents are predicted
+        self.assertEqual(backcross.genotypes, {'Apoe': {'+/tm1': 1.0}})
+        self.assertEqual(untested.genotypes, {})
+        self.assertIsNone(cross.probability)
+
+    def test_desired_genotype(self):
+        prediction, = predict_pairs([(self.het_male.pk, self.het_female.pk)], {'Apoe': 'tm1/tm1', 'Lepr': 'homozygous'}, litter_size=8)
+        self.assertAlmostEqual(prediction.probability, 0.125)
+        self.assertAlmostEqual(prediction.expected_pups, 1.0)
+        self.assertAlmostEqual(prediction.at_least_one, 1 - 0.875 ** 8)
+
+    def test_rank_pairs(self):
+        # Litter size, strains, versions and one matrix load, however many pairs
+        with self.assertNumQueries(6):
+            ranking = rank_pairs([self.wild_male.pk, self.het_male.pk], [self.untested_female.pk, self.het_female.pk, self.ko_female.pk], {'Apoe': 'tm1/+'})
+        # Equally likely pairs keep the order they were screened in
+        self.assertEqual([(p.father_id, p.mother_id) for p in ranking[:4]], [
+            (self.wild_male.pk, self.ko_female.pk), (self.wild_male.pk, self.het_female.pk),
+            (self.het_male.pk, self.het_female.pk), (self.het_male.pk, self.ko_female.pk),
+        ])
+        self.assertEqual([p.probability for p in ranking], [1.0, 0.5, 0.5, 0.5, 0.0, 0.0])
+        self.assertEqual(len(rank_pairs([self.het_male.pk], [self.het_female.pk, self.ko_female.pk], {'Apoe': 'homozygous'}, limit=1)), 1)
+
+    def test_pending_requests(self):
+        cage = Cage.objects.create(cage_number='B1', cage_type='Breeding', location='Room 1')
+        pending = Request.objects.create(requester=self.user, mouse=self.het_female, second_mouse=self.het_male, cage=cage, request_type='breed')
+        Request.objects.create(requester=self.user, mouse=self.wild_male, second_mouse=self.ko_female, cage=cage, request_type='breed', status='rejected')
+        predictions = predict_requests()
+        self.assertEqual(list(predictions), [pending.pk])
+        self.assertEqual(predictions[pending.pk].genotypes['Apoe']['+/tm1'], 0.5)
+        self.assertIn('Apoe: +/+ 25%, +/tm1 50%, tm1/tm1 25%', str(predictions[pending.pk]))
+
+    def test_mean_litter_size(self):
+        self.assertEqual(mean_litter_size(), DEFAULT_LITTER_SIZE)
+        for tube_id, dob in [(10, dt.date(2023, 6, 1)), (11, dt.date(2023, 6, 1)), (12, dt.date(2023, 6, 1)), (13, dt.date(2023, 9, 1))]:
+            Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob=dob, sex='M', state='alive', father=self.het_male, mother=self.het_female)
+        self.assertEqual(mean_litter_size(), 2)
+
+
+class RecommendPairsTest(TestCase):
+
+    def setUp(self):
+        self.today = dt.date.today()
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.leader = User.objects.create_user(username='leader', password='secret', role='leader')
+        self.male = self.make(1, 'M', 120, 'tm1', 'tm1')
+        self.female = self.make(2, 'F', 120, '+', '+')
+        self.son = self.make(3, 'M', 60, '+', 'tm1', father=self.male, mother=self.female)
+        self.daughter = self.make(4, 'F', 60, 'tm1', '+', father=self.male, mother=self.female)
+        self.old_female = self.make(5, 'F', 200, 'tm1', 'tm1')
+        self.retired = self.make(6, 'M', 300, 'tm1', 'tm1')
+        self.weanling = self.make(7, 'F', 30, 'tm1', 'tm1')
+        self.free_cage = Cage.objects.create(cage_number='B1', cage_type='Breeding', location='Room 1')
+        self.retired.cage = Cage.objects.create(cage_number='B2', cage_type='Breeding', location='Room 1')
+        self.retired.save()
+
+    def make(self, tube_id, sex, age, allele_1, allele_2, **parents):
+        mouse = Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob=self.today - dt.timedelta(days=age), sex=sex, state='alive', **parents)
+        Genotype.objects.create(mouse=mouse, gene='Apoe', allele_1=allele_1, allele_2=allele_2)
+        return mouse
+
+    def test_ranking(self):
+        # An empty cage without room for a pair is not offered
+        CageType.objects.create(name='Isolation', capacity=1)
+        Cage.objects.create(cage_number='A1', cage_type='Isolation', location='Room 1')
+        first, second = recommend_pairs(self.strain.pk, {'Apoe': 'tm1/tm1'})
+        # The older female is past her prime but unrelated and homozygous
+        self.assertEqual((first.father_id, first.mother_id, first.probability, first.kinship), (self.male.pk, self.old_female.pk, 1.0, 0.0))
+        self.assertAlmostEqual(first.score, 1 - 20 / 90)
+        self.assertEqual(first.cage_id, self.free_cage.pk)
+        # Full sibs are penalised for their kinship, and there is no cage left for them
+        self.assertEqual((second.father_id, second.mother_id, second.kinship), (self.son.pk, self.daughter.pk, 0.25))
+        self.assertAlmostEqual(second.score, 0.25 * 0.5)
+        self.assertIsNone(second.cage_id)
+        self.assertEqual(second.genotypes, {'Apoe': {'+/+': 0.25, 'tm1/+': 0.5, 'tm1/tm1': 0.25}})
+
+    def test_requested_mice_are_skipped(self):
+        Request.objects.create(requester=self.leader, mouse=self.male, second_mouse=self.old_female, cage=self.free_cage, request_type='breed')
+        recommendations = recommend_pairs(self.strain.pk, {'Apoe': 'tm1/tm1'})
+        self.assertEqual([(r.father_id, r.mother_id) for r in recommendations], [(self.son.pk, self.daughter.pk)])
+
+    def test_without_target(self):
+        recommendations = recommend_pairs(self.strain.pk, limit=1)
+        self.assertEqual(len(recommendations), 1)
+        self.assertIsNone(recommendations[0].probability)
+        # Unrelated prime-age mice come first when genotype does not matter
+        self.assertEqual(recommendations[0].kinship, 0.0)
+        self.assertAlmostEqual(recommendations[0].score, 1.0)
+
+    def test_view(self):
+        url = reverse('breeding_recommendations', args=[self.strain.pk])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.login(username='leader', password='secret')
+        response = self.client.get(url, {'target': 'Apoe:tm1/tm1', 'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['target'], {'Apoe': 'tm1/tm1'})
+        self.assertEqual([(p['father_id'], p['mother_id']) for p in response.json()['pairs']], [(self.male.pk, self.old_female.pk)])
+        self.assertEqual(self.client.get(url, {'target': 'Apoe'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'target': 'Apoe:tm1'}).status_code, 400)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('recommend_pairs', 'C57BL/6', '--target', 'Apoe:tm1/tm1', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn(f"{self.male.pk} x {self.old_female.pk}", lines[0])
+        self.assertIn('cage B1', lines[0])
+        self.assertIn('none free', lines[1])
+        with self.assertRaises(CommandError):
+            call_command('recommend_pairs', 'Unknown')
@@ -0,0 +1,126 @@
+from django.test import TestCase
+from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from website.models import *
+from website.bulk_requests import process_requests
+from website.rollups import reconcile_all
+import datetime as dt
+
+class BulkRequestTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.user = User.objects.create_user(username='leader', email='leader@abdn.ac.uk', password='password', role='leader')
+        CageType.objects.create(name='Breeding', capacity=4)
+        self.cages = [Cage.objects.create(cage_number=f'B00{n}', cage_type='Breeding', location='Room 101') for n in range(3)]
+        self.mice = [
+            Mouse.objects.create(strain=self.strain, tube_id=n, dob=dt.date(2023, 1, 1), sex='M' if n % 2 else 'F', state='alive')
+            for n in range(1, 9)
+        ]
+
+    def breed(self, male, female, cage, status='approved'):
+        return Request.objects.create(requester=self.user, mouse=male, second_mouse=female, cage=cage, request_type='breed', status=status)
+
+    def cull(self, mouse, status='approved'):
+        return Request.objects.create(requester=self.user, mouse=mouse, request_type='cull', status=status)
+
+    def rollups(self):
+        return (
+            sorted(MouseCountRollup.objects.filter(count__gt=0).values_list('strain_id', 'state', 'sex', 'count')),
+            sorted(CageRollup.objects.filter(active_breeds__gt=0).values_list('cage_id', 'active_breeds')),
+            sorted(RequestRollup.objects.filter(count__gt=0).values_list('request_type', 'status', 'count')),
+        )
+
+    def test_approve_and_reject_check_status(self):
+        pending = self.cull(self.mice[0], status='pending')
+        done = self.cull(self.mice[1], status='completed')
+        report = process_requests([pending, done.pk, 999], 'approve')
+        self.assertEqual(report.done, [pending.pk])
+        self.assertEqual([request_id for request_id, _ in report.errors], [done.pk, 999])
+        pending.refresh_from_db()
+        self.assertEqual(pending.status, 'approved')
+
+        report = process_requests([pending], 'reject')
+        self.assertEqual(str(report), "1 rejected, 0 errors")
+
+    def test_complete_batch(self):
+        male, female = self.mice[0], self.mice[1]
+        requests = [self.breed(male, female, self.cages[0]), self.cull(self.mice[2]), self.cull(self.mice[3])]
+        report = process_requests(requests, 'complete')
+        self.assertEqual(report.done, [request.pk for request in requests])
+
+        self.assertEqual(Breed.objects.filter(male=male, female=female, cage=self.cages[0], end_date__isnull=True).count(), 1)
+        states = dict(Mouse.objects.values_list('tube_id', 'state'))
+        self.assertEqual([states[n] for n in (1, 2, 3, 4, 5)], ['breeding', 'breeding', 'deceased', 'deceased', 'alive'])
+        self.assertTrue(Mouse.objects.get(tube_id=3).cull_date)
+        self.cages[0].refresh_from_db()
+        self.assertEqual(self.cages[0].occupancy, 2)
+        self.assertEqual(CageAssignment.objects.filter(cage=self.cages[0], removed_at__isnull=True).count(), 2)
+        self.assertEqual(set(Request.objects.values_list('status', flat=True)), {'completed'})
+
+        # The incrementally kept rollups agree with a full recompute
+        kept = self.rollups()
+        reconcile_all()
+        self.assertEqual(kept, self.rollups())
+
+    def test_complete_validates_against_the_batch(self):
+        first = self.breed(self.mice[0], self.mice[1], self.cages[0])
+        # Same cage as an earlier request in the batch
+        second = self.breed(self.mice[2], self.mice[3], self.cages[0])
+        # Culled earlier in the batch
+        cull = self.cull(self.mice[4])
+        third = self.breed(self.mice[4], self.mice[5], self.cages[1])
+        # Not approved yet
+        pending = self.breed(self.mice[6], self.mice[7], self.cages[2], status='pending')
+
+        report = process_requests([first, second, cull, third, pending], 'complete')
+        self.assertEqual(report.done, [first.pk, cull.pk])
+        errors = dict(report.errors)
+        self.assertIn('active breeding pair', errors[second.pk])
+        self.assertIn('deceased', errors[third.pk])
+        self.assertIn('pending', errors[pending.pk])
+        self.assertEqual(Breed.objects.count(), 1)
+        self.assertEqual(Mouse.objects.get(pk=self.mice[2].pk).state, 'alive')
+
+    def test_pairs_named_female_first_breed_as_male_and_female(self):
+        female, male = self.mice[1], self.mice[2]
+        process_requests([self.breed(female, male, self.cages[0])], 'complete')
+        breed = Breed.objects.get()
+        self.assertEqual((breed.male, breed.female), (male, female))
+        # Only the touched rollup rows change; they still agree with a full recompute
+        kept = self.rollups()
+        reconcile_all()
+        self.assertEqual(kept, self.rollups())
+
+    def test_queries_do_not_grow_with_batch(self):
+        def count(mice):
+            requests = [self.cull(mouse) for mouse in mice]
+            with CaptureQueriesContext(connection) as queries:
+                process_requests(requests, 'complete')
+            return len(queries)
+        # The first batch also creates the rollup row for completed culls
+        count(self.mice[:1])
+        self.assertEqual(count(self.mice[1:3]), count(self.mice[3:8]))
+
+    def test_complete_rejects_full_cage(self):
+        for mouse in self.mice[5:8]:
+            mouse.cage = self.cages[1]
+            mouse.save()
+        request = self.breed(self.mice[0], self.mice[1], self.cages[1])
+        report = process_requests([request], 'complete')
+        self.assertIn('is full', report.errors[0][1])
+        request.refresh_from_db()
+        self.assertEqual(request.status, 'approved')
+
+    def test_admin_action(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.login(username='leader', password='password')
+        requests = [self.cull(self.mice[0], status='pending'), self.cull(self.mice[1], status='pending')]
+        response = self.client.post(reverse('admin:website_request_changelist'), {
+            'action': 'approve_requests',
+            '_selected_action': [request.pk for request in requests],
+        }, follow=True)
+        self.assertContains(response, "Requests 2 approved, 0 errors.")
+        self.assertEqual(set(Request.objects.values_list('status', flat=True)), {'approved'})
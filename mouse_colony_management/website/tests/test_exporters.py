@@ -0,0 +1,51 @@
+from django.test import TestCase
+from django.urls import reverse
+from django.core.management import call_command
+from website.models import *
+from website.exporters import export_colony
+from io import StringIO
+import csv
+import datetime as dt
+import json
+
+class ColonyExportTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.keeper = User.objects.create_user(username='keeper', email='keeper@abdn.ac.uk', password='password', role='leader')
+        self.father = Mouse.objects.create(strain=self.strain, tube_id=1, dob=dt.date(2023, 1, 1), sex='M', state='alive', mouse_keeper=self.keeper)
+        self.mother = Mouse.objects.create(strain=self.strain, tube_id=2, dob=dt.date(2023, 1, 1), sex='F', state='alive')
+        self.pup = Mouse.objects.create(strain=self.strain, tube_id=3, dob=dt.date(2023, 6, 1), sex='F', state='alive', father=self.father, mother=self.mother)
+        Genotype.objects.create(mouse=self.pup, gene='p53', allele_1='A', allele_2='B')
+
+    def test_csv_export_pages_by_primary_key(self):
+        # Header chunk, then one query per page plus the final empty page
+        with self.assertNumQueries(3):
+            text = ''.join(export_colony('mice', 'csv', chunk_size=2))
+        rows = list(csv.DictReader(StringIO(text)))
+        self.assertEqual([row['tube_id'] for row in rows], ['1', '2', '3'])
+        self.assertEqual(rows[0]['mouse_keeper'], 'keeper')
+        self.assertEqual((rows[2]['father_tube_id'], rows[2]['mother_tube_id']), ('1', '2'))
+        self.assertEqual(rows[1]['father_id'], '')
+
+    def test_jsonl_and_columnar_exports(self):
+        lines = ''.join(export_colony('genotypes', 'jsonl')).splitlines()
+        self.assertEqual(json.loads(lines[0])['gene'], 'p53')
+
+        blocks = [json.loads(line) for line in ''.join(export_colony('mice', 'columnar', chunk_size=2)).splitlines()]
+        self.assertEqual(blocks[0]['dataset'], 'mice')
+        self.assertEqual([block['rows'] for block in blocks[1:]], [2, 1])
+        self.assertEqual(blocks[1]['columns']['dob'], ['2023-01-01', '2023-01-01'])
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command('export_colony', 'breeds', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'breed_id,male_id,female_id,cage,start_date,end_date')
+
+    def test_export_view_streams(self):
+        self.client.login(username='keeper', password='password')
+        response = self.client.get(reverse('export_colony', args=['mice']), {'format': 'jsonl'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+        self.assertEqual(self.client.get(reverse('export_colony', args=['cages'])).status_code, 404)
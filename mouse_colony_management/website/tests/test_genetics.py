@@ -0,0 +1,67 @@
+from django.test import TestCase
+from django.core.management import call_command
+from website.models import *
+from website.genetics import genotype_matrix, litter_counts
+from io import StringIO
+import datetime as dt
+
+class GenotypeMatrixTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.father = self.make(1, 'M')
+        self.mother = self.make(2, 'F')
+        self.pups = [self.make(n, 'MF'[n % 2], father=self.father, mother=self.mother) for n in range(3, 8)]
+        genotypes = {
+            self.father: [('Apoe', '+', 'tm1'), ('Lepr', '+', '+')],
+            self.mother: [('Apoe', 'tm1', 'tm1'), ('Lepr', 'db', '+')],
+            self.pups[0]: [('Apoe', 'tm1', '+'), ('Lepr', '+', 'db')],
+            self.pups[1]: [('Apoe', 'tm1', 'tm1'), ('Lepr', '+', '+')],
+            self.pups[2]: [('Apoe', '+', 'tm1')],
+        }
+        for mouse, rows in genotypes.items():
+            for gene, allele_1, allele_2 in rows:
+                Genotype.objects.create(mouse=mouse, gene=gene, allele_1=allele_1, allele_2=allele_2)
+
+    def make(self, tube_id, sex, **parents):
+        return Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob=dt.date(2023, 1, 1), sex=sex, state='alive', **parents)
+
+    def test_dictionary_and_zygosity(self):
+        self.assertEqual(set(Gene.objects.values_list('name', flat=True)), {'Apoe', 'Lepr'})
+        self.assertEqual(Allele.objects.filter(gene__name='Apoe').count(), 2)
+        genotype = Genotype.objects.get(mouse=self.pups[0], gene='Apoe')
+        self.assertEqual((genotype.zygosity, genotype.allele_1_code.symbol, genotype.allele_2_code.symbol), ('heterozygous', 'tm1', '+'))
+        self.assertEqual(Genotype.objects.filter(locus__name='Lepr', zygosity='homozygous').count(), 2)
+
+    def test_matrix_filters(self):
+        matrix = genotype_matrix(self.strain.pk)
+        self.assertEqual(len(matrix), 5)
+        self.assertEqual(matrix.mice('Apoe', 'heterozygous'), [self.father.pk, self.pups[0].pk, self.pups[2].pk])
+        self.assertEqual(matrix.mice('Lepr', allele='db'), [self.mother.pk, self.pups[0].pk])
+        self.assertEqual(matrix.matching({'Apoe': 'heterozygous', 'Lepr': 'homozygous'}), [self.father.pk])
+        self.assertEqual(matrix.mice('Unknown'), [])
+        with self.assertRaises(ValueError):
+            matrix.mask('Apoe', 'hemizygous')
+
+    def test_counts_and_litters(self):
+        matrix = genotype_matrix(self.strain.pk)
+        self.assertEqual(sum(matrix.counts('Apoe').values()), 5)
+        counts = litter_counts(self.father.pk, self.mother.pk, 'Apoe')
+        # Pairs are ordered by allele code, and '+' was recorded first
+        self.assertEqual(counts, {'+/tm1': 2, 'tm1/tm1': 1})
+
+    def test_matrix_is_cached_until_genotypes_change(self):
+        matrix = genotype_matrix(self.strain.pk)
+        with self.assertNumQueries(1):
+            self.assertIs(genotype_matrix(self.strain.pk), matrix)
+        # A retest replaces the earlier result
+        Genotype.objects.create(mouse=self.pups[2], gene='Apoe', allele_1='+', allele_2='+')
+        self.assertEqual(genotype_matrix(self.strain.pk).mice('Apoe', 'heterozygous'), [self.father.pk, self.pups[0].pk])
+
+    def test_normalize_command(self):
+        Genotype.objects.update(locus=None, allele_1_code=None, allele_2_code=None, zygosity='')
+        out = StringIO()
+        call_command('normalize_genotypes', stdout=out)
+        self.assertIn('Encoded 9 genotypes', out.getvalue())
+        self.assertFalse(Genotype.objects.filter(locus__isnull=True).exists())
+        self.assertEqual(genotype_matrix(self.strain.pk).mice('Apoe', 'homozygous'), [self.mother.pk, self.pups[1].pk])
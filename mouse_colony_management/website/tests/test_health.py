@@ -0,0 +1,109 @@
+from io import StringIO
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from website.health import health_trend, ingest_observations, reconcile_health_rollups, room_trend
+from website.importers import import_colony
+from website.models import *
+import datetime as dt
+
+def at(day, hour=9):
+    return timezone.make_aware(dt.datetime(2024, 3, day, hour))
+
+class HealthRollupTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.cage = Cage.objects.create(cage_number='C001', cage_type='Standard', location='Room 101')
+        self.other_cage = Cage.objects.create(cage_number='C002', cage_type='Standard', location='Room 101')
+        self.first = Mouse.objects.create(strain=self.strain, tube_id=1, dob=dt.date(2024, 1, 1), sex='F', state='alive', cage=self.cage)
+        self.second = Mouse.objects.create(strain=self.strain, tube_id=2, dob=dt.date(2024, 1, 1), sex='M', state='alive', cage=self.other_cage)
+
+    def rollup(self, scope, scope_id, period, start, metric='weight'):
+        return HealthRollup.objects.get(scope=scope, scope_id=scope_id, metric=metric, period=period, period_start=start)
+
+    def test_ingestion_builds_day_and_week_rollups(self):
+        # 2024-03-04 is a Monday
+        created = ingest_observations([
+            (self.first.pk, 'weight', 20.0, at(4)),
+            (self.first.pk, 'weight', 22.0, at(4, 15)),
+            (self.second.pk, 'weight', 30.0, at(5)),
+            (self.first.pk, 'temperature', 37.1, at(5)),
+        ], device='balance-1')
+        self.assertEqual(created, 4)
+        day = self.rollup('mouse', self.first.pk, 'day', dt.date(2024, 3, 4))
+        self.assertEqual((day.count, day.mean, day.minimum, day.maximum), (2, 21.0, 20.0, 22.0))
+        week = self.rollup('strain', self.strain.pk, 'week', dt.date(2024, 3, 4))
+        self.assertEqual((week.count, week.total, week.minimum, week.maximum), (3, 72.0, 20.0, 30.0))
+        self.assertEqual(self.rollup('cage', self.other_cage.pk, 'day', dt.date(2024, 3, 5)).count, 1)
+        # Sending the same batch again adds nothing
+        self.assertEqual(ingest_observations([(self.first.pk, 'weight', 20.0, at(4))]), 0)
+        self.assertEqual(self.rollup('mouse', self.first.pk, 'day', dt.date(2024, 3, 4)).count, 2)
+
+    def test_bad_readings_are_rejected_before_writing(self):
+        with self.assertRaises(ValueError):
+            ingest_observations([(self.first.pk, 'weight', 20.0, at(4)), (self.first.pk, 'weight', 500, at(5))])
+        with self.assertRaises(ValueError):
+            ingest_observations([(self.first.pk, 'height', 2.0, at(4))])
+        self.assertFalse(HealthObservation.objects.exists())
+
+    def test_edits_and_deletes_refresh_minimum_and_maximum(self):
+        ingest_observations([(self.first.pk, 'weight', 20.0, at(4)), (self.first.pk, 'weight', 25.0, at(4, 15))])
+        heaviest = HealthObservation.objects.get(value=25.0)
+        heaviest.observed_at = at(12)
+        heaviest.save()
+        self.assertEqual(self.rollup('mouse', self.first.pk, 'day', dt.date(2024, 3, 4)).maximum, 20.0)
+        self.assertEqual(self.rollup('mouse', self.first.pk, 'week', dt.date(2024, 3, 11)).maximum, 25.0)
+        heaviest.delete()
+        self.assertFalse(HealthRollup.objects.filter(period_start=dt.date(2024, 3, 11)).exists())
+        self.assertEqual(self.rollup('cage', self.cage.pk, 'week', dt.date(2024, 3, 4)).count, 1)
+
+    def test_cage_history_survives_moves_and_trends_combine_a_room(self):
+        ingest_observations([(self.first.pk, 'weight', 20.0, at(4)), (self.second.pk, 'weight', 30.0, at(4))])
+        self.first.cage = self.other_cage
+        self.first.save()
+        ingest_observations([(self.first.pk, 'weight', 24.0, at(5))])
+        self.assertEqual(self.rollup('cage', self.cage.pk, 'day', dt.date(2024, 3, 4)).count, 1)
+        with self.assertNumQueries(1):
+            [monday, tuesday] = room_trend('Room 101', 'weight')
+        self.assertEqual((monday['period_start'], monday['count'], monday['mean'], monday['sd']), (dt.date(2024, 3, 4), 2, 25.0, 5.0))
+        self.assertEqual((tuesday['count'], tuesday['min'], tuesday['max']), (1, 24.0, 24.0))
+        [week] = health_trend('weight', 'mouse', [self.first.pk], 'week', start=dt.date(2024, 3, 6))
+        self.assertEqual((week['count'], week['mean']), (2, 22.0))
+
+    def test_reconcile_rebuilds_rollups(self):
+        ingest_observations([(self.first.pk, 'weight', 20.0, at(4)), (self.second.pk, 'weight', 30.0, at(5))])
+        expected = sorted(HealthRollup.objects.values_list('scope', 'scope_id', 'period', 'period_start', 'count', 'total'))
+        HealthRollup.objects.all().delete()
+        HealthRollup.objects.create(scope='mouse', scope_id=self.first.pk, metric='weight', period='day', period_start=dt.date(2024, 3, 6), count=9, total=1, minimum=1, maximum=1)
+        reconcile_health_rollups(dt.date(2024, 3, 1), dt.date(2024, 3, 10))
+        self.assertEqual(sorted(HealthRollup.objects.values_list('scope', 'scope_id', 'period', 'period_start', 'count', 'total')), expected)
+
+    def test_csv_import_and_device_upload(self):
+        csv = 'strain,tube_id,metric,value,observed_at,device\nC57BL/6,1,weight,21.5,2024-03-04 09:00,balance-1\nC57BL/6,9,weight,20,2024-03-04,\nC57BL/6,2,bcs,3,2024-03-04,\n'
+        report = import_colony('health', StringIO(csv))
+        self.assertEqual(report.created, 1)
+        self.assertEqual([line for line, _ in report.errors], [3, 4])
+        self.assertEqual(HealthObservation.objects.get().device, 'balance-1')
+
+        url = reverse('health_observations')
+        payload = '{"device": "scale", "readings": [{"mouse_id": %d, "metric": "body_condition", "value": 3, "observed_at": "2024-03-05T10:00"}]}' % self.second.pk
+        self.assertEqual(self.client.post(url, payload, content_type='application/json').status_code, 403)
+        with override_settings(HEALTH_DEVICE_TOKEN='secret'):
+            response = self.client.post(url, payload, content_type='application/json', headers={'Authorization': 'Bearer secret'})
+            self.assertEqual(response.json(), {'received': 1, 'created': 1})
+            response = self.client.post(url, '{"readings": [{"mouse_id": 1}]}', content_type='application/json', headers={'Authorization': 'Bearer secret'})
+            self.assertEqual(response.status_code, 400)
+
+    def test_trend_view_is_scoped_to_the_users_teams(self):
+        lab = Team.objects.create(name='Lab A')
+        self.other_cage.team = Team.objects.create(name='Lab B')
+        self.other_cage.save()
+        ingest_observations([(self.first.pk, 'weight', 20.0, at(4)), (self.second.pk, 'weight', 30.0, at(4))])
+        user = User.objects.create_user(username='tech', email='tech@abdn.ac.uk', password='password')
+        TeamMembership.objects.create(user=user, team=lab)
+        self.client.login(username='tech', password='password')
+        [point] = self.client.get(reverse('health_trend'), {'metric': 'weight', 'room': 'Room 101'}).json()['points']
+        self.assertEqual((point['count'], point['mean']), (1, 20.0))
+        self.assertEqual(self.client.get(reverse('health_trend'), {'metric': 'weight', 'strain': self.strain.pk}).json()['points'][0]['count'], 2)
+        self.assertEqual(self.client.get(reverse('health_trend'), {'metric': 'weight'}).status_code, 400)
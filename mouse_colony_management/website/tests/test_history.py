@@ -0,0 +1,88 @@
+from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+from django.utils import timezone
+from website.models import *
+from website.cages import move_mice
+from website.history import colony_as_of, take_snapshot
+import datetime as dt
+
+class ColonyHistoryTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.cage = Cage.objects.create(cage_number='C001', cage_type='Breeding', location='Room 101')
+        self.stock = Cage.objects.create(cage_number='C002', cage_type='Stock', location='Room 101')
+        self.male = Mouse.objects.create(strain=self.strain, tube_id=1, dob=dt.date(2023, 1, 1), sex='M', state='alive', cage=self.stock)
+        self.female = Mouse.objects.create(strain=self.strain, tube_id=2, dob=dt.date(2023, 1, 1), sex='F', state='alive', cage=self.stock)
+        self.user = User.objects.create_user(username='leader', email='leader@abdn.ac.uk', password='password', role='leader')
+        self.baseline = take_snapshot()
+
+    def states(self, when):
+        return {row['mouse_id']: (row['state'], row['cage_id']) for row in colony_as_of(when).mice()}
+
+    def test_changes_are_appended_and_replayed(self):
+        before = timezone.now()
+        request = Request.objects.create(requester=self.user, mouse=self.male, second_mouse=self.female, cage=self.cage, request_type='breed')
+        request.complete()
+        breeding = timezone.now()
+        Breed.objects.get().end_breeding()
+        pup = Mouse.objects.create(strain=self.strain, tube_id=3, dob=dt.date(2024, 1, 1), sex='F', state='alive', father=self.male, mother=self.female)
+        pup_id = pup.pk
+        pup.delete()
+
+        self.assertEqual(self.states(before), {self.male.pk: ('alive', self.stock.pk), self.female.pk: ('alive', self.stock.pk)})
+        self.assertEqual(self.states(breeding), {self.male.pk: ('breeding', self.cage.pk), self.female.pk: ('breeding', self.cage.pk)})
+        now = colony_as_of(timezone.now())
+        self.assertEqual(now.counts(), {(self.strain.pk, 'alive'): 2})
+        self.assertEqual(now.cage_occupancy(), {self.cage.pk: 2})
+        self.assertEqual(MouseEvent.objects.filter(mouse_id=pup_id).count(), 2)
+        with self.assertRaises(ValueError):
+            colony_as_of(self.baseline.taken_at - dt.timedelta(seconds=1))
+
+    def test_bulk_moves_are_recorded(self):
+        move_mice([self.male, self.female], self.cage)
+        self.assertEqual(colony_as_of(timezone.now()).cage_occupancy(), {self.cage.pk: 2})
+        self.assertEqual(MouseEvent.objects.filter(changed=MouseEvent.CAGE).count(), 2)
+
+    def test_completion_logs_each_mouse_once(self):
+        request = Request.objects.create(requester=self.user, mouse=self.male, second_mouse=self.female, cage=self.cage, request_type='breed')
+        request.complete()
+        events = MouseEvent.objects.filter(changed=MouseEvent.STATE | MouseEvent.CAGE)
+        self.assertEqual(sorted(events.values_list('mouse_id', 'cage_id')), [(self.male.pk, self.cage.pk), (self.female.pk, self.cage.pk)])
+        self.assertEqual(MouseEvent.objects.count(), 4)
+
+    def test_deleting_a_cage_or_keeper_is_recorded(self):
+        self.female.mouse_keeper = self.user
+        self.female.save()
+        self.stock.delete()
+        self.assertEqual(self.states(timezone.now()), {self.male.pk: ('alive', None), self.female.pk: ('alive', None)})
+        self.user.delete()
+        latest = MouseEvent.objects.filter(mouse=self.female).latest('pk')
+        self.assertEqual((latest.changed, latest.keeper_id), (MouseEvent.KEEPER, None))
+
+    def test_replay_starts_from_the_nearest_snapshot(self):
+        self.male.state = 'to_be_culled'
+        self.male.save()
+        later = take_snapshot(timezone.now())
+        self.assertEqual(later.mice, 2)
+        # One query for the snapshot, one for the (empty) event range; the data is cached
+        colony_as_of(timezone.now())
+        with self.assertNumQueries(2):
+            state = colony_as_of(timezone.now())
+        self.assertEqual(state.counts(), {(self.strain.pk, 'alive'): 1, (self.strain.pk, 'to_be_culled'): 1})
+
+    def test_events_are_append_only(self):
+        event = MouseEvent.objects.filter(mouse=self.male).first()
+        with self.assertRaises(ValidationError):
+            event.save()
+        with self.assertRaises(ValidationError):
+            event.delete()
+
+    def test_as_of_view(self):
+        self.client.login(username='leader', password='password')
+        data = self.client.get(reverse('colony_history'), {'date': timezone.localdate().isoformat(), 'mice': 1}).json()
+        self.assertEqual(data['mice'], 2)
+        self.assertEqual(data['counts'], [{'strain': 'C57BL/6', 'state': 'alive', 'mice': 2}])
+        self.assertEqual(len(data['rows']), 2)
+        self.assertEqual(self.client.get(reverse('colony_history'), {'date': '2000-01-01'}).status_code, 400)
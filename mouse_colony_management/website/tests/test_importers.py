@@ -0,0 +1,126 @@
+from unittest.mock import patch
+from django.db import DatabaseError
+from django.test import TestCase
+from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from website.models import *
+from website import importers
+from website.importers import import_colony
+from website.teams import TeamScope
+from io import StringIO
+import datetime as dt
+import tempfile
+
+MICE_CSV = """Strain,Tube ID,DOB,Sex,Father Tube ID,Mother Tube ID,State
+C57BL/6,3,2023-06-01,M,1,2,alive
+C57BL/6,1,2023-01-01,M,,,breeding
+C57BL/6,2,01/01/2023,F,,,breeding
+C57BL/6,4,2023-06-01,F,1,2,
+C57BL/6,4,2023-06-01,F,1,2,
+C57BL/6,5,not-a-date,F,,,
+C57BL/6,6,2023-06-01,F,2,1,
+C57BL/6,7,2023-06-01,F,99,,
+"""
+
+class ColonyImportTest(TestCase):
+
+    def test_import_mice_resolves_parents_across_chunks(self):
+        report = import_colony('mice', StringIO(MICE_CSV), chunk_size=2)
+        self.assertEqual(report.created, 6)
+        self.assertEqual([line for line, _ in report.errors], [6, 7, 8, 8, 9])
+
+        strain = Strain.objects.get(name='C57BL/6')
+        father = Mouse.objects.get(strain=strain, tube_id=1)
+        mother = Mouse.objects.get(strain=strain, tube_id=2)
+        pup = Mouse.objects.get(strain=strain, tube_id=3)
+        self.assertEqual((pup.father, pup.mother), (father, mother))
+        self.assertEqual(mother.dob, dt.date(2023, 1, 1))
+        self.assertEqual(Mouse.objects.get(strain=strain, tube_id=4).state, 'alive')
+        # Wrong-sex parents are dropped rather than linked
+        swapped = Mouse.objects.get(strain=strain, tube_id=6)
+        self.assertIsNone(swapped.father)
+        self.assertIsNone(swapped.mother)
+        # Bulk-created mice still get lineage rows
+        self.assertTrue(pup.is_descendant_of(father))
+
+    def test_chunks_committed_before_a_failure_keep_their_derived_data(self):
+        link_parents = importers._link_parents
+        def fail_second_chunk(links, index, report):
+            if report.created:
+                raise DatabaseError("Lost connection")
+            return link_parents(links, index, report)
+        with patch.object(importers, '_link_parents', fail_second_chunk), self.assertRaises(DatabaseError):
+            import_colony('mice', StringIO(MICE_CSV), chunk_size=2)
+        self.assertEqual(Mouse.objects.count(), 2)
+        self.assertEqual(sum(MouseCountRollup.objects.values_list('count', flat=True)), 2)
+        self.assertEqual(MouseEvent.objects.count(), 2)
+
+    def test_pups_without_a_team_take_their_parents_team(self):
+        lab = Team.objects.create(name='Lab A')
+        Team.objects.create(name='Lab B')
+        mice = "strain,tube_id,dob,sex,father_tube_id,mother_tube_id,team\nC57BL/6,3,2023-06-01,M,1,2,\nC57BL/6,4,2023-06-01,F,1,2,Lab B\nC57BL/6,1,2023-01-01,M,,,\nC57BL/6,2,2023-01-01,F,,,Lab A\nC57BL/6,5,2024-01-01,F,3,4,\n"
+        self.assertEqual(import_colony('mice', StringIO(mice), chunk_size=2).created, 5)
+        teams = dict(Mouse.objects.values_list('tube_id', 'team__name'))
+        self.assertEqual(teams, {1: None, 2: 'Lab A', 3: 'Lab A', 4: 'Lab B', 5: 'Lab B'})
+        self.assertEqual(Mouse.objects.visible_to(TeamScope([lab.pk])).count(), 3)
+
+    def test_import_genotypes_and_phenotypes_tsv(self):
+        import_colony('mice', StringIO(MICE_CSV))
+        genotypes = "strain\ttube_id\tgene\tallele_1\tallele_2\nC57BL/6\t1\tp53\tA\tB\nC57BL/6\t42\tp53\tA\tA\n"
+        report = import_colony('genotypes', StringIO(genotypes))
+        self.assertEqual(report.created, 1)
+        self.assertEqual(report.errors, [(3, "No mouse with tube 42 in strain C57BL/6.")])
+        self.assertEqual(Genotype.objects.get().allele_2, 'B')
+
+        phenotypes = "strain,tube_id,characteristic,description\nC57BL/6,2,Coat Color,Black\n"
+        self.assertEqual(import_colony('phenotypes', StringIO(phenotypes)).created, 1)
+
+    def test_overlong_values_are_rejected_without_creating_strains(self):
+        mice = "strain,tube_id,dob,sex\nC57BL/6-A-very-long-name,1,2023-01-01,M\nBALB/c,1,not-a-date,M\nC57BL/6,1,2023-01-01,M\n"
+        report = import_colony('mice', StringIO(mice))
+        self.assertEqual([line for line, _ in report.errors], [2, 3])
+        self.assertEqual(list(Strain.objects.values_list('name', flat=True)), ['C57BL/6'])
+        genotypes = "strain,tube_id,gene,allele_1,allele_2\nC57BL/6,1,%s,A,A\nDBA/2,1,p53,A,A\n" % ('x' * 51)
+        report = import_colony('genotypes', StringIO(genotypes))
+        self.assertEqual(report.errors[1], (3, "Unknown strain 'DBA/2'."))
+        self.assertFalse(Genotype.objects.exists())
+        self.assertEqual(Strain.objects.count(), 1)
+
+    def test_unreadable_lines_are_reported_and_skipped(self):
+        data = "strain,tube_id,dob,sex\nC57BL/6,1,2023-01-01,M\n".encode() + b"C57BL/6,2,2023-01-01,\xff\n" + ("C57BL/6,3,%s,F\n" % ('x' * 140000)).encode() + b"C57BL/6,4,2023-01-01,F\n"
+        self.leader = User.objects.create_user(username='leader', password='password', role='leader')
+        self.client.login(username='leader', password='password')
+        response = self.client.post(reverse('import_colony'), {'kind': 'mice', 'file': SimpleUploadedFile('mice.csv', data)})
+        report = response.context['report']
+        self.assertEqual(report.created, 2)
+        self.assertEqual([line for line, _ in report.errors], [3, 4])
+
+    def test_import_colony_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as handle:
+            handle.write(MICE_CSV)
+            handle.flush()
+            out, err = StringIO(), StringIO()
+            call_command('import_colony', 'mice', handle.name, stdout=out, stderr=err)
+        self.assertIn('6 created, 5 errors', out.getvalue())
+        self.assertIn('Line 8:', err.getvalue())
+
+
+class ImportViewTest(TestCase):
+
+    def setUp(self):
+        self.leader = User.objects.create_user(username='leader', password='password', role='leader')
+        self.staff = User.objects.create_user(username='staff', password='password', role='staff')
+
+    def test_upload_by_leader(self):
+        self.client.login(username='leader', password='password')
+        upload = SimpleUploadedFile('mice.csv', MICE_CSV.encode('utf-8'))
+        response = self.client.post(reverse('import_colony'), {'kind': 'mice', 'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['report'].created, 6)
+        self.assertEqual(Mouse.objects.count(), 6)
+
+    def test_upload_requires_leader(self):
+        self.client.login(username='staff', password='password')
+        response = self.client.get(reverse('import_colony'))
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,74 @@
+from unittest.mock import patch
+from django.test import TestCase
+from website.models import *
+from website import kinship
+import datetime as dt
+
+class KinshipTest(TestCase):
+
+    def setUp(self):
+        kinship._pedigrees.clear()
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.user = User.objects.create_user(username='requester', email='requester@abdn.ac.uk', password='pass123')
+        self.cage = Cage.objects.create(cage_number='C001', cage_type='Breeding', location='Room 101')
+        self.father = self.make(1, 'M')
+        self.mother = self.make(2, 'F')
+        self.other_mother = self.make(3, 'F')
+        self.brother = self.make(4, 'M', father=self.father, mother=self.mother)
+        self.sister = self.make(5, 'F', father=self.father, mother=self.mother)
+        self.half_sister = self.make(6, 'F', father=self.father, mother=self.other_mother)
+        self.inbred = self.make(7, 'F', father=self.brother, mother=self.sister)
+
+    def make(self, tube_id, sex, **parents):
+        return Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob=dt.date(2023, 1, 1), sex=sex, state='alive', **parents)
+
+    def test_known_coefficients(self):
+        self.assertAlmostEqual(kinship.kinship(self.brother, self.sister), 0.25)
+        self.assertAlmostEqual(kinship.kinship(self.brother, self.half_sister), 0.125)
+        self.assertAlmostEqual(kinship.kinship(self.father, self.brother), 0.25)
+        self.assertAlmostEqual(kinship.kinship(self.father, self.mother), 0.0)
+        self.assertAlmostEqual(self.inbred.get_inbreeding_coefficient(), 0.25)
+        self.assertAlmostEqual(self.brother.get_inbreeding_coefficient(), 0.0)
+        # Self-kinship of an inbred mouse is (1 + F) / 2
+        self.assertAlmostEqual(kinship.kinship(self.inbred, self.inbred), 0.625)
+
+    def test_batch_matches_single_pairs(self):
+        pairs = [(self.brother, self.sister), (self.brother, self.half_sister), (self.inbred, self.father)]
+        batch = kinship.kinship_many(pairs)
+        kinship._pedigrees.clear()
+        self.assertEqual(batch, [kinship.kinship(a, b) for a, b in pairs])
+
+    def test_large_pedigrees_recurse_instead_of_building_a_matrix(self):
+        pairs = [(self.brother, self.sister), (self.inbred, self.half_sister), (self.inbred, self.inbred), (self.inbred, self.father)]
+        dense = kinship.kinship_many(pairs)
+        kinship._pedigrees.clear()
+        with patch.object(kinship, 'MAX_BATCH_ANCESTORS', 0), patch.object(kinship.StrainPedigree, 'relationship_matrix') as matrix:
+            for expected, (first, second) in zip(dense, pairs):
+                self.assertAlmostEqual(kinship.kinship(first, second), expected)
+            matrix.assert_not_called()
+            # A pair needing more work than allowed is deferred, and finished on a later call
+            kinship._pedigrees.clear()
+            pedigree = kinship.strain_pedigree(self.strain.pk)
+            self.assertIsNone(pedigree.coancestry(pedigree.index[self.inbred.pk], pedigree.index[self.half_sister.pk], budget=1))
+            self.assertAlmostEqual(pedigree.kinships([(self.inbred.pk, self.half_sister.pk)])[0], dense[1])
+
+    def test_pedigree_is_cached_per_strain(self):
+        kinship.kinship(self.brother, self.sister)
+        # Only the snapshot version check hits the database
+        with self.assertNumQueries(1):
+            kinship.kinship(self.brother, self.half_sister)
+        # Re-parenting a mouse drops the cached pedigree for its strain
+        self.half_sister.mother = self.mother
+        self.half_sister.save()
+        self.assertAlmostEqual(kinship.kinship(self.brother, self.half_sister), 0.25)
+
+    def test_breeding_request_records_litter_inbreeding(self):
+        request = Request.objects.create(requester=self.user, mouse=self.brother, second_mouse=self.sister, cage=self.cage, request_type='breed')
+        self.assertAlmostEqual(request.inbreeding_coefficient, 0.25)
+        # Changing the pair of a pending request works it out again
+        request = Request.objects.get(pk=request.pk)
+        request.second_mouse = self.half_sister
+        request.save()
+        self.assertAlmostEqual(Request.objects.get(pk=request.pk).inbreeding_coefficient, 0.125)
+        cull = Request.objects.create(requester=self.user, mouse=self.brother, request_type='cull')
+        self.assertIsNone(cull.inbreeding_coefficient)
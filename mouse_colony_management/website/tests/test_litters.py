@@ -0,0 +1,99 @@
+from django.test import TestCase
+from django.urls import reverse
+from django.core.exceptions import ValidationError
+from website.models import *
+from website.litters import reconcile_litter_stats
+from website.signals import mice_bulk_changed
+import datetime as dt
+
+class LitterTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.user = User.objects.create_user(username='leader', email='leader@abdn.ac.uk', password='password', role='leader')
+        self.cage = Cage.objects.create(cage_number='C001', cage_type='Breeding', location='Room 101')
+        self.male = self.make(1, 'M', dt.date(2022, 6, 1))
+        self.female = self.make(2, 'F', dt.date(2022, 6, 1))
+        self.breed = Breed.objects.create(male=self.male, female=self.female, cage=self.cage)
+        Breed.objects.filter(pk=self.breed.pk).update(start_date=dt.datetime(2022, 12, 1, tzinfo=dt.timezone.utc))
+
+    def make(self, tube_id, sex, dob, **parents):
+        return Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob=dob, sex=sex, state='alive', **parents)
+
+    def pups(self, count, dob, first_tube=10):
+        for n in range(count):
+            self.make(first_tube + n, 'MF'[n % 2], dob, father=self.male, mother=self.female)
+
+    def pair(self):
+        return PairLitterStats.objects.get(father=self.male, mother=self.female)
+
+    def test_pups_record_their_litter(self):
+        self.pups(3, dt.date(2023, 1, 1))
+        litter = Litter.objects.get()
+        self.assertEqual((litter.born, litter.breed, litter.strain, litter.birth_date), (3, self.breed, self.strain, dt.date(2023, 1, 1)))
+        self.assertEqual(litter.pups().count(), 3)
+        # Staff may record more pups born than were kept
+        litter.born = 5
+        litter.save()
+        self.pups(1, dt.date(2023, 1, 1), first_tube=20)
+        self.assertEqual(Litter.objects.get().born, 5)
+
+    def test_stats_follow_litters(self):
+        self.pups(4, dt.date(2023, 1, 1))
+        self.pups(2, dt.date(2023, 2, 10), first_tube=20)
+        pair = self.pair()
+        self.assertEqual((pair.litters, pair.born, pair.pups_per_litter, pair.interval_days), (2, 6, 3, 40))
+        self.assertIsNone(pair.wean_survival)
+
+        litter = Litter.objects.get(birth_date=dt.date(2023, 1, 1))
+        litter.born, litter.weaned, litter.wean_date = 5, 4, dt.date(2023, 1, 22)
+        litter.save()
+        pair = self.pair()
+        self.assertEqual((pair.born, pair.weaned_litters, pair.wean_survival), (7, 1, 0.8))
+        strain = StrainLitterStats.objects.get(strain=self.strain)
+        self.assertEqual((strain.litters, strain.born, strain.weaned, strain.born_in_weaned, strain.interval_days), (2, 7, 4, 5, 40))
+
+        litter.delete()
+        strain.refresh_from_db()
+        self.assertEqual((strain.litters, strain.born, strain.weaned, strain.intervals), (1, 2, 0, 0))
+        Litter.objects.get().delete()
+        self.assertFalse(PairLitterStats.objects.exists())
+
+    def test_reconcile_matches_incremental(self):
+        self.pups(4, dt.date(2023, 1, 1))
+        self.pups(3, dt.date(2023, 3, 1), first_tube=20)
+        Litter.objects.filter(birth_date=dt.date(2023, 1, 1)).update(weaned=3)
+        Litter.objects.get(birth_date=dt.date(2023, 3, 1)).save()
+        reconcile_litter_stats()
+        rebuilt = list(StrainLitterStats.objects.values())
+        StrainLitterStats.objects.all().delete()
+        PairLitterStats.objects.all().delete()
+        reconcile_litter_stats([(self.male.pk, self.female.pk)])
+        self.assertEqual(list(StrainLitterStats.objects.values()), rebuilt)
+        self.assertEqual(rebuilt[0]['weaned'], 3)
+
+    def test_bulk_created_pups(self):
+        pups = Mouse.objects.bulk_create([
+            Mouse(strain=self.strain, tube_id=30 + n, dob=dt.date(2023, 5, 1), sex='F', state='alive', father=self.male, mother=self.female)
+            for n in range(6)
+        ])
+        mice_bulk_changed.send(sender=Mouse, mouse_ids=[pup.pk for pup in pups], strain_ids={self.strain.pk})
+        self.assertEqual(Litter.objects.get().born, 6)
+        self.assertEqual(Litter.objects.get().breed, self.breed)
+        self.assertEqual(self.pair().litters, 1)
+
+    def test_validation(self):
+        litter = Litter(father=self.male, mother=self.female, birth_date=dt.date(2023, 1, 1), born=3, weaned=4)
+        with self.assertRaises(ValidationError):
+            litter.clean()
+        litter.weaned, litter.wean_date = 3, dt.date(2022, 12, 1)
+        with self.assertRaises(ValidationError):
+            litter.clean()
+
+    def test_dashboard_reads_stats(self):
+        self.pups(4, dt.date(2023, 1, 1))
+        self.client.login(username='leader', password='password')
+        response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, 'Breeding performance')
+        self.assertEqual(list(response.context['breeding_performance']), [StrainLitterStats.objects.get()])
+        self.assertEqual(response.context['active_breeds'][0].performance.pups_per_litter, 4)
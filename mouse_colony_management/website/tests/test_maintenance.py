@@ -0,0 +1,134 @@
+from unittest.mock import patch
+from django.test import TestCase
+from django.core.management import call_command
+from django.utils import timezone
+from website.models import *
+from website import maintenance
+from website.maintenance import LEASE, claim_job, end_stale_breeds, ensure_jobs, expire_approved, flag_cull_age, keyset_chunks, run_job, wean_litters
+from io import StringIO
+import datetime as dt
+
+class MaintenanceSweepTest(TestCase):
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.strain = Strain.objects.create(name='C57BL/6', cull_age_days=365)
+        self.user = User.objects.create_user(username='leader', password='password', role='leader')
+        self.cage = Cage.objects.create(cage_number='C001', cage_type='Breeding', location='Room 101')
+        self.male = self.make(1, 'M', 200)
+        self.female = self.make(2, 'F', 200)
+
+    def make(self, tube_id, sex, age, state='alive', **parents):
+        dob = self.today - dt.timedelta(days=age)
+        return Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob=dob, sex=sex, state=state, **parents)
+
+    def test_keyset_chunks(self):
+        for tube_id in range(3, 8):
+            self.make(tube_id, 'M', 50)
+        chunks = list(keyset_chunks(Mouse.objects.filter(sex='M'), size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 2])
+        self.assertEqual(sum(chunks, []), sorted(Mouse.objects.filter(sex='M').values_list('pk', flat=True)))
+
+    def test_wean_litters(self):
+        for tube_id, state in [(3, 'alive'), (4, 'alive'), (5, 'deceased')]:
+            self.make(tube_id, 'F', 30, state, father=self.male, mother=self.female)
+        self.make(6, 'F', 10, father=self.male, mother=self.female)
+        self.assertEqual(wean_litters(), 1)
+        weaned, young = Litter.objects.order_by('birth_date')
+        self.assertEqual((weaned.weaned, weaned.wean_date, weaned.born), (2, self.today, 3))
+        self.assertIsNone(young.weaned)
+        stats = PairLitterStats.objects.get()
+        self.assertEqual((stats.weaned_litters, stats.weaned, stats.born_in_weaned), (1, 2, 3))
+        self.assertEqual(wean_litters(), 0)
+
+    def test_litters_without_recorded_pups_are_weaned_without_a_count(self):
+        other_male = self.make(3, 'M', 200)
+        counted = Litter.objects.create(father=other_male, mother=self.female, birth_date=self.today - dt.timedelta(days=40), born=8)
+        self.assertEqual(wean_litters(), 1)
+        counted.refresh_from_db()
+        self.assertEqual((counted.wean_date, counted.weaned), (self.today, None))
+        self.assertEqual(PairLitterStats.objects.get(father=other_male).weaned_litters, 0)
+        self.assertEqual(wean_litters(), 0)
+
+    def test_flag_cull_age(self):
+        old = self.make(3, 'M', 400)
+        breeding = self.make(4, 'F', 400, 'breeding')
+        self.assertEqual(flag_cull_age(), 1)
+        old.refresh_from_db()
+        breeding.refresh_from_db()
+        self.assertEqual((old.state, breeding.state), ('to_be_culled', 'breeding'))
+        self.assertEqual(MouseCountRollup.objects.get(state='to_be_culled').count, 1)
+
+    def test_end_stale_breeds(self):
+        stale = Breed.objects.create(male=self.male, female=self.female, cage=self.cage)
+        Breed.objects.filter(pk=stale.pk).update(start_date=timezone.now() - dt.timedelta(days=300))
+        Mouse.objects.filter(pk__in=[self.male.pk, self.female.pk]).update(state='breeding')
+        young_male, young_female = self.make(3, 'M', 100, 'breeding'), self.make(4, 'F', 100, 'breeding')
+        Breed.objects.create(male=young_male, female=young_female, cage=Cage.objects.create(cage_number='C002', cage_type='Breeding', location='Room 101'))
+
+        self.assertEqual(end_stale_breeds(), 1)
+        stale.refresh_from_db()
+        self.assertIsNotNone(stale.end_date)
+        self.assertEqual(set(Mouse.objects.filter(state='breeding').values_list('pk', flat=True)), {young_male.pk, young_female.pk})
+        self.assertFalse(CageRollup.objects.filter(cage=self.cage, active_breeds__gt=0).exists())
+
+    def test_expire_approved(self):
+        stuck = Request.objects.create(requester=self.user, mouse=self.male, request_type='cull', status='approved', comments='Old')
+        fresh = Request.objects.create(requester=self.user, mouse=self.female, request_type='cull', status='approved')
+        Request.objects.filter(pk=stuck.pk).update(updated_at=timezone.now() - dt.timedelta(days=20))
+        self.assertEqual(expire_approved(), 1)
+        stuck.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((stuck.status, fresh.status), ('rejected', 'approved'))
+        self.assertTrue(stuck.comments.startswith('Old\nExpired'))
+
+
+class MaintenanceJobTest(TestCase):
+
+    def setUp(self):
+        ensure_jobs()
+
+    def test_jobs_are_leased_to_one_worker(self):
+        self.assertEqual(MaintenanceJob.objects.count(), 6)
+        ensure_jobs()
+        self.assertEqual(MaintenanceJob.objects.count(), 6)
+        first = claim_job('worker-1')
+        second = claim_job('worker-2')
+        self.assertNotEqual(first.name, second.name)
+        self.assertIsNone(claim_job('worker-3', [first.name]))
+        # A lease that ran out may be taken over
+        later = timezone.now() + LEASE + dt.timedelta(seconds=1)
+        self.assertEqual(claim_job('worker-3', [first.name], now=later).locked_by, 'worker-3')
+
+    def test_run_job_reschedules(self):
+        job = claim_job('worker-1', ['expire_approved'])
+        self.assertEqual(run_job(job, 'worker-1'), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.locked_by, job.locked_until, job.last_result, job.failures), ('', None, '0 rows', 0))
+        self.assertGreater(job.next_run_at, timezone.now() + dt.timedelta(minutes=59))
+        self.assertIsNone(claim_job('worker-1', ['expire_approved']))
+
+    def test_a_lost_lease_stops_the_sweep(self):
+        job = claim_job('worker-1', ['expire_approved'])
+        chunks = []
+
+        def sweep(heartbeat):
+            for chunk in range(3):
+                chunks.append(chunk)
+                if chunk == 1:
+                    # The lease ran out and another worker claimed the job
+                    MaintenanceJob.objects.filter(pk=job.pk).update(locked_by='worker-2')
+                heartbeat()
+            return 3
+
+        with patch.dict(maintenance.SWEEPS, {'expire_approved': (sweep, job.interval)}), self.assertLogs('website.maintenance', 'WARNING'):
+            self.assertEqual(run_job(job, 'worker-1'), 0)
+        self.assertEqual(chunks, [0, 1])
+        job.refresh_from_db()
+        self.assertEqual((job.locked_by, job.last_finished_at), ('worker-2', None))
+
+    def test_command_runs_due_jobs(self):
+        out = StringIO()
+        call_command('run_maintenance', '--once', '--force', stdout=out)
+        self.assertEqual(sorted(line.split(':')[0] for line in out.getvalue().splitlines()), ['end_stale_breeds', 'expire_approved', 'flag_cull_age', 'snapshot_colony', 'stamp_replication', 'wean_litters'])
+        self.assertFalse(MaintenanceJob.objects.filter(last_finished_at__isnull=True).exists())
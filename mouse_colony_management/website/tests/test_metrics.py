@@ -0,0 +1,61 @@
+from django.test import TestCase, override_settings
+from django.db import connection
+from django.urls import reverse
+from website.models import *
+from website.metrics import QueryRecorder, store
+import datetime as dt
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        store.reset()
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.mouse = Mouse.objects.create(strain=self.strain, tube_id=1, dob=dt.date(2023, 1, 1), sex='M', state='alive')
+        self.staff = User.objects.create_user(username='staff', email='staff@abdn.ac.uk', password='password', is_staff=True)
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get(reverse('genetic_tree', args=[self.mouse.mouse_id]))
+        self.client.get(reverse('genetic_tree', args=[self.mouse.mouse_id]))
+        stats = store.stats()['genetic_tree']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(sum(stats['buckets'][-1:]), 2)
+        self.assertGreater(stats['queries'], 0)
+        self.assertTrue(stats['slowest_sql'])
+
+    def test_duplicate_queries_are_flagged(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for mouse_id in range(6):
+                list(Mouse.objects.filter(pk=mouse_id))
+            list(Mouse.objects.filter(pk__in=[1, 2]))
+            list(Mouse.objects.filter(pk__in=[1, 2, 3]))
+        self.assertEqual(recorder.count, 8)
+        [(sql, count)] = recorder.duplicates()
+        self.assertEqual(count, 6)
+        self.assertIn('website_mouse', sql)
+        # IN lists of different lengths share a shape
+        self.assertEqual(len(recorder.shapes), 2)
+
+    def test_prometheus_output(self):
+        self.client.get(reverse('genetic_tree', args=[self.mouse.mouse_id]))
+        self.client.login(username='staff', password='password')
+        response = self.client.get(reverse('ops_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('colony_request_duration_seconds_bucket{view="genetic_tree",le="+Inf"} 1', body)
+        self.assertIn('colony_request_duration_seconds_count{view="genetic_tree"} 1', body)
+        self.assertIn('colony_db_queries_total{view="genetic_tree"}', body)
+        # The metrics endpoint does not measure itself
+        self.assertNotIn('ops_metrics', body)
+
+        recent = self.client.get(reverse('ops_metrics_recent')).json()['requests']
+        self.assertEqual([sample['view'] for sample in recent], ['genetic_tree'])
+
+    def test_access(self):
+        self.assertEqual(self.client.get(reverse('ops_metrics')).status_code, 403)
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get(reverse('ops_metrics'), HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse('ops_metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+            self.assertEqual(response.status_code, 403)
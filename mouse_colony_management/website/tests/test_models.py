@@ -1,6 +1,11 @@
 from django.test import TestCase
 from website.models import *
+from website.cages import move_mice, recount_cages
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from io import StringIO
 import datetime as dt
 
 class CageModelTest(TestCase):
@@ -61,6 +66,38 @@ class MouseModelTest(TestCase):
         self.assertIn(child, mother.get_descendants())
         self.assertIn(child, father.get_descendants())
 
+    def test_pedigree_dedupes_shared_ancestors(self):
+        # Sibling mating: the grandparents are reached through both parents
+        grandfather = Mouse.objects.create(strain=self.strain, tube_id=1, dob=dt.date(2019, 1, 1), sex='M', state='alive')
+        grandmother = Mouse.objects.create(strain=self.strain, tube_id=2, dob=dt.date(2019, 1, 1), sex='F', state='alive')
+        brother = Mouse.objects.create(strain=self.strain, tube_id=3, dob=dt.date(2020, 1, 1), sex='M', state='alive', father=grandfather, mother=grandmother)
+        sister = Mouse.objects.create(strain=self.strain, tube_id=4, dob=dt.date(2020, 1, 1), sex='F', state='alive', father=grandfather, mother=grandmother)
+        pup = Mouse.objects.create(strain=self.strain, tube_id=5, dob=dt.date(2021, 1, 1), sex='M', state='alive', father=brother, mother=sister)
+
+        ancestors = pup.get_ancestors()
+        self.assertEqual(len(ancestors), 4)
+        self.assertEqual({a.mouse_id: a.generation for a in ancestors}, {
+            brother.mouse_id: 1, sister.mouse_id: 1, grandfather.mouse_id: 2, grandmother.mouse_id: 2,
+        })
+        descendants = grandfather.get_descendants()
+        self.assertEqual(len(descendants), 3)
+        self.assertEqual([d.generation for d in descendants], [1, 1, 2])
+
+    def test_pedigree_max_depth_and_query_count(self):
+        mouse = Mouse.objects.create(strain=self.strain, tube_id=1, dob=dt.date(2010, 1, 1), sex='F', state='alive')
+        line = [mouse]
+        for tube_id in range(2, 12):
+            line.append(Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob=dt.date(2010, 1, 1), sex='F', state='alive', mother=line[-1]))
+
+        # Snapshot version check, snapshot load and one fetch of the mice found
+        with self.assertNumQueries(3):
+            self.assertEqual(len(line[-1].get_ancestors()), 10)
+        # The snapshot is now cached for this strain version
+        with self.assertNumQueries(2):
+            self.assertEqual(len(line[0].get_descendants()), 10)
+        self.assertEqual([a.generation for a in line[-1].get_ancestors(max_depth=3)], [1, 2, 3])
+        self.assertEqual(line[0].get_descendants(max_depth=2), line[1:3])
+
 class RequestModelTest(TestCase):
 
     def setUp(self):
@@ -166,4 +203,164 @@ class GenotypePhenotypeModelTest(TestCase):
             description='Black'
         )
         self.assertEqual(Phenotype.objects.count(), 1)
-        self.assertEqual(str(phenotype), f"{self.mouse.mouse_id} - Coat Color: Black")
\ No newline at end of file
+        self.assertEqual(str(phenotype), f"{self.mouse.mouse_id} - Coat Color: Black")
+
+class MouseLineageTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.founder_m = self.make(1, 'M')
+        self.founder_f = self.make(2, 'F')
+        self.brother = self.make(3, 'M', father=self.founder_m, mother=self.founder_f)
+        self.sister = self.make(4, 'F', father=self.founder_m, mother=self.founder_f)
+        self.pup = self.make(5, 'F', father=self.brother, mother=self.sister)
+
+    def make(self, tube_id, sex, **parents):
+        return Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob=dt.date(2023, 1, 1), sex=sex, state='alive', **parents)
+
+    def closure(self):
+        return set(MouseLineage.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def test_closure_maintained_on_save(self):
+        self.assertTrue(self.pup.is_descendant_of(self.founder_m))
+        self.assertFalse(self.founder_m.is_descendant_of(self.pup))
+        self.assertEqual(set(self.founder_f.all_descendants()), {self.brother, self.sister, self.pup})
+        self.assertEqual(set(self.brother.common_ancestors(self.sister)), {self.founder_m, self.founder_f})
+        self.assertEqual(MouseLineage.objects.get(ancestor=self.founder_m, descendant=self.pup).depth, 2)
+
+    def test_reparenting_updates_descendants(self):
+        outsider = self.make(6, 'M')
+        self.brother.father = outsider
+        self.brother.save()
+        self.assertTrue(self.pup.is_descendant_of(outsider))
+        # Still reachable through the sister
+        self.assertTrue(self.pup.is_descendant_of(self.founder_m))
+        self.assertFalse(self.brother.is_descendant_of(self.founder_m))
+
+    def test_state_change_does_not_touch_closure(self):
+        pup = Mouse.objects.get(pk=self.pup.pk)
+        pup.state = 'breeding'
+        with CaptureQueriesContext(connection) as queries:
+            pup.save()
+        self.assertFalse([query for query in queries.captured_queries if 'mouselineage' in query['sql']])
+
+    def test_delete_updates_descendants(self):
+        self.sister.delete()
+        self.assertTrue(self.pup.is_descendant_of(self.founder_m))
+        self.brother.delete()
+        self.assertFalse(self.pup.is_descendant_of(self.founder_m))
+        self.assertFalse(MouseLineage.objects.filter(descendant=self.pup).exists())
+
+    def test_rebuild_matches_incremental(self):
+        incremental = self.closure()
+        MouseLineage.objects.all().delete()
+        call_command('rebuild_lineage', stdout=StringIO())
+        self.assertEqual(self.closure(), incremental)
+        self.assertEqual(len(incremental), 8)
+
+
+class CageOccupancyTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.user = User.objects.create_user(username='keeper', email='keeper@abdn.ac.uk', password='pass123')
+        CageType.objects.create(name='Breeding', capacity=3)
+        self.cage = Cage.objects.create(cage_number='B001', cage_type='Breeding', location='Room 101')
+        self.other = Cage.objects.create(cage_number='S001', cage_type='Stock', location='Room 101')
+        self.male = Mouse.objects.create(strain=self.strain, tube_id=1, dob=dt.date(2023, 1, 1), sex='M', state='alive')
+        self.female = Mouse.objects.create(strain=self.strain, tube_id=2, dob=dt.date(2023, 1, 1), sex='F', state='alive')
+
+    def test_capacity_comes_from_cage_type(self):
+        self.assertEqual(self.cage.capacity, 3)
+        self.assertEqual(self.other.capacity, CageType.DEFAULT_CAPACITY)
+        cage_type = CageType.objects.get(name='Breeding')
+        cage_type.capacity = 4
+        cage_type.save()
+        self.cage.refresh_from_db()
+        self.assertEqual(self.cage.capacity, 4)
+
+    def test_save_and_transfer_update_occupancy(self):
+        self.male.cage = self.cage
+        self.male.save()
+        self.cage.refresh_from_db()
+        self.assertEqual(self.cage.occupancy, 1)
+
+        self.male.cage = self.other
+        self.male.save()
+        self.cage.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.cage.occupancy, self.other.occupancy), (0, 1))
+        history = list(CageAssignment.objects.filter(mouse=self.male).order_by('pk').values_list('cage_id', 'removed_at'))
+        self.assertEqual(history[0][0], self.cage.pk)
+        self.assertIsNotNone(history[0][1])
+        self.assertEqual(history[1], (self.other.pk, None))
+
+        self.male.delete()
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.occupancy, 0)
+
+    def test_move_mice_rejects_full_cage(self):
+        extra = [Mouse.objects.create(strain=self.strain, tube_id=n, dob=dt.date(2023, 1, 1), sex='F', state='alive') for n in (3, 4)]
+        self.assertEqual(move_mice([self.male, self.female], self.cage), 2)
+        with self.assertRaises(ValidationError):
+            move_mice(extra, self.cage)
+        self.cage.refresh_from_db()
+        self.assertEqual(self.cage.occupancy, 2)
+        self.assertEqual(Mouse.objects.filter(cage=self.cage).count(), 2)
+        # The moved instances remember their new cage, so a later save is not a move
+        self.male.save()
+        self.cage.refresh_from_db()
+        self.assertEqual(self.cage.occupancy, 2)
+
+    def test_find_empty_cage(self):
+        self.assertEqual(Cage.objects.find_empty('Room 101', 'Breeding'), self.cage)
+        move_mice([self.male], self.cage)
+        self.assertIsNone(Cage.objects.find_empty('Room 101', 'Breeding'))
+        self.assertEqual(Cage.objects.find_empty('Room 101'), self.other)
+        self.assertEqual(list(Cage.objects.with_space(2)), [self.cage, self.other])
+
+    def test_breeding_request_checks_cage(self):
+        request = Request(requester=self.user, mouse=self.male, second_mouse=self.female, cage=self.cage, request_type='breed')
+        request.full_clean()
+        extra = [Mouse.objects.create(strain=self.strain, tube_id=n, dob=dt.date(2023, 1, 1), sex='F', state='alive') for n in (3, 4)]
+        move_mice(extra, self.cage)
+        self.cage.refresh_from_db()
+        with self.assertRaisesMessage(ValidationError, 'is full'):
+            request.full_clean()
+
+        move_mice(extra, None)
+        Breed.objects.create(male=self.male, female=self.female, cage=self.cage)
+        self.cage.refresh_from_db()
+        with self.assertRaisesMessage(ValidationError, 'active breeding pair'):
+            request.full_clean()
+
+    def test_completed_requests_move_mice(self):
+        request = Request.objects.create(requester=self.user, mouse=self.male, second_mouse=self.female, cage=self.cage, request_type='breed')
+        request.approve()
+        request.complete()
+        self.cage.refresh_from_db()
+        self.assertEqual(self.cage.occupancy, 2)
+
+        cull = Request.objects.create(requester=self.user, mouse=self.male, request_type='cull')
+        cull.approve()
+        cull.complete()
+        self.cage.refresh_from_db()
+        self.assertEqual(self.cage.occupancy, 1)
+
+    def test_completing_into_a_full_cage_changes_nothing(self):
+        request = Request.objects.create(requester=self.user, mouse=self.male, second_mouse=self.female, cage=self.cage, request_type='breed')
+        request.approve()
+        move_mice([Mouse.objects.create(strain=self.strain, tube_id=n, dob=dt.date(2023, 1, 1), sex='F', state='alive') for n in (3, 4)], self.cage)
+        with self.assertRaisesMessage(ValidationError, 'free places'):
+            request.complete()
+        request.refresh_from_db()
+        self.assertEqual(request.status, 'approved')
+        self.assertFalse(Breed.objects.exists())
+        self.assertEqual(Mouse.objects.filter(cage=self.cage).count(), 2)
+
+    def test_recount_cages(self):
+        move_mice([self.male, self.female], self.cage)
+        Cage.objects.filter(pk=self.cage.pk).update(occupancy=0)
+        Cage.objects.filter(pk=self.other.pk).update(occupancy=7)
+        recount_cages()
+        self.assertEqual(dict(Cage.objects.values_list('cage_number', 'occupancy')), {'B001': 2, 'S001': 0})
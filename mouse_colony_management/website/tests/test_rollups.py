@@ -0,0 +1,81 @@
+from django.test import TestCase
+from django.urls import reverse
+from django.core.management import call_command
+from website.models import *
+from io import StringIO
+import datetime as dt
+
+class RollupTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.user = User.objects.create_user(username='leader', email='leader@abdn.ac.uk', password='password', role='leader')
+        self.cage = Cage.objects.create(cage_number='C001', cage_type='Breeding', location='Room 101')
+        self.male = self.make(1, 'M')
+        self.female = self.make(2, 'F')
+
+    def make(self, tube_id, sex, dob=dt.date(2023, 1, 1), **parents):
+        return Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob=dob, sex=sex, state='alive', **parents)
+
+    def counts(self):
+        return {(row.state, row.sex): row.count for row in MouseCountRollup.objects.filter(count__gt=0)}
+
+    def snapshot(self):
+        return (
+            sorted(MouseCountRollup.objects.filter(count__gt=0).values_list('strain_id', 'state', 'sex', 'count')),
+            sorted(BreedingPairRollup.objects.values_list('father_id', 'mother_id', 'litters', 'pups')),
+            sorted(CageRollup.objects.filter(active_breeds__gt=0).values_list('cage_id', 'active_breeds')),
+            sorted(RequestRollup.objects.filter(count__gt=0).values_list('request_type', 'status', 'count')),
+        )
+
+    def test_mouse_counts_follow_state_changes(self):
+        self.assertEqual(self.counts(), {('alive', 'M'): 1, ('alive', 'F'): 1})
+        self.male.state = 'to_be_culled'
+        self.male.save()
+        self.assertEqual(self.counts(), {('to_be_culled', 'M'): 1, ('alive', 'F'): 1})
+        self.female.delete()
+        self.assertEqual(self.counts(), {('to_be_culled', 'M'): 1})
+
+    def test_litters_counted_per_pair(self):
+        for tube_id in (3, 4):
+            self.make(tube_id, 'F', dob=dt.date(2023, 6, 1), father=self.male, mother=self.female)
+        late = self.make(5, 'M', dob=dt.date(2023, 9, 1), father=self.male, mother=self.female)
+        pair = BreedingPairRollup.objects.get(father=self.male, mother=self.female)
+        self.assertEqual((pair.litters, pair.pups), (2, 3))
+        late.delete()
+        pair.refresh_from_db()
+        self.assertEqual((pair.litters, pair.pups), (1, 2))
+
+    def test_breeding_requests_update_cage_and_request_rollups(self):
+        request = Request.objects.create(requester=self.user, mouse=self.male, second_mouse=self.female, cage=self.cage, request_type='breed')
+        self.assertEqual(RequestRollup.objects.get(request_type='breed', status='pending').count, 1)
+        request.approve()
+        request.complete()
+        self.assertEqual(RequestRollup.objects.get(request_type='breed', status='pending').count, 0)
+        self.assertEqual(RequestRollup.objects.get(request_type='breed', status='completed').count, 1)
+        self.assertEqual(CageRollup.objects.get(cage=self.cage).active_breeds, 1)
+        self.assertEqual(self.counts(), {('breeding', 'M'): 1, ('breeding', 'F'): 1})
+
+        Breed.objects.get().end_breeding()
+        self.assertEqual(CageRollup.objects.get(cage=self.cage).active_breeds, 0)
+
+    def test_reconcile_matches_incremental(self):
+        self.make(3, 'F', dob=dt.date(2023, 6, 1), father=self.male, mother=self.female)
+        Request.objects.create(requester=self.user, mouse=self.male, second_mouse=self.female, cage=self.cage, request_type='breed').complete()
+        incremental = self.snapshot()
+        MouseCountRollup.objects.update(count=0)
+        BreedingPairRollup.objects.all().delete()
+        call_command('reconcile_rollups', stdout=StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_dashboard_reads_rollups(self):
+        Request.objects.create(requester=self.user, mouse=self.male, second_mouse=self.female, cage=self.cage, request_type='breed').complete()
+        self.client.login(username='leader', password='password')
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'dashboard.html')
+        self.assertEqual(response.context['strain_rows'][0]['total'], 2)
+        self.assertEqual(len(response.context['active_breeds']), 1)
+        self.assertContains(response, '1 of 1 cages')
+        [room] = response.context['cage_occupancy']
+        self.assertEqual((room['location'], room['cages'], room['full'], room['empty'], room['mice'], room['free']), (self.cage.location, 1, 0, 0, 2, self.cage.capacity - 2))
@@ -0,0 +1,80 @@
+from unittest import skipUnless
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import router
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from website.models import *
+from website.maintenance import stamp_replication
+from website.routers import STICKY_COOKIE, check_replicas, replica_reads
+import datetime as dt
+
+REPLICA = 'replica_test'
+
+# Added by mouse_colony_management.test_settings. Nothing copies rows to it, so
+# reads it serves miss what the tests write to the primary.
+@skipUnless(REPLICA in settings.DATABASES, "No unmirrored replica database configured.")
+@override_settings(REPLICA_DATABASES=[REPLICA], REPLICA_MAX_LAG_SECONDS=5, REPLICA_STICKY_SECONDS=10)
+class ReplicaRouterTest(TestCase):
+    databases = {alias for alias in ('default', REPLICA) if alias in settings.DATABASES}
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.mouse = Mouse.objects.create(strain=self.strain, tube_id=1, dob=dt.date(2024, 1, 1), sex='F', state='alive')
+        self.set_replica_lag(0)
+
+    def set_replica_lag(self, seconds, beat_at=None):
+        beat_at = beat_at or timezone.now()
+        ReplicationHeartbeat.objects.update_or_create(pk=1, defaults={'beat_at': beat_at})
+        ReplicationHeartbeat.objects.using(REPLICA).update_or_create(pk=1, defaults={'beat_at': beat_at - dt.timedelta(seconds=seconds)})
+        check_replicas(force=True)
+
+    def test_only_replica_reads_use_the_replica(self):
+        self.assertEqual(Mouse.objects.count(), 1)
+        with replica_reads():
+            self.assertEqual(Mouse.objects.count(), 0)
+            self.assertEqual(router.db_for_write(Mouse), 'default')
+            # Sessions must see a login at once
+            self.assertEqual(router.db_for_read(Session), 'default')
+        self.assertEqual(router.db_for_read(Mouse), 'default')
+
+    def test_a_write_sends_later_reads_to_the_primary(self):
+        with replica_reads():
+            self.assertFalse(Strain.objects.filter(name='BALB/c').exists())
+            Strain.objects.create(name='BALB/c')
+            self.assertTrue(Strain.objects.filter(name='BALB/c').exists())
+
+    def test_lagging_or_unreachable_replicas_are_skipped(self):
+        self.set_replica_lag(60)
+        with replica_reads():
+            self.assertEqual(Mouse.objects.count(), 1)
+        ReplicationHeartbeat.objects.using(REPLICA).all().delete()
+        self.assertEqual(check_replicas(force=True), {REPLICA: None})
+        with replica_reads():
+            self.assertEqual(Mouse.objects.count(), 1)
+
+    def test_lag_is_measured_between_the_heartbeats(self):
+        # A replica that copied the last beat is current however long ago it was stamped
+        self.set_replica_lag(0, beat_at=timezone.now() - dt.timedelta(hours=1))
+        self.assertEqual(check_replicas(force=True), {REPLICA: 0.0})
+        with replica_reads():
+            self.assertEqual(Mouse.objects.count(), 0)
+        self.set_replica_lag(30, beat_at=timezone.now() - dt.timedelta(hours=1))
+        self.assertEqual(check_replicas(force=True), {REPLICA: 30.0})
+        # Checks only read; the maintenance job stamps the primary
+        with self.assertNumQueries(1):
+            check_replicas(force=True)
+        stamp_replication()
+        self.assertGreater(check_replicas(force=True)[REPLICA], 3000)
+
+    def test_clients_read_their_own_writes_for_a_while(self):
+        User.objects.create_user(username='tech', email='tech@abdn.ac.uk', password='password')
+        tree = reverse('genetic_tree', args=[self.mouse.mouse_id])
+        self.assertEqual(self.client.get(tree).status_code, 404)
+        # Logging in writes last_login, which pins the client to the primary
+        response = self.client.post(reverse('login'), {'username': 'tech', 'password': 'password'})
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], 10)
+        self.assertEqual(self.client.get(tree).status_code, 200)
+        self.client.cookies.pop(STICKY_COOKIE)
+        self.assertEqual(self.client.get(reverse('api_mouse', args=[self.mouse.mouse_id])).status_code, 404)
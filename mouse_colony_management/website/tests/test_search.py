@@ -0,0 +1,90 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from website import genetics
+from website.models import *
+from website.search import rebuild_index, search
+from website.teams import TeamScope
+import datetime as dt
+
+EVERYTHING = TeamScope((), sees_everything=True)
+
+class SearchTestMixin:
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.other_strain = Strain.objects.create(name='BALB/c')
+        self.tube_123 = Mouse.objects.create(strain=self.strain, tube_id=123, dob=dt.date(2023, 1, 1), sex='F', state='alive')
+        self.tube_12 = Mouse.objects.create(strain=self.other_strain, tube_id=12, dob=dt.date(2023, 1, 1), sex='M', state='alive')
+        self.tube_45 = Mouse.objects.create(strain=self.strain, tube_id=45, dob=dt.date(2023, 1, 1), sex='M', state='breeding')
+        Phenotype.objects.create(mouse=self.tube_45, characteristic='Coat Color', description='Black')
+        rebuild_index()
+
+    def titles(self, query, scope=EVERYTHING):
+        return [result['title'] for result in search(query, scope)]
+
+    def test_prefix_matching_ranks_exact_tokens_first(self):
+        self.assertEqual(self.titles('12'), ['BALB/c tube 12', 'C57BL/6 tube 123'])
+        self.assertEqual(set(self.titles('balb')), {'BALB/c', 'BALB/c tube 12'})
+        self.assertEqual(self.titles('c57 12'), ['C57BL/6 tube 123'])
+        self.assertEqual(self.titles('coat bla'), ['C57BL/6 tube 45'])
+        self.assertEqual(self.titles(''), [])
+
+    def test_documents_follow_saves_and_deletes(self):
+        # Documents of changed mice are rebuilt when the transaction commits.
+        # That also caches the new gene's id, which the test's rollback removes.
+        self.addCleanup(genetics._dictionary.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            Genotype.objects.create(mouse=self.tube_123, gene='Apoe', allele_1='tm1', allele_2='+')
+        self.assertEqual(self.titles('apoe tm1'), ['C57BL/6 tube 123'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tube_45.state = 'deceased'
+            self.tube_45.save()
+            self.assertEqual(self.titles('deceased'), [])
+        self.assertEqual(self.titles('deceased'), ['C57BL/6 tube 45'])
+        self.strain.name = 'B6J'
+        self.strain.save()
+        self.assertEqual(set(self.titles('b6j')), {'B6J', 'B6J tube 123', 'B6J tube 45'})
+        self.assertEqual(self.titles('c57bl'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tube_45.delete()
+        self.assertEqual(self.titles('coat'), [])
+
+    def test_results_are_limited_to_the_team_scope(self):
+        lab = Team.objects.create(name='Lab A')
+        other_lab = Team.objects.create(name='Lab B')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tube_123.team = other_lab
+            self.tube_123.save()
+            self.tube_12.team = lab
+            self.tube_12.save()
+        self.assertEqual(self.titles('12', TeamScope([lab.pk])), ['BALB/c tube 12'])
+        self.assertEqual(self.titles('12', TeamScope([])), [])
+
+    def test_a_transaction_reindexes_each_mouse_once(self):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            for state in ('breeding', 'to_be_culled'):
+                self.tube_123.state = state
+                self.tube_123.save()
+            Phenotype.objects.create(mouse=self.tube_123, characteristic='Eye Color', description='Red')
+        self.assertEqual(sum('INSERT INTO "website_searchdocument"' in query['sql'] for query in queries), 1)
+        self.assertEqual(self.titles('culled red'), ['C57BL/6 tube 123'])
+
+class FTS5SearchTest(SearchTestMixin, TestCase):
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'coat'})
+        self.assertEqual(response.status_code, 302)
+        User.objects.create_user(username='tech', email='tech@abdn.ac.uk', password='password')
+        self.client.login(username='tech', password='password')
+        [result] = self.client.get(reverse('search'), {'q': 'coat'}).json()['results']
+        self.assertEqual(result['url'], reverse('genetic_tree', args=[self.tube_45.mouse_id]))
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'coat', 'limit': 'x'}).status_code, 400)
+
+@override_settings(SEARCH_BACKEND='terms')
+class TermSearchTest(SearchTestMixin, TestCase):
+
+    def test_terms_are_stored_per_document(self):
+        terms = set(SearchTerm.objects.filter(document__kind='mouse', document__object_id=self.tube_45.mouse_id).values_list('term', flat=True))
+        self.assertTrue({'45', 'c57bl', 'coat', 'color', 'black', 'breeding'} <= terms)
@@ -0,0 +1,44 @@
+from django.test import TestCase
+from website.models import *
+from website.snapshots import get_snapshot
+import datetime as dt
+
+class PedigreeSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.cross = Strain.objects.create(name='B6xDBA')
+        self.father = self.make(self.strain, 1, 'M')
+        self.mother = self.make(self.strain, 2, 'F')
+        self.pup = self.make(self.strain, 3, 'F', father=self.father, mother=self.mother)
+
+    def make(self, strain, tube_id, sex, **parents):
+        return Mouse.objects.create(strain=strain, tube_id=tube_id, dob=dt.date(2023, 1, 1), sex=sex, state='alive', **parents)
+
+    def test_snapshot_arrays(self):
+        snapshot = get_snapshot(self.strain.pk)
+        self.assertEqual(snapshot.mouse_ids.tolist(), [self.father.pk, self.mother.pk, self.pup.pk])
+        self.assertEqual(snapshot.father_ids.tolist(), [0, 0, self.father.pk])
+        self.assertEqual(snapshot.sex.tolist(), [1, 2, 2])
+        with self.assertNumQueries(1):
+            self.assertIs(get_snapshot(self.strain.pk), snapshot)
+
+    def test_save_invalidates_snapshot(self):
+        snapshot = get_snapshot(self.strain.pk)
+        self.pup.state = 'deceased'
+        self.pup.save()
+        fresh = get_snapshot(self.strain.pk)
+        self.assertIsNot(fresh, snapshot)
+        self.assertEqual(fresh.state[-1], 4)
+        # Saves that do not touch pedigree columns keep the snapshot
+        self.pup.earmark = 'TL'
+        self.pup.save()
+        self.assertIs(get_snapshot(self.strain.pk), fresh)
+
+    def test_traversal_crosses_strains(self):
+        hybrid = self.make(self.cross, 1, 'M', mother=self.pup)
+        grandpup = self.make(self.cross, 2, 'M', father=hybrid)
+        self.assertEqual([m.pk for m in self.father.get_descendants()], [self.pup.pk, hybrid.pk, grandpup.pk])
+        self.assertEqual({m.pk: m.generation for m in grandpup.get_ancestors()}, {
+            hybrid.pk: 1, self.pup.pk: 2, self.father.pk: 3, self.mother.pk: 3,
+        })
@@ -0,0 +1,75 @@
+from django.test import TestCase
+from django.urls import reverse
+from website.models import *
+from website.teams import team_scope
+import datetime as dt
+
+class TeamScopeTest(TestCase):
+
+    def setUp(self):
+        self.lab = Team.objects.create(name='Lab A')
+        self.other_lab = Team.objects.create(name='Lab B')
+        self.user = User.objects.create_user(username='tech', email='tech@abdn.ac.uk', password='password', role='staff')
+        TeamMembership.objects.create(user=self.user, team=self.lab)
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.mother = Mouse.objects.create(strain=self.strain, tube_id=1, dob=dt.date(2023, 1, 1), sex='F', state='alive', team=self.lab)
+        self.stranger = Mouse.objects.create(strain=self.strain, tube_id=2, dob=dt.date(2023, 1, 1), sex='M', state='alive', team=self.other_lab)
+        self.shared = Mouse.objects.create(strain=self.strain, tube_id=3, dob=dt.date(2023, 1, 1), sex='M', state='alive')
+
+    def fresh_user(self):
+        # A new request loads the user row again
+        return User.objects.get(pk=self.user.pk)
+
+    def test_scope_is_resolved_once_per_session(self):
+        session = {}
+        user = self.fresh_user()
+        with self.assertNumQueries(1):
+            scope = team_scope(user, session)
+        self.assertEqual(scope.team_ids, {self.lab.pk})
+        self.assertEqual(scope.role, 'staff')
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertEqual(team_scope(user, session).team_ids, {self.lab.pk})
+        # A membership change invalidates the stored scope
+        TeamMembership.objects.create(user=self.user, team=self.other_lab)
+        self.assertEqual(team_scope(self.fresh_user(), session).team_ids, {self.lab.pk, self.other_lab.pk})
+        TeamMembership.objects.filter(team=self.lab).delete()
+        self.assertEqual(team_scope(self.fresh_user(), session).team_ids, {self.other_lab.pk})
+
+    def test_querysets_are_scoped_to_the_users_teams(self):
+        visible = Mouse.objects.visible_to(team_scope(self.fresh_user(), {}))
+        self.assertEqual(set(visible), {self.mother, self.shared})
+        admin = User.objects.create_superuser(username='admin', email='admin@abdn.ac.uk', password='password')
+        self.assertEqual(Mouse.objects.visible_to(team_scope(admin)).count(), 3)
+
+    def test_pups_and_requests_inherit_the_team(self):
+        pup = Mouse.objects.create(strain=self.strain, tube_id=4, dob=dt.date(2023, 6, 1), sex='F', state='alive', mother=self.mother)
+        self.assertEqual(pup.team, self.lab)
+        request = Request.objects.create(requester=self.user, mouse=pup, request_type='cull')
+        self.assertEqual(request.team, self.lab)
+        self.assertEqual(list(Request.objects.visible_to(team_scope(self.fresh_user()))), [request])
+
+    def test_team_colony_page_and_api_are_scoped(self):
+        self.client.login(username='tech', password='password')
+        response = self.client.get(reverse('team_colony'))
+        self.assertEqual(set(response.context['mice']), {self.mother, self.shared})
+        self.assertContains(response, 'Lab A')
+        self.assertEqual(self.client.get(reverse('api_mouse', args=[self.stranger.mouse_id])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('api_mouse', args=[self.mother.mouse_id])).status_code, 200)
+
+    def test_cage_occupants_and_trees_are_scoped(self):
+        cage = Cage.objects.create(cage_number='C001', cage_type='Standard', location='Room 101')
+        for mouse in (self.mother, self.stranger):
+            mouse.cage = cage
+            mouse.save()
+        own_pup = Mouse.objects.create(strain=self.strain, tube_id=4, dob=dt.date(2023, 6, 1), sex='F', state='alive', mother=self.mother, father=self.stranger)
+        Mouse.objects.create(strain=self.strain, tube_id=5, dob=dt.date(2023, 6, 1), sex='F', state='alive', mother=self.mother, father=self.stranger, team=self.other_lab)
+        self.client.login(username='tech', password='password')
+        mice = self.client.get(reverse('api_cage', args=[cage.pk])).json()['mice']
+        self.assertEqual([mouse['mouse_id'] for mouse in mice], [self.mother.pk])
+        self.assertEqual(self.client.get(reverse('genetic_tree', args=[self.stranger.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('genetic_tree_nodes', args=[self.stranger.pk])).status_code, 404)
+        nodes = self.client.get(reverse('genetic_tree_nodes', args=[self.mother.pk])).json()['nodes']
+        self.assertEqual([node['mouse_id'] for node in nodes], [own_pup.pk])
+        response = self.client.get(reverse('genetic_tree', args=[own_pup.pk]), {'depth': 2})
+        self.assertEqual([ancestor.pk for ancestor in response.context['ancestors']], [self.mother.pk])
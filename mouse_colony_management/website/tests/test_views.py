@@ -86,20 +86,50 @@ class RegisterViewTest(TestCase):
         self.assertTemplateUsed(response, 'registration/register.html')
         self.assertFalse(User.objects.filter(username='').exists())  # User shouldn't be created
 
-# class GeneticTreeViewTest(TestCase):
+class GeneticTreeViewTest(TestCase):
 
-#     def setUp(self):
-#         self.mouse = Mouse.objects.create(
-#             
-#         )
-
-#     def test_genetic_tree_view_valid_mouse(self):
-#         response = self.client.get(reverse('genetic_tree', args=[self.mouse.mouse_id]))
-#         self.assertEqual(response.status_code, 200)
-#         self.assertTemplateUsed(response, 'genetictree.html')
-#         self.assertContains(response, 'Mouse123')
-
-#     def test_genetic_tree_view_invalid_mouse(self):
-#         response = self.client.get(reverse('genetic_tree', args=[999]))  # Non-existent mouse_id
-#         self.assertEqual(response.status_code, 404)
+    def setUp(self):
+        self.strain = Strain.objects.create(name='C57BL/6')
+        self.father = Mouse.objects.create(strain=self.strain, tube_id=1, dob='2023-01-01', sex='M', state='alive')
+        self.mouse = Mouse.objects.create(strain=self.strain, tube_id=2, dob='2024-01-01', sex='F', state='alive', father=self.father)
+        self.pup = Mouse.objects.create(strain=self.strain, tube_id=3, dob='2024-06-01', sex='M', state='alive', mother=self.mouse)
 
+    def test_genetic_tree_view_valid_mouse(self):
+        response = self.client.get(reverse('genetic_tree', args=[self.mouse.mouse_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'genetictree.html')
+        # Relatives are fetched lazily unless a depth is requested
+        self.assertIsNone(response.context['ancestors'])
+
+    def test_genetic_tree_view_depth_limit(self):
+        response = self.client.get(reverse('genetic_tree', args=[self.mouse.mouse_id]), {'depth': 2})
+        self.assertEqual(response.context['ancestors'], [self.father])
+        self.assertEqual(response.context['descendants'], [self.pup])
+        response = self.client.get(reverse('genetic_tree', args=[self.pup.mouse_id]), {'depth': 1})
+        self.assertEqual(response.context['ancestors'], [self.mouse])
+
+    def test_genetic_tree_nodes_paginates_children(self):
+        pups = [self.pup] + [
+            Mouse.objects.create(strain=self.strain, tube_id=tube_id, dob='2024-06-01', sex='F', state='alive', mother=self.mouse)
+            for tube_id in range(4, 8)
+        ]
+        url = reverse('genetic_tree_nodes', args=[self.mouse.mouse_id])
+        page = self.client.get(url, {'direction': 'children', 'limit': 3}).json()
+        self.assertEqual([node['mouse_id'] for node in page['nodes']], [pup.mouse_id for pup in pups[:3]])
+        self.assertTrue(page['nodes'][0]['has_parents'])
+        self.assertEqual(page['nodes'][0]['child_count'], 0)
+        page = self.client.get(url, {'direction': 'children', 'limit': 3, 'cursor': page['next_cursor']}).json()
+        self.assertEqual([node['mouse_id'] for node in page['nodes']], [pup.mouse_id for pup in pups[3:]])
+        self.assertIsNone(page['next_cursor'])
+
+    def test_genetic_tree_nodes_parents(self):
+        page = self.client.get(reverse('genetic_tree_nodes', args=[self.mouse.mouse_id]), {'direction': 'parents'}).json()
+        self.assertEqual(page['nodes'][0]['mouse_id'], self.father.mouse_id)
+        self.assertEqual(page['nodes'][0]['child_count'], 1)
+        self.assertFalse(page['nodes'][0]['has_parents'])
+        response = self.client.get(reverse('genetic_tree_nodes', args=[self.mouse.mouse_id]), {'direction': 'sideways'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_genetic_tree_view_invalid_mouse(self):
+        response = self.client.get(reverse('genetic_tree', args=[999]))  # Non-existent mouse_id
+        self.assertEqual(response.status_code, 404)
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.urls import path
 from django.contrib.auth import views as auth_views
-from . import views
+from . import api, views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('legal/terms-of-service/', views.terms_of_service, name='terms_of_service'), # legal
@@ -10,5 +10,22 @@ urlpatterns = [
     path('login/', auth_views.LoginView.as_view(), name='login'),  # Login page
     path('register/', views.register, name='register'), # Register page
     path('logout/', views.logout_user, name="logout_user"),
+    path('dashboard/', views.colony_dashboard, name='dashboard'), # Colony status dashboard
+    path('team/', views.team_colony, name='team_colony'), # The user's team mice, cages and requests
     path('genetic-tree/<int:mouse_id>/', views.genetic_tree, name='genetic_tree'), # Genetic Tree page
+    path('genetic-tree/<int:mouse_id>/nodes/', views.genetic_tree_nodes, name='genetic_tree_nodes'), # Lazy tree expansion (JSON)
+    path('breeding/recommendations/<int:strain_id>/', views.breeding_recommendations, name='breeding_recommendations'), # Suggested pairs (JSON)
+    path('api/mice/<int:mouse_id>/', api.mouse_detail, name='api_mouse'), # Async read API (JSON)
+    path('api/mice/<int:mouse_id>/lineage/', api.mouse_lineage, name='api_mouse_lineage'),
+    path('api/cages/', api.cage_list, name='api_cages'),
+    path('api/cages/<int:cage_id>/', api.cage_detail, name='api_cage'),
+    path('api/requests/', api.request_list, name='api_requests'),
+    path('colony/as-of/', views.colony_history, name='colony_history'), # Point-in-time colony (JSON)
+    path('search/', views.search_view, name='search'), # Typeahead search (JSON)
+    path('health/trend/', views.health_trend_view, name='health_trend'), # Health trends from the rollups (JSON)
+    path('health/observations/', views.health_observations, name='health_observations'), # Bench device readings (JSON POST)
+    path('import/', views.import_colony_view, name='import_colony'), # Bulk CSV/TSV import
+    path('export/<str:dataset>/', views.export_colony_view, name='export_colony'), # Streamed colony export
+    path('ops/metrics', views.ops_metrics, name='ops_metrics'), # Prometheus scrape target
+    path('ops/metrics/recent', views.ops_metrics_recent, name='ops_metrics_recent'), # Recent slow requests (JSON)
 ]
\ No newline at end of file
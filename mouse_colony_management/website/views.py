@@ -1,9 +1,33 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
-from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib.auth.decorators import login_required, permission_required, user_passes_test
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from .models import *
 from .forms import *
+from .health import MAX_DEVICE_READINGS, health_trend, ingest_observations, room_trend
+from .history import colony_as_of
+from .importers import import_colony
+from .breeding import parse_targets, recommend_pairs
+from .exporters import DATASETS, EXPORT_FORMATS, export_colony
+from .metrics import render_prometheus, store as metrics_store
+from .pedigree import MAX_TREE_LISTING, MAX_TREE_PAGE_SIZE, TREE_PAGE_SIZE, tree_page
+from .search import MAX_SEARCH_LIMIT, SEARCH_LIMIT, search
+from .routers import replica_reads, replica_stream
+from .teams import request_scope
+import datetime as dt
+import hmac
+import io
+import json
+
+# Colony-wide data operations are limited to team leaders (and superusers)
+leader_required = user_passes_test(lambda user: user.is_authenticated and (user.role == 'leader' or user.is_superuser))
+
+# Rows per section of the team colony page
+TEAM_LISTING = 200
 
 # Legal Boiler-plate Views
 def terms_of_service(request):
@@ -35,28 +59,247 @@ def register(request):
     return render(request, 'registration/register.html', {'form': form})
 
 # Generate genetic tree
+@replica_reads()
 def genetic_tree(request, mouse_id):
-    mouse = get_object_or_404(Mouse, mouse_id=mouse_id)
-    ancestors = mouse.get_ancestors()
-    descendants = mouse.get_descendants()
+    scope = request_scope(request)
+    mouse = get_object_or_404(Mouse.objects.visible_to(scope).select_related('strain'), mouse_id=mouse_id)
+    # The tree is expanded lazily in the browser; ?depth=N also lists N generations up front
+    try:
+        max_depth = max(int(request.GET['depth']), 1)
+    except (KeyError, ValueError):
+        max_depth = None
+    ancestors = descendants = None
+    if max_depth:
+        # Relatives of other teams are left out
+        ancestors = [relative for relative in mouse.get_ancestors(max_depth=max_depth, limit=MAX_TREE_LISTING) if scope.includes(relative.team_id)]
+        descendants = [relative for relative in mouse.get_descendants(max_depth=max_depth, limit=MAX_TREE_LISTING) if scope.includes(relative.team_id)]
 
     context = {
         'mouse': mouse,
         'ancestors': ancestors,
         'descendants': descendants,
+        'max_depth': max_depth,
+        'max_listing': MAX_TREE_LISTING,
+        'inbreeding_coefficient': mouse.get_inbreeding_coefficient(),
     }
     return render(request, 'genetictree.html', context)
 
-# @login_required
-# def dashboard(request):
-#     # Get the team of the logged-in user
-#     membership = TeamMembership.objects.get(user=request.user)
-#     team = membership.team
+# One page of a tree node's parents or children, e.g. ?direction=children&cursor=123
+@replica_reads()
+def genetic_tree_nodes(request, mouse_id):
+    scope = request_scope(request)
+    mouse = get_object_or_404(Mouse.objects.visible_to(scope), mouse_id=mouse_id)
+    direction = request.GET.get('direction', 'children')
+    if direction not in ('parents', 'children'):
+        return JsonResponse({'error': "direction must be 'parents' or 'children'."}, status=400)
+    try:
+        after = int(request.GET['cursor'])
+    except (KeyError, ValueError):
+        after = None
+    try:
+        limit = min(max(int(request.GET['limit']), 1), MAX_TREE_PAGE_SIZE)
+    except (KeyError, ValueError):
+        limit = TREE_PAGE_SIZE
+
+    nodes, next_cursor = tree_page(mouse, direction, after, limit, scope)
+    return JsonResponse({'mouse_id': mouse.mouse_id, 'direction': direction, 'nodes': nodes, 'next_cursor': next_cursor})
+
+# Constant-time check of an 'Authorization: Bearer <token>' header
+def has_bearer_token(request, token):
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode())
+
+# Operational metrics are for staff, or for a scraper presenting METRICS_TOKEN
+def metrics_allowed(request):
+    if has_bearer_token(request, getattr(settings, 'METRICS_TOKEN', '')):
+        return True
+    return request.user.is_authenticated and request.user.is_staff
+
+# Per-view latency and query counters in Prometheus text format
+def ops_metrics(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# The most recent requests, slowest first, with their slowest and repeated SQL
+def ops_metrics_recent(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    samples = sorted(metrics_store.samples(), key=lambda sample: sample.seconds, reverse=True)
+    return JsonResponse({'requests': [sample.as_dict() for sample in samples[:100]]})
+
+# Bulk upload of colony spreadsheets
+@leader_required
+def import_colony_view(request):
+    report = None
+    if request.method == 'POST':
+        form = ColonyImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            stream = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', errors='surrogateescape', newline='')
+            report = import_colony(form.cleaned_data['kind'], stream)
+            messages.success(request, f"Import finished: {report}.")
+    else:
+        form = ColonyImportForm()
+
+    return render(request, 'import_colony.html', {'form': form, 'report': report})
+
+# Streamed download of a whole dataset, e.g. /export/mice/?format=columnar
+@leader_required
+def export_colony_view(request, dataset):
+    export_format = request.GET.get('format', 'csv')
+    if dataset not in DATASETS or export_format not in EXPORT_FORMATS:
+        raise Http404("Unknown export.")
+    content_type, extension = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(replica_stream(export_colony(dataset, export_format)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{extension}"'
+    return response
+
+# Suggested new breeding pairs in a strain, e.g. ?target=Apoe:tm1/tm1&limit=10&location=Room 01
+@leader_required
+@replica_reads()
+def breeding_recommendations(request, strain_id):
+    strain = get_object_or_404(Strain, pk=strain_id)
+    try:
+        desired = parse_targets(request.GET.getlist('target'))
+        limit = min(int(request.GET.get('limit', 20)), 100)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    recommendations = recommend_pairs(strain.pk, desired, limit, request.GET.get('location'), request.GET.get('cage_type'))
+    return JsonResponse({'strain': strain.name, 'target': desired, 'pairs': [recommendation.as_dict() for recommendation in recommendations]})
+
+# The colony as it was at the end of a day, e.g. ?date=2024-03-01&strain=3&mice=1
+@leader_required
+@replica_reads()
+def colony_history(request):
+    try:
+        day = dt.date.fromisoformat(request.GET.get('date', ''))
+        strain_ids = [int(strain_id) for strain_id in request.GET.getlist('strain')] or None
+        state = colony_as_of(day, strain_ids)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    strains = dict(Strain.objects.values_list('pk', 'name'))
+    data = {
+        'as_of': state.at.isoformat(),
+        'mice': len(state),
+        'counts': [{'strain': strains.get(strain_id, strain_id), 'state': mouse_state, 'mice': count} for (strain_id, mouse_state), count in sorted(state.counts().items())],
+        'cage_occupancy': state.cage_occupancy(),
+    }
+    if request.GET.get('mice'):
+        data['rows'] = state.mice()
+    return JsonResponse(data)
+
+# Daily or weekly health trend read from the rollups, e.g. ?metric=weight&room=Room 01&period=week&start=2024-01-01
+# (or &mouse=, &cage= or &strain= ids; several ids are combined)
+@login_required
+@replica_reads()
+def health_trend_view(request):
+    metric = request.GET.get('metric', 'weight')
+    period = request.GET.get('period', 'day')
+    scope = request_scope(request)
+    try:
+        start = dt.date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = dt.date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+        if request.GET.get('room'):
+            points = room_trend(request.GET['room'], metric, period, start, end, cages=Cage.objects.visible_to(scope))
+        else:
+            kind = next((kind for kind in ('mouse', 'cage', 'strain') if kind in request.GET), None)
+            if kind is None:
+                raise ValueError("Give a mouse, cage, strain or room.")
+            ids = [int(scope_id) for scope_id in request.GET.getlist(kind)]
+            if kind == 'mouse':
+                ids = Mouse.objects.visible_to(scope).filter(pk__in=ids).values_list('pk', flat=True)
+            elif kind == 'cage':
+                ids = Cage.objects.visible_to(scope).filter(pk__in=ids).values_list('pk', flat=True)
+            points = health_trend(metric, kind, ids, period, start, end)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({'metric': metric, 'period': period, 'points': points})
+
+# Bench devices post readings as JSON with HEALTH_DEVICE_TOKEN, e.g. {"device": "balance-2",
+# "readings": [{"mouse_id": 5, "metric": "weight", "value": 24.1, "observed_at": "2024-03-01T09:30"}]}
+@csrf_exempt
+@require_POST
+def health_observations(request):
+    if not has_bearer_token(request, getattr(settings, 'HEALTH_DEVICE_TOKEN', '')):
+        return HttpResponseForbidden()
+    try:
+        payload = json.loads(request.body)
+        readings = [
+            (int(reading['mouse_id']), reading['metric'], reading['value'], dt.datetime.fromisoformat(reading['observed_at']))
+            for reading in payload['readings']
+        ]
+        if len(readings) > MAX_DEVICE_READINGS:
+            raise ValueError(f"At most {MAX_DEVICE_READINGS} readings per request.")
+        created = ingest_observations(readings, device=str(payload.get('device', ''))[:50])
+    except KeyError as error:
+        return JsonResponse({'error': f"Missing {error}."}, status=400)
+    except (TypeError, ValueError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    return JsonResponse({'received': len(readings), 'created': created})
+
+# Colony status dashboard, read entirely from the rollup tables
+@login_required
+@replica_reads()
+def colony_dashboard(request):
+    states = [key for key, _ in Mouse.STATE_CHOICES]
+    strains = {}
+    state_totals = dict.fromkeys(states, 0)
+    for row in MouseCountRollup.objects.filter(count__gt=0).values('strain__name', 'state', 'sex', 'count'):
+        strain = strains.setdefault(row['strain__name'], {'name': row['strain__name'], 'states': dict.fromkeys(states, 0), 'M': 0, 'F': 0, 'total': 0})
+        strain['states'][row['state']] += row['count']
+        strain[row['sex']] += row['count']
+        strain['total'] += row['count']
+        state_totals[row['state']] += row['count']
+    strain_rows = [dict(strain, states=[strain['states'][state] for state in states]) for strain in sorted(strains.values(), key=lambda s: s['name'])]
+
+    active_breeds = list(Breed.objects.filter(end_date__isnull=True).select_related('male', 'female', 'cage').order_by('-start_date')[:50])
+    litters = {
+        (row.father_id, row.mother_id): row
+        for row in BreedingPairRollup.objects.filter(father_id__in=[breed.male_id for breed in active_breeds], mother_id__in=[breed.female_id for breed in active_breeds])
+    }
+    performance = {
+        (row.father_id, row.mother_id): row
+        for row in PairLitterStats.objects.filter(father_id__in=[breed.male_id for breed in active_breeds], mother_id__in=[breed.female_id for breed in active_breeds])
+    }
+    for breed in active_breeds:
+        breed.litter_stats = litters.get((breed.male_id, breed.female_id))
+        breed.performance = performance.get((breed.male_id, breed.female_id))
+
+    context = {
+        'state_labels': [label for _, label in Mouse.STATE_CHOICES],
+        'state_totals': [state_totals[state] for state in states],
+        'strain_rows': strain_rows,
+        'breeding_performance': StrainLitterStats.objects.filter(litters__gt=0).select_related('strain').order_by('strain__name'),
+        'cage_count': Cage.objects.count(),
+        'cage_occupancy': Cage.objects.occupancy_by_location(),
+        'occupied_cages': CageRollup.objects.filter(active_breeds__gt=0).select_related('cage').order_by('cage__cage_number'),
+        'active_breeds': active_breeds,
+        'request_counts': RequestRollup.objects.filter(count__gt=0).order_by('request_type', 'status'),
+    }
+    return render(request, 'dashboard.html', context)
 
-#     # Filter mice based on team (assuming mice are linked to team via their father/mother)
-#     mice = Mouse.objects.filter(father__team=team) | Mouse.objects.filter(mother__team=team)
+# Ranked typeahead matches for ?q=..., e.g. ?q=coat+black&limit=10
+@login_required
+def search_view(request):
+    try:
+        limit = min(max(int(request.GET.get('limit', SEARCH_LIMIT)), 1), MAX_SEARCH_LIMIT)
+    except ValueError:
+        return JsonResponse({'error': "limit must be a whole number."}, status=400)
+    query = request.GET.get('q', '')
+    return JsonResponse({'query': query, 'results': search(query, request_scope(request), limit)})
 
-#     return render(request, 'dashboard.html', {'mice': mice, 'team': team})
+# The logged-in user's mice, cages and open requests, limited to their teams
+@login_required
+@replica_reads()
+def team_colony(request):
+    scope = request_scope(request)
+    context = {
+        'teams': Team.objects.filter(pk__in=scope.team_ids).order_by('name'),
+        'mice': Mouse.objects.visible_to(scope).exclude(state='deceased').select_related('strain', 'cage').order_by('strain__name', 'tube_id')[:TEAM_LISTING],
+        'cages': Cage.objects.visible_to(scope).order_by('cage_number')[:TEAM_LISTING],
+        'requests': Request.objects.visible_to(scope).filter(status__in=['pending', 'approved']).select_related('requester').order_by('-submitted_at')[:TEAM_LISTING],
+        'listing_limit': TEAM_LISTING,
+    }
+    return render(request, 'team_colony.html', context)
 
 # @permission_required('users.is_leader', raise_exception=True)
 # @login_required